@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+    Benchmark the visitor exclusion checks.
+
+    Compares the per-request cost of
+    :class:`flask_split.exclusion.ExclusionEngine` with matching the
+    uncompiled ``SPLIT_ROBOT_REGEX`` and scanning the list of ignored IP
+    addresses, as Flask-Split did before the engine existed.
+
+    Run with ``python benchmarks/bench_exclusion.py`` from the root of the
+    repository after installing Flask-Split.
+"""
+
+from __future__ import print_function
+
+import re
+import timeit
+
+from flask_split.exclusion import ROBOT_SIGNATURES, ExclusionEngine
+
+
+ROBOT_REGEX = r"""
+    (?i)\b(
+        Baidu|
+        Gigabot|
+        Googlebot|
+        libwww-perl|
+        lwp-trivial|
+        msnbot|
+        SiteUptime|
+        Slurp|
+        WordPress|
+        ZIBB|
+        ZyBorg
+    )\b
+"""
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) '
+    'AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Mobile/15E148 '
+    'Safari/604.1',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:121.0) '
+    'Gecko/20100101 Firefox/121.0',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; '
+    '+http://www.google.com/bot.html)',
+]
+
+#: The old implementation only supported exact addresses.
+IGNORED_ADDRESSES = ['10.0.%d.%d' % (i // 256, i % 256) for i in range(500)]
+IGNORED_NETWORKS = ['10.0.0.0/23', '192.168.0.0/16', '2001:db8::/32']
+REMOTE_ADDRESS = '203.0.113.7'
+
+
+def old_is_robot(user_agent):
+    return re.search(ROBOT_REGEX, user_agent, flags=re.VERBOSE)
+
+
+def old_is_ignored_ip_address(address):
+    return address in IGNORED_ADDRESSES
+
+
+def bench(name, statement, number=100000):
+    seconds = min(timeit.repeat(statement, number=number, repeat=3))
+    print('%-40s %8.3f us' % (name, seconds / number * 1e6))
+
+
+def main():
+    engine = ExclusionEngine(ROBOT_REGEX, ROBOT_SIGNATURES,
+                             IGNORED_NETWORKS)
+    uncached = ExclusionEngine(ROBOT_REGEX, ROBOT_SIGNATURES, cache_size=0)
+    user_agents = USER_AGENTS * 25
+
+    bench('old robot check', lambda: [
+        old_is_robot(ua) for ua in user_agents], number=1000)
+    bench('engine robot check (cached)', lambda: [
+        engine.is_robot(ua) for ua in user_agents], number=1000)
+    bench('engine robot check (uncached)', lambda: [
+        uncached.is_robot(ua) for ua in user_agents], number=1000)
+    bench('old ignored address check (500 ips)',
+          lambda: old_is_ignored_ip_address(REMOTE_ADDRESS))
+    bench('engine ignored address check (3 cidrs)',
+          lambda: engine.is_ignored_ip_address(REMOTE_ADDRESS))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,11 +9,11 @@
     :license: MIT, see LICENSE for more details.
 """
 
-from .core import ab_test, finished
+from .core import ab_test, finished, preload_experiments, register_experiment
 from .views import split
 
 
-__all__ = (ab_test, finished, split)
+__all__ = (ab_test, finished, preload_experiments, register_experiment, split)
 
 
 try:
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.aggregation
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Host-local aggregation of counter increments in a memory-mapped file
+    shared by all worker processes on a host.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+import atexit
+import errno
+import fcntl
+import logging
+import mmap
+import numbers
+import os
+import struct
+import threading
+import time
+
+from redis import ConnectionError
+
+from .models import _execute, _increment_segments
+from .monitor import mark_changed
+
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b'SPLITAGG'
+
+#: magic, number of worker slots, number of counters, number of registered
+#: counters, time of the last flush.
+_HEADER = struct.Struct('<8sIII4xd')
+
+_INT = struct.Struct('<q')
+
+# The header fields that change, written separately so that a flush and
+# the registration of a counter cannot overwrite each other's update.
+_COUNT = struct.Struct('<I')
+_COUNT_OFFSET = 16
+_FLUSHED_AT = struct.Struct('<d')
+_FLUSHED_AT_OFFSET = 24
+
+#: The maximum length of an encoded ``key\nfield`` counter name.
+NAME_SIZE = 128
+
+# The fields of segment counters join the counter, the alternative, the
+# cardinality, the dimension and the value with newlines, which the fields
+# of other counters do not contain.
+_SEGMENT_SEPARATOR = '\n'
+
+# Byte ranges of the lock file used as separate locks.
+_REGISTER_LOCK = 0
+_FLUSH_LOCK = 1
+
+
+class CounterAggregator(object):
+    """
+    Counters shared by all processes on a host through a memory-mapped file.
+
+    Every process claims a row of the file for itself and only ever writes
+    to that row, so increments need no inter-process locking.  Counter names
+    are appended to a table in the file under a file lock the first time a
+    process sees them, and are cached by the process afterwards.
+
+    At most once every `interval` seconds one process on the host wins a
+    non-blocking file lock and becomes the flusher: it sums up the rows and
+    pushes the difference to what was flushed before to Redis with
+    ``HINCRBYFLOAT``, or with the segment script for segment counters, in
+    one pipeline.  If the pipeline fails, the increments are kept and pushed
+    by the next flush.
+
+    The file should be placed on a memory-backed file system such as
+    ``/dev/shm``.
+
+    :param redis: The Redis connection to flush to.
+    :param path: The path of the counter file.  It is created if it does not
+        exist.
+    :param interval: The minimum number of seconds between flushes.
+    :param workers: The number of processes that can use the file at once.
+    :param counters: The number of distinct counters the file can hold.
+    :param mark_changes: Whether to mark the experiments whose counters are
+        flushed as changed for the :mod:`~flask_split.monitor`.
+    """
+
+    def __init__(self, redis, path, interval=1, workers=128, counters=4096,
+                 mark_changes=False):
+        self.redis = redis
+        self.path = path
+        self.interval = interval
+        self.mark_changes = mark_changes
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._with_file_lock(_REGISTER_LOCK, self._initialize, workers,
+                             counters)
+        self._map = mmap.mmap(self._fd, self._size)
+        self._indexes = {}
+        self._names = []
+        self._pid = None
+        self._row = None
+        atexit.register(self.close)
+
+    def _initialize(self, workers, counters):
+        header = os.read(self._fd, _HEADER.size)
+        if len(header) == _HEADER.size and header[:8] == _MAGIC:
+            _, workers, counters, _, _ = _HEADER.unpack(header)
+        self.workers = workers
+        self.counters = counters
+        if os.fstat(self._fd).st_size < self._size:
+            os.ftruncate(self._fd, self._size)
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            os.write(self._fd, _HEADER.pack(_MAGIC, workers, counters, 0, 0))
+
+    @property
+    def _size(self):
+        return self._matrix_offset + self.workers * self.counters * 8
+
+    @property
+    def _names_offset(self):
+        return _HEADER.size
+
+    @property
+    def _pids_offset(self):
+        return self._names_offset + self.counters * NAME_SIZE
+
+    @property
+    def _flushed_offset(self):
+        return self._pids_offset + self.workers * 8
+
+    @property
+    def _matrix_offset(self):
+        return self._flushed_offset + self.counters * 8
+
+    def _with_file_lock(self, lock, func, *args):
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, lock)
+        try:
+            return func(*args)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, lock)
+
+    def _get_count(self):
+        return _COUNT.unpack_from(self._map, _COUNT_OFFSET)[0]
+
+    def _get_flushed_at(self):
+        return _FLUSHED_AT.unpack_from(self._map, _FLUSHED_AT_OFFSET)[0]
+
+    def increment(self, key, field, amount=1, pipe=None):
+        """
+        Add `amount` to the counter `field` of the hash `key`, and flush
+        all counters to Redis if it is this process's turn.  A failed flush
+        is retried by the next one.
+
+        :param pipe: The caller's pipeline, which is not used: the flushes
+            are written with the aggregator's own connection.
+
+        :return: `False` if `amount` is not an integer or the counter does
+            not fit in the file, in which case nothing is counted and the
+            caller should write to Redis directly, or `True` otherwise.
+        """
+        if not isinstance(amount, numbers.Integral):
+            return False
+        return self._add(key, [field], amount)
+
+    def increment_segments(self, key, field, alternative_name, amount,
+                           segments, cardinality, pipe=None):
+        """
+        Add `amount` to the counter `field` of the alternative
+        `alternative_name` in each of the given segments, with the segment
+        hash at `key`, like
+        :meth:`~flask_split.models.Alternative.increment_segments`.  The
+        number of values per dimension is capped when the counters are
+        flushed.  `pipe` is not used, as in :meth:`increment`.
+
+        :return: `False` if `amount` is not an integer or the counters do
+            not fit in the file, in which case nothing is counted, or `True`
+            otherwise.
+        """
+        if not isinstance(amount, numbers.Integral):
+            return False
+        fields = [
+            _SEGMENT_SEPARATOR.join(
+                [field, alternative_name, '%d' % cardinality, dimension,
+                 value])
+            for dimension, value in sorted(segments.items())
+        ]
+        return self._add(key, fields, amount)
+
+    def _add(self, key, fields, amount):
+        with self._lock:
+            row = self._get_row()
+            indexes = [self._get_index(key, field) for field in fields]
+            if row is None or None in indexes:
+                return False
+            for index in indexes:
+                offset = (self._matrix_offset +
+                          (row * self.counters + index) * 8)
+                value, = _INT.unpack_from(self._map, offset)
+                _INT.pack_into(self._map, offset, value + amount)
+        try:
+            self.flush(force=False)
+        except ConnectionError:
+            pass
+        return True
+
+    def _get_row(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            self._pid = pid
+            self._row = self._with_file_lock(_REGISTER_LOCK, self._claim_row)
+        return self._row
+
+    def _claim_row(self):
+        free = None
+        for row in range(self.workers):
+            offset = self._pids_offset + row * 8
+            pid, = _INT.unpack_from(self._map, offset)
+            if pid == self._pid:
+                return row
+            if free is None and (pid == 0 or not _is_running(pid)):
+                free = row
+        if free is not None:
+            _INT.pack_into(self._map, self._pids_offset + free * 8, self._pid)
+        return free
+
+    def _get_index(self, key, field):
+        name = (key, field)
+        index = self._indexes.get(name)
+        if index is None:
+            self._load_names()
+            index = self._indexes.get(name)
+        if index is None:
+            index = self._with_file_lock(
+                _REGISTER_LOCK, self._register_name, key, field)
+        return index
+
+    def _load_names(self):
+        count = self._get_count()
+        for index in range(len(self._names), count):
+            offset = self._names_offset + index * NAME_SIZE
+            data = self._map[offset:offset + NAME_SIZE].rstrip(b'\0')
+            key, field = data.decode('utf-8').split('\n', 1)
+            self._names.append((key, field))
+            self._indexes[(key, field)] = index
+
+    def _register_name(self, key, field):
+        self._load_names()
+        if (key, field) in self._indexes:
+            return self._indexes[(key, field)]
+        data = ('%s\n%s' % (key, field)).encode('utf-8')
+        index = len(self._names)
+        if len(data) > NAME_SIZE or index >= self.counters:
+            return None
+        offset = self._names_offset + index * NAME_SIZE
+        self._map[offset:offset + len(data)] = data
+        _COUNT.pack_into(self._map, _COUNT_OFFSET, index + 1)
+        self._names.append((key, field))
+        self._indexes[(key, field)] = index
+        return index
+
+    def flush(self, force=True):
+        """
+        Push the counters to Redis if no other process is flushing.
+
+        :param force: If `False`, only flush if the last flush on this host
+            was at least `interval` seconds ago.
+        :return: `True` if this process flushed, or `False` otherwise.
+        """
+        if not force and time.time() - self._get_flushed_at() < self.interval:
+            return False
+        if not self._flush_lock.acquire(False):
+            return False
+        try:
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1,
+                            _FLUSH_LOCK)
+            except (IOError, OSError):
+                return False
+            try:
+                if not force and \
+                        time.time() - self._get_flushed_at() < self.interval:
+                    return False
+                self._flush()
+                return True
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, _FLUSH_LOCK)
+        finally:
+            self._flush_lock.release()
+
+    def _flush(self):
+        _FLUSHED_AT.pack_into(self._map, _FLUSHED_AT_OFFSET, time.time())
+        with self._lock:
+            self._load_names()
+            names = list(self._names)
+        count = len(names)
+        if not count:
+            return
+        fmt = '<%dq' % count
+        totals = [0] * count
+        for row in range(self.workers):
+            offset = self._matrix_offset + row * self.counters * 8
+            for index, value in enumerate(
+                    struct.unpack_from(fmt, self._map, offset)):
+                totals[index] += value
+        flushed = struct.unpack_from(fmt, self._map, self._flushed_offset)
+
+        pipe = self.redis.pipeline(transaction=False)
+        changed = set()
+        indexes = []
+        for index, (total, done) in enumerate(zip(totals, flushed)):
+            if total != done:
+                key, field = names[index]
+                if _SEGMENT_SEPARATOR in field:
+                    counter, alternative_name, cardinality, dimension, \
+                        value = field.split(_SEGMENT_SEPARATOR, 4)
+                    _increment_segments(pipe, key, counter, alternative_name,
+                                        total - done, {dimension: value},
+                                        int(cardinality))
+                else:
+                    pipe.hincrbyfloat(key, field, total - done)
+                changed.add(key.split(':', 1)[0])
+                indexes.append(index)
+        if self.mark_changes:
+            mark_changed(pipe, *sorted(changed))
+        if not len(pipe):
+            return
+        # Redis applies the commands of a pipeline that did not fail, so
+        # only the counters whose command failed are left to the next flush.
+        results = _execute(self.redis, pipe, raise_on_error=False)
+        done = list(flushed)
+        for index, result in zip(indexes, results):
+            if isinstance(result, Exception):
+                logger.warning('Could not flush %s %s: %s',
+                               names[index][0], names[index][1], result)
+            else:
+                done[index] = totals[index]
+        struct.pack_into(fmt, self._map, self._flushed_offset, *done)
+
+    def pending(self):
+        """
+        Return a dictionary mapping ``(key, field)`` tuples to the increments
+        that have not been flushed to Redis yet.
+        """
+        with self._lock:
+            self._load_names()
+            names = list(self._names)
+        result = {}
+        for index, name in enumerate(names):
+            total = sum(
+                _INT.unpack_from(
+                    self._map,
+                    self._matrix_offset + (row * self.counters + index) * 8
+                )[0]
+                for row in range(self.workers)
+            )
+            done, = _INT.unpack_from(self._map,
+                                     self._flushed_offset + index * 8)
+            if total != done:
+                result[name] = total - done
+        return result
+
+    def close(self):
+        """
+        Flush the counters to Redis and close the file.  This is done
+        automatically when the process exits.  If Redis is not available,
+        the increments are left in the file for another process to flush.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        with self._flush_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, _FLUSH_LOCK)
+            try:
+                self._flush()
+            except ConnectionError:
+                pass
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, _FLUSH_LOCK)
+        self._map.close()
+        os.close(self._fd)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.archive
+    ~~~~~~~~~~~~~~~~~~~
+
+    Archival of finished experiments into compressed snapshots.
+
+    An archived experiment's final counts and statistics are kept as one
+    zlib-compressed JSON blob in the ``experiment_archive`` hash and its live
+    keys are removed.  Its winner is kept in the small
+    ``experiment_archived_winners`` hash, from which
+    :func:`~flask_split.ab_test` keeps serving it.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+import base64
+from datetime import datetime
+import json
+import zlib
+
+from redis import WatchError
+
+from .backup import _restore, _to_record
+from .models import Experiment, _compact_key
+
+
+def archive_experiment(redis, name):
+    """
+    Archive the finished experiment `name`.
+
+    The snapshot is written and the live keys are removed in a single
+    transaction that is retried if the experiment is modified concurrently,
+    so that no conversion counted in the meantime is lost.
+
+    :return: The archived snapshot as returned by :func:`find_archived`, or
+        `None` if the experiment does not exist.
+    :raises ValueError: if the experiment has no winner.
+    """
+    while True:
+        experiments = Experiment.find_many(redis, [name], counters=False)
+        if not experiments:
+            return None
+        keys = _live_keys(experiments[0])
+        with redis.pipeline() as pipe:
+            try:
+                pipe.watch('experiment_winner', 'experiment_start_times',
+                           *keys)
+                experiments = Experiment.find_many(redis, [name])
+                if not experiments or _live_keys(experiments[0]) != keys:
+                    continue
+                snapshot = _to_snapshot(experiments[0])
+                pipe.multi()
+                pipe.unlink(*keys)
+                pipe.hdel('experiment_winner', name)
+                pipe.hdel('experiment_start_times', name)
+                pipe.srem('experiments', name)
+                pipe.hset('experiment_archive', name, _compress(snapshot))
+                pipe.hset('experiment_archived_winners', name,
+                          snapshot['winner'])
+                pipe.execute()
+                return snapshot
+            except WatchError:
+                continue
+
+
+def archive_experiments(redis, names=None, callback=None):
+    """
+    Archive all finished experiments with :func:`archive_experiment`.
+
+    :param names: The names of the experiments to archive, if not all of
+        them.  Experiments without a winner are skipped.
+    :param callback: An optional function called with the name of each
+        archived experiment.
+    :return: The number of archived experiments.
+    """
+    count = 0
+    for experiment in Experiment.find_many(redis, names, counters=False):
+        if experiment.winner is None:
+            continue
+        if archive_experiment(redis, experiment.name) is not None:
+            count += 1
+            if callback is not None:
+                callback(experiment.name)
+    return count
+
+
+def archived_winners(redis):
+    """
+    Return a dictionary mapping the names of the archived experiments to
+    their winners, without loading any snapshots.
+    """
+    return redis.hgetall('experiment_archived_winners')
+
+
+def find_archived(redis, name):
+    """
+    Return the snapshot of the archived experiment `name`, or `None` if it
+    has not been archived.
+
+    The snapshot is a dictionary in the format written by
+    :func:`~flask_split.backup.export_experiments`, with the totals, the
+    statistics of each alternative and the ``archived_at`` time added.
+    """
+    blob = redis.hget('experiment_archive', name)
+    if blob is None:
+        return None
+    return json.loads(zlib.decompress(base64.b64decode(blob)).decode('utf-8'))
+
+
+def restore_experiment(redis, name, compact=False):
+    """
+    Restore the archived experiment `name` into live keys, with the counts
+    it had when it was archived, and remove it from the archive.  The data
+    of a live experiment created with the same name since is removed.
+
+    :param compact: Whether to restore the experiment in the compact layout.
+    :return: `True` if the experiment was restored, or `False` if it has
+        not been archived.
+    """
+    snapshot = find_archived(redis, name)
+    if snapshot is None:
+        return False
+    existing = Experiment.find_many(redis, [name], counters=False)
+    pipe = redis.pipeline()
+    _restore(pipe, snapshot, existing[0] if existing else None, compact)
+    pipe.hdel('experiment_archive', name)
+    pipe.hdel('experiment_archived_winners', name)
+    pipe.execute()
+    return True
+
+
+def _live_keys(experiment):
+    """Return the keys holding `experiment` in either storage layout."""
+    name = experiment.name
+    keys = set([name, experiment.weights_key, '%s:version' % name,
+                _compact_key(name)])
+    keys.update(experiment._data_keys())
+    keys.update(alternative.key for alternative in experiment.alternatives)
+    return sorted(keys)
+
+
+def _to_snapshot(experiment):
+    if experiment.winner is None:
+        raise ValueError('%r has no winner.' % experiment.name)
+    snapshot = _to_record(experiment)
+    snapshot['archived_at'] = datetime.now().isoformat()[:19]
+    snapshot['total_participants'] = experiment.total_participants
+    snapshot['total_completed'] = experiment.total_completed
+    for record, alternative in zip(snapshot['alternatives'],
+                                   experiment.alternatives):
+        record.update({
+            'participant_count_error': alternative.participant_count_error,
+            'completed_count_error': alternative.completed_count_error,
+            'conversion_rate': alternative.conversion_rate,
+            'z_score': alternative.z_score,
+            'confidence_level': alternative.confidence_level,
+        })
+    return snapshot
+
+
+def _compress(snapshot):
+    """
+    Return `snapshot` as compressed JSON.  The compressed data is encoded in
+    base64, as the connections decode all responses as text.
+    """
+    data = json.dumps(snapshot, sort_keys=True).encode('utf-8')
+    return base64.b64encode(zlib.compress(data, 9)).decode('ascii')
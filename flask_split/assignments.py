@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.assignments
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    A server-side store of the alternatives assigned to logged-in users, so
+    that they see the same alternatives on every device.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+from .exclusion import LRUCache
+
+
+class AssignmentStore(object):
+    """
+    Stores the alternatives assigned to each user in a Redis hash
+    ``split:user:<user id>`` mapping experiment keys to alternative names.
+
+    The assignments of the most recently seen users are cached in a
+    per-process LRU cache, so that returning users are served without any
+    round trips.  The cache is updated by the writes of this process only,
+    so an assignment removed by another process may be seen until the user
+    is evicted from the cache.  New assignments never conflict, as they are
+    claimed with ``HSETNX``.
+
+    :param cache_size: The maximum number of users cached.
+    :param ttl: The number of seconds a user's assignments are kept after
+        they were last changed, or `None` to keep them forever.
+    """
+
+    def __init__(self, cache_size=1024, ttl=None):
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._cache = LRUCache(cache_size)
+
+    def key(self, user_id):
+        """Return the key of the hash holding the assignments of a user."""
+        return 'split:user:%s' % user_id
+
+    def load(self, redis, user_id, merge=None):
+        """
+        Return the assignments of `user_id` as a dictionary.
+
+        :param merge: A dictionary of assignments to add to the user's
+            assignments, e.g. the ones made before the user logged in.
+            Assignments the user already has take precedence.
+        """
+        assignments = self._cache.get(user_id)
+        missing = [
+            (key, alternative) for key, alternative in (merge or {}).items()
+            if assignments is None or key not in assignments
+        ]
+        if assignments is not None and not missing:
+            return dict(assignments)
+        pipe = redis.pipeline(transaction=False)
+        for key, alternative in missing:
+            pipe.hsetnx(self.key(user_id), key, alternative)
+        if missing:
+            self._expire(pipe, user_id)
+        pipe.hgetall(self.key(user_id))
+        assignments = pipe.execute()[-1]
+        self._cache.set(user_id, assignments)
+        return dict(assignments)
+
+    def claim(self, redis, user_id, key, alternative):
+        """
+        Assign `alternative` of the experiment with the given `key` to
+        `user_id`, unless the user has another alternative already.
+
+        :return: The alternative assigned to the user.
+        """
+        assignments = self._cache.get(user_id)
+        if assignments is not None and assignments.get(key) == alternative:
+            return alternative
+        pipe = redis.pipeline(transaction=False)
+        pipe.hsetnx(self.key(user_id), key, alternative)
+        pipe.hget(self.key(user_id), key)
+        self._expire(pipe, user_id)
+        alternative = pipe.execute()[1]
+        if assignments is not None:
+            assignments = dict(assignments)
+            assignments[key] = alternative
+            self._cache.set(user_id, assignments)
+        return alternative
+
+    def remove(self, redis, user_id, *keys):
+        """Remove the assignments of `user_id` with the given `keys`."""
+        if not keys:
+            return
+        redis.hdel(self.key(user_id), *keys)
+        assignments = self._cache.get(user_id)
+        if assignments is not None:
+            self._cache.set(user_id, dict(
+                (key, alternative)
+                for key, alternative in assignments.items()
+                if key not in keys
+            ))
+
+    def _expire(self, pipe, user_id):
+        if self.ttl:
+            pipe.expire(self.key(user_id), self.ttl)
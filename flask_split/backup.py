@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.backup
+    ~~~~~~~~~~~~~~~~~~
+
+    Streaming export and import of all experiment data.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+import csv
+import json
+from itertools import groupby
+
+from .models import Experiment, _compact_key
+
+
+#: The supported export formats.
+FORMATS = ('jsonl', 'csv')
+
+CSV_FIELDS = (
+    'experiment',
+    'version',
+    'winner',
+    'start_time',
+    'alternative',
+    'weight',
+    'participant_count',
+    'completed_count',
+)
+
+
+#: The fields holding the variances of sampled counters.  They are only
+#: exported as JSON Lines, and only when non-zero.
+VARIANCE_FIELDS = ('participant_count_variance', 'completed_count_variance')
+
+
+def iter_experiment_names(redis, chunk_size=100):
+    """
+    Iterate over the names of all experiments in chunks of at most
+    `chunk_size` names, walking the ``experiments`` set with ``SSCAN`` so
+    that the whole set is never loaded at once.
+
+    As with any ``SSCAN``, a name may be returned more than once if the set
+    is modified during the iteration.
+    """
+    chunk = []
+    for name in redis.sscan_iter('experiments', count=chunk_size):
+        chunk.append(name)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_records(redis, chunk_size=100, federation=None):
+    """
+    Iterate over the data of all experiments as dictionaries.
+
+    The experiments are fetched in chunks of `chunk_size` experiments with a
+    constant number of pipelined round trips per chunk.
+
+    :param federation: A :class:`~flask_split.federation.Federation` to
+        load the experiments of `redis` with, summing the counters of all
+        regions.
+    """
+    for names in iter_experiment_names(redis, chunk_size):
+        if federation is not None:
+            experiments = federation.find_many(names)
+        else:
+            experiments = Experiment.find_many(redis, names)
+        for experiment in experiments:
+            yield _to_record(experiment)
+
+
+def export_experiments(redis, fp, format='jsonl', chunk_size=100,
+                       federation=None):
+    """
+    Write the data of all experiments to the file object `fp`.
+
+    :param format: Either ``'jsonl'`` for one JSON object per experiment and
+        line, or ``'csv'`` for one row per alternative.
+    :param chunk_size: The number of experiments fetched from Redis at once.
+    :param federation: A federation to sum the counters of all regions
+        with, see :func:`iter_records`.
+    :return: The number of exported experiments.
+    """
+    records = iter_records(redis, chunk_size, federation)
+    if format == 'jsonl':
+        count = 0
+        for record in records:
+            fp.write(json.dumps(record, sort_keys=True) + '\n')
+            count += 1
+        return count
+    elif format == 'csv':
+        writer = csv.DictWriter(fp, CSV_FIELDS)
+        writer.writeheader()
+        count = 0
+        for record in records:
+            writer.writerows(_to_rows(record))
+            count += 1
+        return count
+    raise ValueError('Unknown format: %r' % format)
+
+
+def import_experiments(redis, fp, format='jsonl', chunk_size=100,
+                       compact=False):
+    """
+    Restore experiments from the file object `fp` written by
+    :func:`export_experiments`.
+
+    Existing experiments with the same names are overwritten, and their
+    timelines, segments and the counters of alternatives the records do not
+    have are removed.  The records are written with one pipeline per
+    `chunk_size` experiments.
+
+    :param compact: Whether to restore the experiments in the compact
+        layout.
+    :return: The number of imported experiments.
+    """
+    if format == 'jsonl':
+        records = (json.loads(line) for line in fp if line.strip())
+    elif format == 'csv':
+        records = _from_rows(csv.DictReader(fp))
+    else:
+        raise ValueError('Unknown format: %r' % format)
+
+    count = 0
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            count += _restore_many(redis, chunk, compact)
+            chunk = []
+    if chunk:
+        count += _restore_many(redis, chunk, compact)
+    return count
+
+
+def _to_record(experiment):
+    winner = experiment.winner
+    start_time = experiment.start_time
+    return {
+        'name': experiment.name,
+        'version': experiment.version,
+        'winner': winner.name if winner else None,
+        'start_time': start_time.isoformat() if start_time else None,
+        'alternatives': [
+            _to_alternative_record(alternative)
+            for alternative in experiment.alternatives
+        ],
+    }
+
+
+def _to_alternative_record(alternative):
+    record = {
+        'name': alternative.name,
+        'weight': alternative.weight,
+        'participant_count': alternative.participant_count,
+        'completed_count': alternative.completed_count,
+    }
+    for field in VARIANCE_FIELDS:
+        variance = alternative._get_value(field)
+        if variance:
+            record[field] = variance
+    return record
+
+
+def _to_rows(record):
+    for alternative in record['alternatives']:
+        yield {
+            'experiment': record['name'],
+            'version': record['version'],
+            'winner': record['winner'] or '',
+            'start_time': record['start_time'] or '',
+            'alternative': alternative['name'],
+            'weight': alternative['weight'],
+            'participant_count': alternative['participant_count'],
+            'completed_count': alternative['completed_count'],
+        }
+
+
+def _from_rows(rows):
+    for name, group in groupby(rows, key=lambda row: row['experiment']):
+        group = list(group)
+        yield {
+            'name': name,
+            'version': int(group[0]['version'] or 0),
+            'winner': group[0]['winner'] or None,
+            'start_time': group[0]['start_time'] or None,
+            'alternatives': [
+                {
+                    'name': row['alternative'],
+                    'weight': row.get('weight') or 1,
+                    'participant_count': int(row['participant_count'] or 0),
+                    'completed_count': int(row['completed_count'] or 0),
+                }
+                for row in group
+            ],
+        }
+
+
+def _restore_many(redis, records, compact=False):
+    existing = dict(
+        (experiment.name, experiment)
+        for experiment in Experiment.find_many(
+            redis, [record['name'] for record in records], counters=False)
+    )
+    pipe = redis.pipeline(transaction=False)
+    for record in records:
+        _restore(pipe, record, existing.get(record['name']), compact)
+    pipe.execute()
+    return len(records)
+
+
+def _restore(pipe, record, existing=None, compact=False):
+    name = record['name']
+    keys = [name, '%s:weights' % name, '%s:version' % name,
+            _compact_key(name)]
+    keys.extend('%s:%s' % (name, alternative['name'])
+                for alternative in record['alternatives'])
+    if existing is not None:
+        keys.extend(existing._data_keys())
+    pipe.unlink(*keys)
+    pipe.hdel('experiment_winner', name)
+    pipe.hdel('experiment_start_times', name)
+    pipe.sadd('experiments', name)
+    _write_keys(pipe, _to_keys([record], compact))
+
+
+def _to_keys(records, compact=False):
+    """
+    Return the Redis keys that store the experiments of `records` in the
+    default or the compact layout, as a dictionary mapping keys to strings,
+    lists or dictionaries for string, list and hash keys.  Entries of the
+    global ``experiment_winner`` and ``experiment_start_times`` hashes are
+    included as hashes holding only those entries.
+    """
+    keys = {}
+    for record in records:
+        name = record['name']
+        alternatives = record['alternatives']
+        if compact:
+            fields = {}
+            for index, alternative in enumerate(alternatives):
+                fields['alternative:%d' % index] = alternative['name']
+                fields['weight:%s' % alternative['name']] = \
+                    alternative.get('weight', 1)
+                for field, value in _counters(alternative).items():
+                    fields['%s:%s' % (field, alternative['name'])] = value
+            if record.get('version'):
+                fields['version'] = int(record['version'])
+            if record.get('winner'):
+                fields['winner'] = record['winner']
+            if record.get('start_time'):
+                fields['start_time'] = record['start_time']
+            keys[_compact_key(name)] = fields
+            continue
+        keys[name] = [alternative['name'] for alternative in alternatives]
+        keys['%s:weights' % name] = dict(
+            (alternative['name'], alternative.get('weight', 1))
+            for alternative in alternatives
+        )
+        for alternative in alternatives:
+            keys['%s:%s' % (name, alternative['name'])] = \
+                _counters(alternative)
+        if record.get('version'):
+            keys['%s:version' % name] = str(int(record['version']))
+        if record.get('winner'):
+            keys.setdefault('experiment_winner', {})[name] = record['winner']
+        if record.get('start_time'):
+            keys.setdefault('experiment_start_times', {})[name] = \
+                record['start_time']
+    return keys
+
+
+def _counters(alternative):
+    """Return the counters of an alternative's record."""
+    counters = {
+        'participant_count': int(alternative['participant_count']),
+        'completed_count': int(alternative['completed_count']),
+    }
+    for field in VARIANCE_FIELDS:
+        if alternative.get(field):
+            counters[field] = float(alternative[field])
+    return counters
+
+
+def _write_keys(pipe, keys, prefix=''):
+    """
+    Queue the commands writing `keys` as returned by :func:`_to_keys` into
+    `pipe`, prepending `prefix` to the keys.  Lists and hashes are merged
+    into existing keys.
+    """
+    for key, value in sorted(keys.items()):
+        if isinstance(value, list):
+            pipe.rpush(prefix + key, *value)
+        elif isinstance(value, dict):
+            pipe.hmset(prefix + key, value)
+        else:
+            pipe.set(prefix + key, value)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.bandit
+    ~~~~~~~~~~~~~~~~~~
+
+    Adaptive allocation of visitors to the alternatives of an experiment as
+    a multi-armed bandit.
+
+    The allocations are computed from the counters of the alternatives and
+    returned as weights, so that choosing an alternative for a visitor stays
+    a weighted random choice.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+import random
+
+
+#: The allocation modes.  ``'weights'`` keeps the static weights of the
+#: alternatives, ``'thompson'`` allocates visitors by Thompson sampling and
+#: ``'epsilon-greedy'`` sends most visitors to the alternative with the best
+#: conversion rate.
+ALLOCATIONS = ('weights', 'thompson', 'epsilon-greedy')
+
+
+def thompson_weights(counts, draws=1000):
+    """
+    Return the weights that allocate visitors by Thompson sampling.
+
+    The weight of each alternative is the probability that it has the best
+    conversion rate, estimated with `draws` samples from the Beta posteriors
+    of the conversion rates under a uniform prior.  Choosing alternatives
+    with these weights is equivalent to sampling the posteriors for every
+    visitor.  Each alternative keeps a weight of at least about
+    ``1 / draws``, so that none of them is abandoned for good.
+
+    :param counts: A list of ``(participant_count, completed_count)`` tuples,
+        one per alternative.
+    """
+    wins = [0] * len(counts)
+    params = [
+        (1 + max(completed, 0), 1 + max(participants - completed, 0))
+        for participants, completed in counts
+    ]
+    for _ in range(draws):
+        samples = [random.betavariate(a, b) for a, b in params]
+        wins[samples.index(max(samples))] += 1
+    return [(win + 1.0) / (draws + len(counts)) for win in wins]
+
+
+def epsilon_greedy_weights(counts, epsilon=0.1):
+    """
+    Return the weights that send a fraction `epsilon` of the visitors to a
+    random alternative and the others to the alternative with the best
+    conversion rate so far, the first one on ties.
+
+    :param counts: A list of ``(participant_count, completed_count)`` tuples,
+        one per alternative.
+    """
+    rates = [
+        float(completed) / participants if participants > 0 else 0
+        for participants, completed in counts
+    ]
+    weights = [float(epsilon) / len(counts)] * len(counts)
+    weights[rates.index(max(rates))] += 1 - epsilon
+    return weights
+
+
+def allocation_weights(allocation, counts, epsilon=0.1):
+    """
+    Return the weights of the alternatives with the given `counts` for the
+    given `allocation` mode, or `None` for static weights.
+    """
+    if allocation == 'thompson':
+        return thompson_weights(counts)
+    elif allocation == 'epsilon-greedy':
+        return epsilon_greedy_weights(counts, epsilon)
+    return None
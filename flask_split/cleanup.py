@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.cleanup
+    ~~~~~~~~~~~~~~~~~~~
+
+    Garbage collection of Redis keys that are no longer reachable from the
+    registry of experiments.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+import time
+
+from .models import COMPACT_FIELDS, _compact_key
+
+
+#: Prefixes of the fields of the hashes that hold alternatives' counters.
+COUNTER_FIELD_PREFIXES = ('participant_count', 'completed_count')
+
+#: Prefixes of the fields of the hashes that hold segmented counters.
+SEGMENT_FIELD_PREFIXES = COUNTER_FIELD_PREFIXES + ('value:', 'values:')
+
+#: Prefixes of the fields of the hashes of experiments in the compact
+#: layout.
+COMPACT_FIELD_PREFIXES = COUNTER_FIELD_PREFIXES + (
+    'alternative:', 'weight:') + COMPACT_FIELDS
+
+
+def find_dangling_experiments(redis):
+    """
+    Return the names in the ``experiments`` set whose alternatives no longer
+    exist in either storage layout.
+    """
+    names = sorted(redis.smembers('experiments'))
+    pipe = redis.pipeline(transaction=False)
+    for name in names:
+        pipe.exists(name)
+        pipe.hexists(_compact_key(name), 'alternative:0')
+    result = pipe.execute()
+    return [
+        name for index, name in enumerate(names)
+        if not result[2 * index] and not result[2 * index + 1]
+    ]
+
+
+def remove_dangling_experiments(redis, names):
+    """Remove the given names from the registry of experiments."""
+    if not names:
+        return
+    pipe = redis.pipeline(transaction=False)
+    pipe.srem('experiments', *names)
+    pipe.hdel('experiment_winner', *names)
+    pipe.hdel('experiment_start_times', *names)
+    pipe.hdel('experiment_allocations', *names)
+    pipe.execute()
+
+
+def iter_orphaned_keys(redis, batch_size=500):
+    """
+    Iterate over batches of keys that belong to no existing experiment.
+
+    The keyspace is walked with ``SCAN``, so Redis is never blocked for long.
+    A key is considered orphaned if it is either
+
+    - an ``<experiment>:version``, ``<experiment>:weights``,
+      ``<experiment>:timeline``, ``<experiment>:segments`` or
+      ``<experiment>:experiment`` key of an experiment that no longer
+      exists, or
+    - an ``<experiment>:<alternative>`` hash holding only counters, where
+      the experiment no longer exists or no longer has that alternative,
+      e.g. because it is stored in the compact layout.  Run
+      :func:`~flask_split.storage.migrate_experiments` again before
+      collecting garbage after migrating, so that such late increments are
+      not lost.
+
+    Keys of any other shape are never reported, so that unrelated data in
+    the same Redis database is left alone.
+    """
+    experiments = set(redis.smembers('experiments'))
+    alternatives = {}
+    cursor = 0
+    while True:
+        cursor, keys = redis.scan(cursor, match='*:*', count=batch_size)
+        candidates = _find_candidates(redis, keys, experiments, alternatives)
+        orphans = _check_candidates(redis, candidates, experiments,
+                                    alternatives)
+        if orphans:
+            yield orphans
+        if not int(cursor):
+            break
+
+
+def collect_garbage(redis, dry_run=False, batch_size=500, throttle=0,
+                    callback=None):
+    """
+    Find orphaned keys with :func:`iter_orphaned_keys` and remove them in
+    batches with the non-blocking ``UNLINK`` command.
+
+    :param dry_run: If `True`, the keys are only reported and not removed.
+    :param batch_size: The ``COUNT`` hint given to ``SCAN`` and thereby the
+        approximate number of keys examined per round trip.
+    :param throttle: The number of seconds to sleep between batches.
+    :param callback: An optional function called with each orphaned key.
+    :return: The number of orphaned keys found.
+    """
+    count = 0
+    for keys in iter_orphaned_keys(redis, batch_size):
+        count += len(keys)
+        if callback is not None:
+            for key in keys:
+                callback(key)
+        if not dry_run:
+            redis.unlink(*keys)
+        if throttle:
+            time.sleep(throttle)
+    return count
+
+
+def _find_candidates(redis, keys, experiments, alternatives):
+    unknown = set()
+    for key in keys:
+        name = key.split(':', 1)[0]
+        if name in experiments and name not in alternatives:
+            unknown.add(name)
+    if unknown:
+        unknown = sorted(unknown)
+        pipe = redis.pipeline(transaction=False)
+        for name in unknown:
+            pipe.lrange(name, 0, -1)
+        for name, names in zip(unknown, pipe.execute()):
+            alternatives[name] = set(names)
+
+    candidates = []
+    for key in keys:
+        name, rest = key.split(':', 1)
+        kind = rest if rest in ('version', 'weights', 'timeline', 'segments',
+                                'experiment') else 'counters'
+        if name not in experiments:
+            candidates.append((key, kind))
+        elif kind == 'counters' and rest not in alternatives[name]:
+            candidates.append((key, kind))
+    return candidates
+
+
+def _check_candidates(redis, candidates, experiments, alternatives):
+    if not candidates:
+        return []
+    # The experiments are read again along with the candidates, so that the
+    # keys of experiments created or redefined since the scan started are
+    # not mistaken for orphans.
+    names = sorted(set(key.split(':', 1)[0] for key, kind in candidates))
+    pipe = redis.pipeline(transaction=False)
+    for name in names:
+        pipe.sismember('experiments', name)
+        pipe.lrange(name, 0, -1)
+    for key, kind in candidates:
+        pipe.type(key)
+        if kind == 'version':
+            pipe.get(key)
+        else:
+            pipe.hgetall(key)
+    result = pipe.execute(raise_on_error=False)
+
+    for index, name in enumerate(names):
+        exists, current = result[2 * index], result[2 * index + 1]
+        if exists:
+            experiments.add(name)
+            if isinstance(current, list):
+                alternatives[name] = set(current)
+    result = result[2 * len(names):]
+
+    orphans = []
+    for index, (key, kind) in enumerate(candidates):
+        name, rest = key.split(':', 1)
+        if name in experiments and (
+                kind != 'counters' or rest in alternatives.get(name, ())):
+            continue
+        key_type, value = result[2 * index], result[2 * index + 1]
+        if kind == 'version':
+            if key_type == 'string' and value.isdigit():
+                orphans.append(key)
+        elif key_type != 'hash' or not value:
+            continue
+        elif kind == 'weights':
+            if all(_is_number(weight) for weight in value.values()):
+                orphans.append(key)
+        elif kind == 'segments':
+            if all(field.startswith(SEGMENT_FIELD_PREFIXES)
+                   for field in value):
+                orphans.append(key)
+        elif kind == 'experiment':
+            if all(field.startswith(COMPACT_FIELD_PREFIXES)
+                   for field in value):
+                orphans.append(key)
+        elif all(field.startswith(COUNTER_FIELD_PREFIXES) for field in value):
+            orphans.append(key)
+    return orphans
+
+
+def _is_number(value):
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.cli
+    ~~~~~~~~~~~~~~~
+
+    This module provides the ``flask split`` commands for administering
+    experiments from the command line.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+from fnmatch import fnmatchcase
+import os
+import socket
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from .archive import archive_experiments, restore_experiment
+from .backup import FORMATS, export_experiments, import_experiments
+from .cleanup import (
+    collect_garbage,
+    find_dangling_experiments,
+    remove_dangling_experiments
+)
+from .events import consume as consume_events, create_group
+from .models import Experiment
+from .monitor import SignificanceMonitor, post_webhook
+from .signals import _send, experiment_deleted, experiment_reset, winner_set
+from .storage import LAYOUTS, memory_report, migrate_experiments
+from .utils import (
+    _get_aggregator,
+    _get_federation,
+    _get_redis_connection,
+    _get_state,
+    _use_compact_layout
+)
+
+
+cli = AppGroup('split', help='Administer Flask-Split experiments.')
+
+
+def _find_experiments(redis, patterns, counters=False, federation=None):
+    """
+    Return the experiments whose name matches any of the given glob
+    `patterns`, loaded with a constant number of round trips, and merged
+    from all regions by `federation` if one is given.
+    """
+    names = [
+        name for name in sorted(redis.smembers('experiments'))
+        if any(fnmatchcase(name, pattern) for pattern in patterns)
+    ]
+    if federation is not None:
+        experiments = federation.find_many(names, counters=counters)
+        _report_unavailable(federation)
+        return experiments
+    return Experiment.find_many(redis, names, counters=counters)
+
+
+def _report_unavailable(federation):
+    if federation.unavailable:
+        click.echo('Left out the regions that could not be read: %s' %
+                   ', '.join(federation.unavailable), err=True)
+
+
+def _format_count(count, error):
+    if error:
+        return '~%d+-%d' % (count, error)
+    return str(count)
+
+
+def _confirm(action, experiments, yes):
+    if not experiments:
+        click.echo('No matching experiments.')
+        return False
+    if yes:
+        return True
+    for experiment in experiments:
+        click.echo(experiment.name)
+    return click.confirm(
+        '%s %d experiment(s)?' % (action, len(experiments)))
+
+
+@cli.command('list')
+@click.argument('patterns', nargs=-1)
+def list_experiments(patterns):
+    """List the experiments matching the glob PATTERNS."""
+    redis = _get_redis_connection()
+    for experiment in _find_experiments(redis, patterns or ['*']):
+        winner = experiment.winner
+        click.echo('%s\tv%d\t%s\t%s' % (
+            experiment.name,
+            experiment.version,
+            ','.join(experiment.alternative_names),
+            winner.name if winner else '-',
+        ))
+
+
+@cli.command('stats')
+@click.argument('patterns', nargs=-1)
+def stats(patterns):
+    """Show the statistics of the experiments matching the glob PATTERNS."""
+    redis = _get_redis_connection()
+    experiments = _find_experiments(redis, patterns or ['*'], counters=True,
+                                    federation=_get_federation())
+    for experiment in experiments:
+        winner = experiment.winner
+        click.echo('%s (v%d%s)' % (
+            experiment.name,
+            experiment.version,
+            ', winner: %s' % winner.name if winner else ''
+        ))
+        for alternative in experiment.alternatives:
+            click.echo('  %-20s %10s %10s %8.2f%%  %s' % (
+                alternative.name,
+                _format_count(alternative.participant_count,
+                              alternative.participant_count_error),
+                _format_count(alternative.completed_count,
+                              alternative.completed_count_error),
+                alternative.conversion_rate * 100,
+                'control' if alternative.is_control
+                else alternative.confidence_level
+            ))
+
+
+@cli.command('reset')
+@click.argument('patterns', nargs=-1, required=True)
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def reset(patterns, yes):
+    """Delete all data of the experiments matching the glob PATTERNS."""
+    redis = _get_redis_connection()
+    experiments = _find_experiments(redis, patterns)
+    if not _confirm('Reset', experiments, yes):
+        return
+    pipe = redis.pipeline()
+    for experiment in experiments:
+        experiment.reset(pipe)
+    pipe.execute()
+    for experiment in experiments:
+        _send(experiment_reset, experiment=experiment)
+    click.echo('Reset %d experiment(s).' % len(experiments))
+
+
+@cli.command('delete')
+@click.argument('patterns', nargs=-1, required=True)
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def delete(patterns, yes):
+    """Delete the experiments matching the glob PATTERNS."""
+    redis = _get_redis_connection()
+    experiments = _find_experiments(redis, patterns)
+    if not _confirm('Delete', experiments, yes):
+        return
+    pipe = redis.pipeline()
+    for experiment in experiments:
+        experiment.delete(pipe)
+    pipe.execute()
+    for experiment in experiments:
+        _send(experiment_deleted, experiment=experiment)
+    click.echo('Deleted %d experiment(s).' % len(experiments))
+
+
+@cli.command('set-winner')
+@click.argument('pattern')
+@click.argument('alternative')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def set_winner(pattern, alternative, yes):
+    """
+    Mark ALTERNATIVE as the winner of the experiments matching the glob
+    PATTERN.  Experiments that do not have such an alternative are skipped.
+    """
+    redis = _get_redis_connection()
+    experiments = [
+        experiment for experiment in _find_experiments(redis, [pattern])
+        if alternative in experiment.alternative_names
+    ]
+    if not _confirm('Set the winner of', experiments, yes):
+        return
+    pipe = redis.pipeline()
+    for experiment in experiments:
+        experiment.set_winner(alternative, pipe)
+    pipe.execute()
+    for experiment in experiments:
+        _send(winner_set, experiment=experiment, alternative=alternative)
+    click.echo('Set the winner of %d experiment(s).' % len(experiments))
+
+
+@cli.command('set-weights')
+@click.argument('pattern')
+@click.argument('weights', nargs=-1, required=True)
+def set_weights(pattern, weights):
+    """
+    Change the weights of alternatives of the experiments matching the glob
+    PATTERN without resetting them.  WEIGHTS are given as ALTERNATIVE=WEIGHT
+    pairs, e.g. ``control=90 new=10``.
+    """
+    try:
+        weights = dict(weight.rsplit('=', 1) for weight in weights)
+    except ValueError:
+        raise click.BadParameter('Expected ALTERNATIVE=WEIGHT pairs.')
+    redis = _get_redis_connection()
+    experiments = _find_experiments(redis, [pattern])
+    pipe = redis.pipeline()
+    for experiment in experiments:
+        try:
+            experiment.set_weights(weights, pipe)
+        except ValueError as e:
+            raise click.ClickException('%s: %s' % (experiment.name, e))
+    pipe.execute()
+    click.echo('Changed the weights of %d experiment(s).' % len(experiments))
+
+
+@cli.command('archive')
+@click.argument('patterns', nargs=-1, required=True)
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def archive(patterns, yes):
+    """
+    Archive the finished experiments matching the glob PATTERNS into
+    compressed snapshots and remove their live data.  Experiments without a
+    winner are skipped.
+    """
+    redis = _get_redis_connection()
+    experiments = [
+        experiment for experiment in _find_experiments(redis, patterns)
+        if experiment.winner
+    ]
+    if not _confirm('Archive', experiments, yes):
+        return
+    count = archive_experiments(
+        redis, [experiment.name for experiment in experiments])
+    click.echo('Archived %d experiment(s).' % count)
+
+
+@cli.command('restore')
+@click.argument('names', nargs=-1, required=True)
+def restore(names):
+    """Restore the archived experiments NAMES into live experiments."""
+    redis = _get_redis_connection()
+    count = 0
+    for name in names:
+        if restore_experiment(redis, name, _use_compact_layout()):
+            count += 1
+        else:
+            click.echo('%s has not been archived.' % name, err=True)
+    click.echo('Restored %d experiment(s).' % count)
+
+
+@cli.command('gc')
+@click.option('--dry-run', is_flag=True,
+    help='Only report what would be removed.')
+@click.option('--batch-size', type=int, default=500,
+    help='The number of keys examined per SCAN call.')
+@click.option('--throttle', type=float, default=0,
+    help='The number of seconds to sleep between batches.')
+def gc(dry_run, batch_size, throttle):
+    """
+    Remove data that is no longer reachable from any experiment.
+
+    This removes registry entries of experiments whose alternatives list no
+    longer exists, and unlinks version keys and counters left behind by
+    deleted experiments and removed alternatives.
+    """
+    redis = _get_redis_connection()
+    dangling = find_dangling_experiments(redis)
+    for name in dangling:
+        click.echo(name)
+    if not dry_run:
+        remove_dangling_experiments(redis, dangling)
+    count = collect_garbage(redis, dry_run, batch_size, throttle, click.echo)
+    click.echo('%s %d dangling experiment(s) and %d orphaned key(s).' % (
+        'Found' if dry_run else 'Removed', len(dangling), count))
+
+
+@cli.command('flush')
+def flush():
+    """
+    Push the counters aggregated on this host to Redis.  This requires the
+    SPLIT_AGGREGATION_PATH setting.
+    """
+    aggregator = _get_aggregator()
+    if aggregator is None:
+        raise click.ClickException('SPLIT_AGGREGATION_PATH is not set.')
+    pending = aggregator.pending()
+    aggregator.flush()
+    click.echo('Flushed %d counter(s).' % len(pending))
+
+
+@cli.command('consume')
+@click.option('--group', default='split',
+    help='The name of the consumer group.')
+@click.option('--consumer', default=None,
+    help='The name of this consumer.  Defaults to the host name and PID.')
+@click.option('--batch-size', type=int, default=500,
+    help='The maximum number of events aggregated at once.')
+@click.option('--block', type=int, default=5000,
+    help='The number of milliseconds to wait for new events.')
+@click.option('--claim-after', type=int, default=60000,
+    help='The number of milliseconds after which the unacknowledged events '
+         'of other consumers are claimed.')
+@click.option('--once', is_flag=True,
+    help='Exit when there are no more events instead of waiting.')
+def consume(group, consumer, batch_size, block, claim_after, once):
+    """
+    Aggregate the events of the SPLIT_EVENT_STREAM stream into the counters.
+
+    Run any number of consumers in the same group to share the load.
+    """
+    key = current_app.config['SPLIT_EVENT_STREAM']
+    if not key:
+        raise click.ClickException('SPLIT_EVENT_STREAM is not set.')
+    if consumer is None:
+        consumer = '%s-%d' % (socket.gethostname(), os.getpid())
+    redis = _get_redis_connection()
+    create_group(redis, key, group)
+    total = 0
+    try:
+        while True:
+            count = consume_events(redis, key, group, consumer, batch_size,
+                                   None if once else block,
+                                   current_app.config['SPLIT_MONITOR'],
+                                   claim_after)
+            total += count
+            if once and not count:
+                break
+    except KeyboardInterrupt:
+        pass
+    click.echo('Consumed %d event(s).' % total)
+
+
+@cli.command('monitor')
+@click.option('--interval', type=float, default=None,
+    help='The number of seconds between runs.  Defaults to '
+         'SPLIT_MONITOR_INTERVAL.')
+@click.option('--webhook', default=None,
+    help='A URL to post the results to as JSON.  Defaults to '
+         'SPLIT_MONITOR_WEBHOOK.')
+@click.option('--once', is_flag=True, help='Run once and exit.')
+def monitor(interval, webhook, once):
+    """
+    Notify when an alternative becomes significantly better or worse than
+    the control.
+
+    Only the experiments whose counters changed since the last run are
+    evaluated, which requires the SPLIT_MONITOR setting.  Each result is
+    printed and passed to SPLIT_MONITOR_CALLBACK and the webhook.
+    """
+    config = current_app.config
+    if interval is None:
+        interval = config['SPLIT_MONITOR_INTERVAL']
+    callbacks = [_echo_result]
+    if config['SPLIT_MONITOR_CALLBACK'] is not None:
+        callbacks.append(config['SPLIT_MONITOR_CALLBACK'])
+    webhook = webhook or config['SPLIT_MONITOR_WEBHOOK']
+    if webhook:
+        callbacks.append(post_webhook(webhook))
+
+    def callback(result):
+        for function in callbacks:
+            function(result)
+
+    significance_monitor = SignificanceMonitor(
+        _get_redis_connection(), callback,
+        config['SPLIT_MONITOR_Z_SCORE'],
+        config['SPLIT_MONITOR_MIN_PARTICIPANTS'])
+    try:
+        while True:
+            try:
+                significance_monitor.run()
+            except Exception as e:
+                if once:
+                    raise
+                click.echo('Monitor run failed: %s' % e, err=True)
+            if once:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command('allocate')
+@click.option('--interval', type=float, default=None,
+    help='The number of seconds between runs.  Defaults to '
+         'SPLIT_BANDIT_INTERVAL.')
+@click.option('--once', is_flag=True, help='Run once and exit.')
+def allocate(interval, once):
+    """
+    Recompute the weights of the registered experiments with an adaptive
+    allocation from their counters.
+
+    The application processes pick up the new weights when they reload the
+    experiments, within SPLIT_CACHE_TTL seconds.
+    """
+    if interval is None:
+        interval = current_app.config['SPLIT_BANDIT_INTERVAL']
+    registry = _get_state(current_app)['registry']
+    redis = _get_redis_connection()
+    try:
+        while True:
+            try:
+                allocations = registry.allocate(redis, _use_compact_layout())
+            except Exception as e:
+                if once:
+                    raise
+                click.echo('Allocation failed: %s' % e, err=True)
+            else:
+                for name, weights in sorted(allocations.items()):
+                    click.echo('%s: %s' % (name, ', '.join(
+                        '%s %.3f' % (alternative, weight)
+                        for alternative, weight in sorted(weights.items())
+                    )))
+            if once:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def _echo_result(result):
+    click.echo('%s: %s vs. %s, %s (z-score %.3f)' % (
+        result['experiment'],
+        result['alternative'],
+        result['control'],
+        result['confidence_level'],
+        result['z_score'],
+    ))
+
+
+@cli.command('export')
+@click.option('-o', '--output', type=click.File('w'), default='-',
+    help='The file to write to.  Defaults to standard output.')
+@click.option('--format', type=click.Choice(FORMATS), default='jsonl',
+    help='The export format.')
+@click.option('--chunk-size', type=int, default=100,
+    help='The number of experiments fetched from Redis at once.')
+@click.option('--local', is_flag=True,
+    help='Export the counters of this region only, e.g. for importing them '
+         'back.  By default the counters of all SPLIT_FEDERATION_URLS are '
+         'summed.')
+def export(output, format, chunk_size, local):
+    """Export the data of all experiments."""
+    redis = _get_redis_connection()
+    federation = None if local else _get_federation()
+    count = export_experiments(redis, output, format, chunk_size, federation)
+    if federation is not None:
+        _report_unavailable(federation)
+    click.echo('Exported %d experiment(s).' % count, err=True)
+
+
+@cli.command('import')
+@click.argument('input', type=click.File('r'))
+@click.option('--format', type=click.Choice(FORMATS), default='jsonl',
+    help='The import format.')
+@click.option('--chunk-size', type=int, default=100,
+    help='The number of experiments written to Redis at once.')
+def import_(input, format, chunk_size):
+    """Import experiments exported with the export command."""
+    redis = _get_redis_connection()
+    count = import_experiments(redis, input, format, chunk_size,
+                               _use_compact_layout())
+    click.echo('Imported %d experiment(s).' % count)
+
+
+@cli.command('migrate')
+@click.option('--to', 'layout', type=click.Choice(LAYOUTS), default=None,
+    help='The layout to migrate to.  Defaults to SPLIT_STORAGE_LAYOUT.')
+@click.option('--settle', type=float, default=None,
+    help='The number of seconds to wait before folding in increments that '
+         'were written in the old layout.  Defaults to SPLIT_CACHE_TTL + 1.')
+@click.option('--throttle', type=float, default=0,
+    help='The number of seconds to sleep between chunks of experiments.')
+def migrate(layout, settle, throttle):
+    """
+    Convert all experiments to another storage layout while the application
+    keeps serving requests.
+
+    After converting, the command waits until the processes that loaded
+    experiments before the conversion have reloaded them, and then folds
+    their late increments into the new layout.
+    """
+    if layout is None:
+        layout = current_app.config['SPLIT_STORAGE_LAYOUT']
+    if settle is None:
+        settle = current_app.config['SPLIT_CACHE_TTL'] + 1
+    compact = layout == 'compact'
+    redis = _get_redis_connection()
+    count = migrate_experiments(redis, compact, throttle)
+    click.echo('Migrated %d experiment(s) to the %s layout.' % (
+        count, layout))
+    if count and settle:
+        time.sleep(settle)
+        count = migrate_experiments(redis, compact, throttle)
+        click.echo('Folded late increments into %d experiment(s).' % count)
+
+
+@cli.command('memory')
+@click.option('--sample', type=int, default=100,
+    help='The number of experiments to measure.')
+def memory(sample):
+    """Compare the memory used by the storage layouts."""
+    redis = _get_redis_connection()
+    report = memory_report(redis, sample)
+    experiments = report['experiments']
+    if not experiments:
+        click.echo('No experiments.')
+        return
+    click.echo('Measured %d experiment(s).' % experiments)
+    click.echo('%-10s %8s %12s %16s' % (
+        'layout', 'keys', 'bytes', 'bytes/experiment'))
+    for layout in LAYOUTS:
+        click.echo('%-10s %8d %12d %16.1f' % (
+            layout,
+            report[layout]['keys'],
+            report[layout]['bytes'],
+            report[layout]['bytes'] / float(experiments),
+        ))
+    keys, compact = report['keys']['bytes'], report['compact']['bytes']
+    if keys:
+        click.echo('The compact layout uses %.0f%% %s memory.' % (
+            abs(keys - compact) * 100.0 / keys,
+            'less' if compact <= keys else 'more'))
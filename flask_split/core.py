@@ -9,13 +9,36 @@
     :license: MIT, see LICENSE for more details.
 """
 
-import re
+import random
 
-from flask import current_app, request, session
+from flask import current_app, g, request, session
 from redis import ConnectionError
-
-from .models import Alternative, Experiment
-from .utils import _get_redis_connection
+from redis.client import Pipeline
+
+from .exclusion import ROBOT_SIGNATURES
+from .models import Alternative, Experiment, _execute
+from .registry import (
+    ExperimentRegistry,
+    _parse_options,
+    _validate_fraction
+)
+from .signals import (
+    _send,
+    alternative_assigned,
+    conversion_tracked,
+    experiment_started
+)
+from .storage import LAYOUTS
+from .tracing import annotate, traced
+from .utils import (
+    _get_aggregator,
+    _get_assignment_store,
+    _get_exclusion_engine,
+    _get_redis_connection,
+    _get_state,
+    _get_visitor_id,
+    _use_compact_layout
+)
 from .views import split
 
 
@@ -28,9 +51,37 @@ def init_app(state):
     """
     app = state.app
 
+    app.config.setdefault('SPLIT_AGGREGATION_INTERVAL', 1)
+    app.config.setdefault('SPLIT_AGGREGATION_PATH', None)
     app.config.setdefault('SPLIT_ALLOW_MULTIPLE_EXPERIMENTS', False)
+    app.config.setdefault('SPLIT_ASSIGNMENT_MAX_AGE', 300)
+    app.config.setdefault('SPLIT_BANDIT_INTERVAL', 60)
+    app.config.setdefault('SPLIT_BEACON_MAX_EVENTS', 50)
+    app.config.setdefault('SPLIT_BEACON_MAX_CONTENT_LENGTH', 16 * 1024)
+    app.config.setdefault('SPLIT_BEACON_RATE_LIMIT', (30, 60))
+    app.config.setdefault('SPLIT_CACHE_TTL', 5)
+    app.config.setdefault('SPLIT_EXPERIMENTS', {})
+    app.config.setdefault('SPLIT_EVENT_STREAM', None)
+    app.config.setdefault('SPLIT_EVENT_STREAM_MAXLEN', 100000)
     app.config.setdefault('SPLIT_DB_FAILOVER', False)
+    app.config.setdefault('SPLIT_FEDERATION_TIMEOUT', 2)
+    app.config.setdefault('SPLIT_FEDERATION_URLS', [])
     app.config.setdefault('SPLIT_IGNORE_IP_ADDRESSES', [])
+    app.config.setdefault('SPLIT_MONITOR', False)
+    app.config.setdefault('SPLIT_MONITOR_CALLBACK', None)
+    app.config.setdefault('SPLIT_MONITOR_INTERVAL', 60)
+    app.config.setdefault('SPLIT_MONITOR_MIN_PARTICIPANTS', 100)
+    app.config.setdefault('SPLIT_MONITOR_WEBHOOK', None)
+    app.config.setdefault('SPLIT_MONITOR_Z_SCORE', 1.96)
+    app.config.setdefault('SPLIT_SEGMENTS', {})
+    app.config.setdefault('SPLIT_SEGMENT_CARDINALITY', 20)
+    app.config.setdefault('SPLIT_SIGNAL_QUEUE_SIZE', 1000)
+    app.config.setdefault('SPLIT_SIGNAL_WORKERS', 0)
+    app.config.setdefault('SPLIT_STORAGE_LAYOUT', 'keys')
+    app.config.setdefault('SPLIT_USER_CACHE_SIZE', 1024)
+    app.config.setdefault('SPLIT_USER_ID', None)
+    app.config.setdefault('SPLIT_USER_TTL', None)
+    app.config.setdefault('SPLIT_ROBOT_CACHE_SIZE', 1024)
     app.config.setdefault('SPLIT_ROBOT_REGEX', r"""
         (?i)\b(
             Baidu|
@@ -46,6 +97,28 @@ def init_app(state):
             ZyBorg
         )\b
     """)
+    app.config.setdefault('SPLIT_ROBOT_SIGNATURES', list(ROBOT_SIGNATURES))
+    _get_exclusion_engine(app)
+
+    if app.config['SPLIT_STORAGE_LAYOUT'] not in LAYOUTS:
+        raise ValueError('Unknown storage layout: %r' %
+                         app.config['SPLIT_STORAGE_LAYOUT'])
+
+    registry = ExperimentRegistry(app.config['SPLIT_CACHE_TTL'])
+    for name, definition in app.config['SPLIT_EXPERIMENTS'].items():
+        if isinstance(definition, dict):
+            options = dict(definition)
+            registry.register(name, *options.pop('alternatives'), **options)
+        else:
+            registry.register(name, *definition)
+    _get_state(app)['registry'] = registry
+    if len(registry):
+        with app.app_context():
+            preload_experiments()
+
+    if hasattr(app, 'cli'):
+        from .cli import cli
+        app.cli.add_command(cli)
 
     app.jinja_env.globals.update({
         'ab_test': ab_test,
@@ -61,7 +134,51 @@ def init_app(state):
             return "%d%%" % round(number)
 
 
-def ab_test(experiment_name, *alternatives):
+def register_experiment(experiment_name, *alternatives, **options):
+    """
+    Declare an experiment up front.
+
+    Registered experiments are created in Redis by
+    :func:`preload_experiments`, or lazily on first use, and their
+    definitions are then served from memory.  After that they can be started
+    with just their name: ``ab_test(experiment_name)``.
+
+    Experiments can also be registered with the ``SPLIT_EXPERIMENTS``
+    setting, in which case they are preloaded when the blueprint is
+    registered.
+
+    :param experiment_name: Name of the experiment.
+    :param alternatives: The alternatives of the experiment, in the same
+        form as given to :func:`ab_test`.
+    :param options: The `traffic` and `sample_rate` options, as with
+        :func:`ab_test`, and the `allocation` mode of the experiment:
+        ``'weights'`` for the static weights of the alternatives, or
+        ``'thompson'`` or ``'epsilon-greedy'`` for allocating visitors
+        adaptively, with the `epsilon` fraction of visitors that explore the
+        alternatives at random in the latter.  Experiments given the same
+        `layer` name are mutually exclusive, see :ref:`layers`.
+    """
+    _get_registry().register(experiment_name, *alternatives, **options)
+
+
+def preload_experiments():
+    """
+    Validate and create all registered experiments in Redis and load them
+    into memory with a single pipeline.
+
+    Call this at application startup after registering experiments with
+    :func:`register_experiment`, e.g. before a preforking server such as
+    gunicorn forks its workers, so that no request has to load them.
+    """
+    redis = _get_redis_connection()
+    try:
+        _get_registry().refresh(redis, _use_compact_layout())
+    except ConnectionError:
+        if not current_app.config['SPLIT_DB_FAILOVER']:
+            raise
+
+
+def ab_test(experiment_name, *alternatives, **options):
     """
     Start a new A/B test.
 
@@ -74,11 +191,51 @@ def ab_test(experiment_name, *alternatives):
         string or a two-tuple of the form (alternative name, weight).  By
         default each alternative has the weight of 1.  The first alternative
         is the control.  Every experiment must have at least  two alternatives.
+        The alternatives can be omitted for experiments registered with
+        :func:`register_experiment`.
+    :param traffic: The fraction of visitors that take part in the
+        experiment, between 0 and 1.  The other visitors are shown the
+        control without being counted or written to Redis, and keep seeing
+        it until the experiment is reset.  Defaults to 1.
+    :param sample_rate: The probability with which a participation is
+        written to Redis, between 0 and 1.  Recorded participations are
+        weighted by ``1 / sample_rate``, so the participant counts become
+        estimates with error bounds.  Defaults to 1.
+
+    For registered experiments the options are part of their registered
+    definition instead.
+    """
+    return _ab_test(experiment_name, alternatives, _parse_options(options))
+
+
+@traced('ab_test')
+def _ab_test(experiment_name, alternatives, options, experiment=None):
+    """
+    Implement :func:`ab_test`.
+
+    :param experiment: The experiment if it is already loaded, in which case
+        `alternatives` are its alternative names.
     """
     redis = _get_redis_connection()
+    registry = _get_registry()
     try:
-        experiment = Experiment.find_or_create(
-            redis, experiment_name, *alternatives)
+        if experiment is not None:
+            annotate(cache_hit=True)
+        elif experiment_name in registry:
+            if alternatives and _alternative_names(alternatives) != \
+                    registry.alternative_names(experiment_name):
+                raise ValueError(
+                    'The alternatives of %r differ from its registered '
+                    'definition.' % experiment_name)
+            annotate(cache_hit=registry.is_fresh())
+            experiment = registry.get(
+                redis, experiment_name, _use_compact_layout())
+            options = registry.options(experiment_name)
+        else:
+            annotate(cache_hit=False)
+            experiment = Experiment.find_or_create(
+                redis, experiment_name, *alternatives,
+                compact=_use_compact_layout())
         if experiment.winner:
             return experiment.winner.name
         else:
@@ -87,25 +244,82 @@ def ab_test(experiment_name, *alternatives):
             if forced_alternative:
                 return forced_alternative
             _clean_old_versions(experiment)
+            if not _in_layer_slot(experiment):
+                return experiment.control.name
+            if _sampled_out(experiment, options['traffic']):
+                return experiment.control.name
             if (_exclude_visitor() or
                     _not_allowed_to_test(experiment.key)):
                 _begin_experiment(experiment)
+                return _get_session()[experiment.key]
 
             alternative_name = _get_session().get(experiment.key)
             if alternative_name:
+                _send(alternative_assigned, experiment=experiment,
+                      alternative=alternative_name)
                 return alternative_name
             alternative = experiment.next_alternative()
-            alternative.increment_participation()
+            claimed = _claim_assignment(experiment, alternative.name)
+            if claimed != alternative.name:
+                # The user was assigned an alternative on another device.
+                _begin_experiment(experiment, claimed)
+                _send(alternative_assigned, experiment=experiment,
+                      alternative=claimed)
+                return claimed
+            _increment(redis, alternative, 'participant_count',
+                       options['sample_rate'])
             _begin_experiment(experiment, alternative.name)
+            _send(experiment_started, experiment=experiment,
+                  alternative=alternative.name)
+            _send(alternative_assigned, experiment=experiment,
+                  alternative=alternative.name)
             return alternative.name
     except ConnectionError:
         if not current_app.config['SPLIT_DB_FAILOVER']:
             raise
-        control = alternatives[0]
-        return control[0] if isinstance(control, tuple) else control
+        annotate(failover=True)
+        if experiment_name in registry:
+            return registry.alternative_names(experiment_name)[0]
+        return _alternative_names(alternatives)[0]
+
+
+def _ab_test_many(names):
+    """
+    Return the alternatives of several experiments for the current visitor,
+    as :func:`ab_test` would, in a dictionary mapping the names to the
+    alternatives or to `None` for experiments that do not exist.
+
+    Registered experiments are served by the registry and the others are
+    loaded with one bulk read, without creating any experiments.
+    """
+    registry = _get_registry()
+    others = [name for name in names if name not in registry]
+    try:
+        experiments = dict(
+            (experiment.name, experiment)
+            for experiment in Experiment.find_many(
+                _get_redis_connection(), others, counters=False)
+        )
+    except ConnectionError:
+        if not current_app.config['SPLIT_DB_FAILOVER']:
+            raise
+        experiments = {}
+    options = _parse_options({})
+    assignments = {}
+    for name in names:
+        experiment = experiments.get(name)
+        if name in registry:
+            assignments[name] = _ab_test(name, (), options)
+        elif experiment:
+            assignments[name] = _ab_test(
+                name, experiment.alternative_names, options, experiment)
+        else:
+            assignments[name] = None
+    return assignments
 
 
-def finished(experiment_name, reset=True):
+@traced('finished')
+def finished(experiment_name, reset=True, sample_rate=None):
     """
     Track a conversion.
 
@@ -113,33 +327,209 @@ def finished(experiment_name, reset=True):
     :param reset: If set to `True` current user's session is reset so that they
         may start the test again in the future.  If set to `False` the user
         will always see the alternative they started with.  Defaults to `True`.
+    :param sample_rate: The probability with which the conversion is written
+        to Redis, as with :func:`ab_test`.  Defaults to the sample rate of the
+        registered experiment, or 1.
     """
+    if sample_rate is not None:
+        _validate_fraction('sample_rate', sample_rate)
     if _exclude_visitor():
         return
     redis = _get_redis_connection()
+    registry = _get_registry()
     try:
-        experiment = Experiment.find(redis, experiment_name)
-        if not experiment:
+        if experiment_name in registry:
+            experiment = registry.get(
+                redis, experiment_name, _use_compact_layout())
+            if sample_rate is None:
+                sample_rate = registry.options(experiment_name)['sample_rate']
+        else:
+            experiment = Experiment.find(redis, experiment_name)
+        if not experiment or experiment.archived:
             return
-        alternative_name = _get_session().get(experiment.key)
+        alternative_name = _track_completion(
+            redis, experiment, reset, sample_rate or 1)
+    except ConnectionError:
+        if not current_app.config['SPLIT_DB_FAILOVER']:
+            raise
+        annotate(failover=True)
+    else:
         if alternative_name:
-            split_finished = set(session.get('split_finished', []))
-            if experiment.key not in split_finished:
-                alternative = Alternative(
-                    redis, alternative_name, experiment_name)
-                alternative.increment_completion()
-            if reset:
-                _get_session().pop(experiment.key, None)
-                try:
-                    split_finished.remove(experiment.key)
-                except KeyError:
-                    pass
+            _send(conversion_tracked, experiment=experiment,
+                  alternative=alternative_name)
+
+
+def _finished_many(events, rate_limit=None):
+    """
+    Track several conversions of the current visitor at once.
+
+    The experiments are loaded with one bulk read and all the completions
+    are written to Redis in one pipeline.
+
+    :param events: A list of ``(experiment_name, reset)`` tuples.
+    :param rate_limit: An optional ``(key, limit, seconds)`` tuple.  The
+        counter at `key` is incremented along with loading the experiments
+        and expires after `seconds`; if it exceeds `limit`, nothing is
+        tracked.
+    :return: A list of the names of the experiments whose conversion was
+        counted, or `None` if the rate limit was exceeded.
+    """
+    if _exclude_visitor():
+        return []
+    redis = _get_redis_connection()
+    tracked = []
+    try:
+        names = []
+        for experiment_name, reset in events:
+            if experiment_name not in names:
+                names.append(experiment_name)
+        pipe = redis.pipeline(transaction=False)
+        if rate_limit is not None:
+            key, limit, seconds = rate_limit
+            pipe.incr(key)
+            pipe.expire(key, seconds)
+        Experiment._queue_many(pipe, names)
+        result = pipe.execute(raise_on_error=False)
+        if rate_limit is not None:
+            count = result[0]
+            if isinstance(count, Exception):
+                raise count
+            result = result[2:]
+            if count > limit:
+                return None
+        experiments = dict(
+            (experiment.name, experiment)
+            for experiment in Experiment._from_many(
+                redis, names, result, counters=False)
+        )
+        registry = _get_registry()
+        pipe = redis.pipeline(transaction=False)
+        conversions = []
+        for experiment_name, reset in events:
+            experiment = experiments.get(experiment_name)
+            if experiment_name in registry:
+                sample_rate = registry.options(experiment_name)['sample_rate']
             else:
-                split_finished.add(experiment.key)
-            session['split_finished'] = list(split_finished)
+                sample_rate = 1
+            alternative_name = experiment and _track_completion(
+                pipe, experiment, reset, sample_rate)
+            if alternative_name:
+                tracked.append(experiment_name)
+                conversions.append((experiment, alternative_name))
+        if tracked:
+            _execute(redis, pipe)
     except ConnectionError:
         if not current_app.config['SPLIT_DB_FAILOVER']:
             raise
+        return []
+    for experiment, alternative_name in conversions:
+        _send(conversion_tracked, experiment=experiment,
+              alternative=alternative_name)
+    return tracked
+
+
+def _track_completion(redis, experiment, reset, sample_rate=1):
+    """
+    Count a conversion of the current visitor in `experiment`, unless it
+    has already been counted, and update the visitor's session.
+
+    :param redis: A Redis connection or a pipeline.
+    :param sample_rate: The probability with which the conversion is
+        written to Redis.
+    :return: The name of the visitor's alternative if the conversion was
+        counted, or `None` otherwise.  The caller sends the
+        :data:`~flask_split.signals.conversion_tracked` signal once the
+        conversion is written.
+    """
+    alternative_name = _get_session().get(experiment.key)
+    if not alternative_name:
+        return None
+    split_finished = set(session.get('split_finished', []))
+    counted = experiment.key not in split_finished
+    if counted:
+        alternative = Alternative(redis, alternative_name, experiment.name,
+                                  experiment.compact)
+        _increment(redis, alternative, 'completed_count', sample_rate)
+    if reset:
+        _remove_assignments(experiment.key)
+        try:
+            split_finished.remove(experiment.key)
+        except KeyError:
+            pass
+    else:
+        split_finished.add(experiment.key)
+    session['split_finished'] = list(split_finished)
+    return alternative_name if counted else None
+
+
+def _increment(redis, alternative, field, sample_rate):
+    """
+    Increment the counter `field` of `alternative`, and the counters of the
+    current visitor's segments in the same pipeline or through the same
+    aggregator.  With
+    ``SPLIT_MONITOR`` the experiment is also marked as changed for the
+    significance monitor, unless the increment is left to the aggregator,
+    which marks it when it writes it.
+
+    :param redis: A Redis connection or a pipeline.
+    """
+    segments = _get_segments()
+    monitor = current_app.config['SPLIT_MONITOR']
+    if (segments or monitor) and not isinstance(redis, Pipeline):
+        pipe = redis.pipeline(transaction=False)
+    else:
+        pipe = redis
+    alternative = Alternative(pipe, alternative.name,
+                              alternative.experiment_name,
+                              alternative.compact)
+    aggregator = _get_aggregator()
+    options = {'mark_changes': True} if monitor else {}
+    if field == 'participant_count':
+        weight = alternative.increment_participation(
+            sample_rate, aggregator=aggregator, **options)
+    else:
+        weight = alternative.increment_completion(
+            sample_rate, aggregator=aggregator, **options)
+    if weight and segments:
+        alternative.increment_segments(
+            field, weight, segments,
+            current_app.config['SPLIT_SEGMENT_CARDINALITY'],
+            aggregator=aggregator)
+    if pipe is not redis:
+        _execute(redis, pipe)
+
+
+def _get_segments():
+    """
+    Return the current visitor's segments as a dictionary mapping the
+    dimensions in ``SPLIT_SEGMENTS`` to the values returned by their
+    extractors.  The extractors are called once per request.
+    """
+    extractors = current_app.config['SPLIT_SEGMENTS']
+    if not extractors:
+        return {}
+    segments = getattr(g, '_split_segments', None)
+    if segments is None:
+        segments = dict(
+            (dimension, _clean_segment_value(extractor()))
+            for dimension, extractor in extractors.items()
+        )
+        g._split_segments = segments
+    return segments
+
+
+def _clean_segment_value(value):
+    if value is None or value == '':
+        return 'unknown'
+    return ('%s' % value).replace(':', '_')[:64]
+
+
+def _get_registry():
+    return _get_state(current_app)['registry']
+
+
+def _alternative_names(alternatives):
+    return [a[0] if isinstance(a, tuple) else a for a in alternatives]
 
 
 def _override(experiment_name, alternatives):
@@ -150,16 +540,88 @@ def _override(experiment_name, alternatives):
 def _begin_experiment(experiment, alternative_name=None):
     if not alternative_name:
         alternative_name = experiment.control.name
+    alternative_name = _claim_assignment(experiment, alternative_name)
     _get_session()[experiment.key] = alternative_name
     session.modified = True
 
 
 def _get_session():
+    """
+    Return the dictionary mapping the keys of the experiments the current
+    visitor takes part in to their alternatives.
+
+    The dictionary is kept in the session.  If the visitor is a logged-in
+    user, see ``SPLIT_USER_ID``, it is replaced by the user's assignments in
+    the assignment store once per request.  The first time a session is
+    seen with a user, the assignments made before the user logged in are
+    merged into the store.
+    """
     if 'split' not in session:
         session['split'] = {}
+    user_id = _get_user_id()
+    if user_id is not None and g.get('_split_user_synced') != user_id:
+        g._split_user_synced = user_id
+        _sync_assignments(user_id)
+    elif user_id is None and 'split_user' in session:
+        session.pop('split_user')
     return session['split']
 
 
+def _get_user_id():
+    """
+    Return the id of the current user as returned by the ``SPLIT_USER_ID``
+    callable, or `None` for anonymous visitors.  The callable is called once
+    per request.
+    """
+    get_user_id = current_app.config['SPLIT_USER_ID']
+    if get_user_id is None:
+        return None
+    if '_split_user_id' not in g:
+        user_id = get_user_id()
+        g._split_user_id = None if user_id is None else '%s' % user_id
+    return g._split_user_id
+
+
+def _sync_assignments(user_id):
+    store = _get_assignment_store(current_app)
+    redis = _get_redis_connection()
+    if session.get('split_user') == user_id:
+        assignments = store.load(redis, user_id)
+    else:
+        assignments = store.load(redis, user_id, session['split'])
+        session['split_user'] = user_id
+    if assignments != session['split']:
+        session['split'] = assignments
+
+
+def _claim_assignment(experiment, alternative_name):
+    """
+    Assign `alternative_name` of `experiment` to the current user in the
+    assignment store, unless the user already has another alternative.
+
+    :return: The alternative assigned to the user, which is always
+        `alternative_name` for anonymous visitors.
+    """
+    user_id = _get_user_id()
+    if user_id is None:
+        return alternative_name
+    _get_session()
+    return _get_assignment_store(current_app).claim(
+        _get_redis_connection(), user_id, experiment.key, alternative_name)
+
+
+def _remove_assignments(*keys):
+    """Remove the current visitor's assignments with the given keys."""
+    assignments = _get_session()
+    for key in keys:
+        assignments.pop(key, None)
+    session.modified = True
+    user_id = _get_user_id()
+    if user_id is not None:
+        _get_assignment_store(current_app).remove(
+            _get_redis_connection(), user_id, *keys)
+
+
 def _exclude_visitor():
     """
     Return `True` if the current visitor should be excluded from participating
@@ -171,6 +633,7 @@ def _exclude_visitor():
 def _not_allowed_to_test(experiment_key):
     return (
         not current_app.config['SPLIT_ALLOW_MULTIPLE_EXPERIMENTS'] and
+        _get_registry().layer(experiment_key.split(':', 1)[0]) is None and
         _doing_other_tests(experiment_key)
     )
 
@@ -179,17 +642,71 @@ def _doing_other_tests(experiment_key):
     """
     Return `True` if the current user is doing other experiments than the
     experiment with the key ``experiment_key`` at the moment, or `False`
-    otherwise.
+    otherwise.  Experiments in layers are not taken into account, as their
+    exclusivity is decided by the layers.
     """
+    registry = _get_registry()
     for key in _get_session():
-        if key != experiment_key:
+        if key != experiment_key and \
+                registry.layer(key.split(':', 1)[0]) is None:
             return True
     return False
 
 
+def _in_layer_slot(experiment):
+    """
+    Return `True` if the current visitor may take part in `experiment`,
+    i.e. it is not registered in a layer or the visitor's slot in the layer
+    belongs to it.  Logged-in users are identified by their user id, so that
+    they get the same slot on every device.
+
+    Visitors that already take part in the experiment stay in it, so that
+    changing the experiments of a layer does not move them to the control
+    while their conversions are still credited to their alternative.
+    """
+    registry = _get_registry()
+    if registry.layer(experiment.name) is None:
+        return True
+    if experiment.key in _get_session():
+        return True
+    visitor_id = _get_user_id()
+    if visitor_id is None:
+        visitor_id = _get_visitor_id()
+    return registry.is_eligible(experiment.name, visitor_id)
+
+
+def _sampled_out(experiment, traffic):
+    """
+    Return `True` if the current visitor is left out of `experiment` because
+    it only takes part of the traffic.
+
+    The decision is made once per visitor and version of the experiment and
+    remembered in the session.  Visitors that already take part in the
+    experiment are never left out, so that lowering the traffic fraction
+    does not affect them.
+    """
+    sampled_out = session.get('split_sampled_out', [])
+    if experiment.key in sampled_out:
+        return True
+    if traffic >= 1 or experiment.key in _get_session():
+        return False
+    if random.random() < traffic:
+        return False
+    session['split_sampled_out'] = sampled_out + [experiment.key]
+    return True
+
+
 def _clean_old_versions(experiment):
-    for old_key in _old_versions(experiment):
-        del _get_session()[old_key]
+    old_keys = _old_versions(experiment)
+    if old_keys:
+        _remove_assignments(*old_keys)
+    sampled_out = session.get('split_sampled_out')
+    if sampled_out:
+        session['split_sampled_out'] = [
+            key for key in sampled_out
+            if key == experiment.key or
+            key.split(':', 1)[0] != experiment.name
+        ]
     session.modified = True
 
 
@@ -208,13 +725,13 @@ def _is_robot():
     Return `True` if the current visitor is a robot or spider, or
     `False` otherwise.
 
-    This function works by comparing the request's user agent with a regular
-    expression.  The regular expression can be configured with the
-    ``SPLIT_ROBOT_REGEX`` setting.
+    This function works by matching the request's user agent against the
+    ``SPLIT_ROBOT_REGEX`` regular expression and the user agent substrings
+    in the ``SPLIT_ROBOT_SIGNATURES`` setting.  The verdicts are cached per
+    user agent.
     """
-    robot_regex = current_app.config['SPLIT_ROBOT_REGEX']
     user_agent = request.headers.get('User-Agent', '')
-    return re.search(robot_regex, user_agent, flags=re.VERBOSE)
+    return _get_exclusion_engine(current_app).is_robot(user_agent)
 
 
 def _is_ignored_ip_address():
@@ -222,8 +739,8 @@ def _is_ignored_ip_address():
     Return `True` if the IP address of the current visitor should be
     ignored, or `False` otherwise.
 
-    The list of ignored IP addresses can be configured with the
-    ``SPLIT_IGNORE_IP_ADDRESSES`` setting.
+    The ignored IP addresses and networks in CIDR notation can be configured
+    with the ``SPLIT_IGNORE_IP_ADDRESSES`` setting.
     """
-    ignore_ip_addresses = current_app.config['SPLIT_IGNORE_IP_ADDRESSES']
-    return request.remote_addr in ignore_ip_addresses
+    engine = _get_exclusion_engine(current_app)
+    return engine.is_ignored_ip_address(request.remote_addr)
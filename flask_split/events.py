@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.events
+    ~~~~~~~~~~~~~~~~~~
+
+    An optional log of participation and conversion events on a Redis
+    Stream, and a consumer that aggregates the events into the counters.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+import json
+from collections import defaultdict
+from datetime import datetime
+
+from redis import ResponseError
+
+from .models import _execute, _increment_segments
+from .monitor import mark_changed
+from .utils import _get_visitor_id
+
+
+#: The format of the hourly time buckets.
+BUCKET_FORMAT = '%Y%m%d%H'
+
+
+class EventStream(object):
+    """
+    Appends an event to a Redis Stream for every counter increment, instead
+    of incrementing the counter directly.
+
+    Each event is a compact set of fields: ``k`` is the key of the
+    alternative's hash, ``f`` the name of the counter, ``w`` the weight of a
+    sampled increment if it is not 1, and ``v`` the visitor's id.  The time
+    of the event is given by the id of the stream entry.  Segment events
+    also have ``a``, the name of the alternative, ``s``, the segments as
+    JSON, and ``c``, the cardinality of the segment dimensions.
+
+    :param redis: The Redis connection.
+    :param key: The key of the stream.
+    :param maxlen: The approximate maximum number of events kept in the
+        stream.  Older events are trimmed, whether they have been consumed
+        or not.
+    """
+
+    def __init__(self, redis, key, maxlen=100000):
+        self.redis = redis
+        self.key = key
+        self.maxlen = maxlen
+
+    def increment(self, key, field, amount=1, pipe=None):
+        """
+        Append an event for incrementing the counter `field` of the hash
+        `key` by `amount`.
+
+        :param pipe: An optional pipeline to queue the event on instead of
+            appending it right away.
+        :return: Always `True`.
+        """
+        event = {'k': key, 'f': field}
+        if amount != 1:
+            event['w'] = repr(float(amount))
+        visitor = _get_visitor_id()
+        if visitor:
+            event['v'] = visitor
+        redis = self.redis if pipe is None else pipe
+        redis.xadd(self.key, event, maxlen=self.maxlen, approximate=True)
+        return True
+
+    def increment_segments(self, key, field, alternative_name, amount,
+                           segments, cardinality, pipe=None):
+        """
+        Append an event for adding `amount` to the counter `field` of the
+        alternative `alternative_name` in each of the given segments, with
+        the segment hash at `key`.
+
+        :param pipe: An optional pipeline to queue the event on instead of
+            appending it right away.
+        :return: Always `True`.
+        """
+        event = {'k': key, 'f': field, 'a': alternative_name,
+                 's': json.dumps(segments, sort_keys=True),
+                 'c': cardinality}
+        if amount != 1:
+            event['w'] = repr(float(amount))
+        redis = self.redis if pipe is None else pipe
+        redis.xadd(self.key, event, maxlen=self.maxlen, approximate=True)
+        return True
+
+
+def create_group(redis, key, group):
+    """
+    Create the consumer group `group` for the stream `key`, starting from
+    the beginning of the stream, unless it exists already.
+    """
+    try:
+        redis.xgroup_create(key, group, id='0', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def consume(redis, key, group, consumer, batch_size=500, block=None,
+            mark_changes=False, min_idle_time=60000):
+    """
+    Read a batch of events of the stream `key` as `consumer` of `group`, and
+    aggregate them with :func:`apply_events`.
+
+    The events delivered to this consumer earlier but never acknowledged
+    are processed first, and then those another consumer has left
+    unacknowledged for `min_idle_time` milliseconds, e.g. because it crashed
+    and was not restarted under the same name.
+
+    :param block: The number of milliseconds to wait for new events, or
+        `None` to return immediately if there are none.
+    :param mark_changes: Whether to mark the experiments of the events as
+        changed for the :mod:`~flask_split.monitor`.
+    :param min_idle_time: The number of milliseconds after which the events
+        of other consumers are claimed, or `None` to never claim them.
+        Claiming requires Redis 6.2 or greater.
+    :return: The number of processed events.
+    """
+    result = redis.xreadgroup(group, consumer, {key: '0'}, count=batch_size)
+    events = result[0][1] if result else []
+    if not events and min_idle_time is not None:
+        events = _claim(redis, key, group, consumer, min_idle_time,
+                        batch_size)
+    if not events:
+        result = redis.xreadgroup(group, consumer, {key: '>'},
+                                  count=batch_size, block=block)
+        events = result[0][1] if result else []
+    if not events:
+        return 0
+    apply_events(redis, key, group, events, mark_changes)
+    return len(events)
+
+
+def _claim(redis, key, group, consumer, min_idle_time, count):
+    try:
+        return redis.xautoclaim(key, group, consumer, min_idle_time,
+                                count=count)[1]
+    except ResponseError as e:
+        if 'unknown command' not in str(e).lower():
+            raise
+        return []
+
+
+def apply_events(redis, key, group, events, mark_changes=False):
+    """
+    Add up `events` of the stream `key` and apply them to the counters and
+    the hourly time buckets in one transaction that also acknowledges them,
+    so that each event is counted exactly once.  The segment counters are
+    incremented with the segment script in the same transaction.  Events
+    without fields, which were trimmed from the stream before they were
+    acknowledged, are only acknowledged.
+
+    :param events: A list of ``(id, fields)`` tuples as returned by
+        ``XREADGROUP``.
+    :param mark_changes: Whether to mark the experiments of the events as
+        changed for the :mod:`~flask_split.monitor`.
+    """
+    counters = defaultdict(int)
+    sampled = defaultdict(float)
+    variances = defaultdict(float)
+    buckets = defaultdict(float)
+    segments = defaultdict(float)
+    changed = set()
+    for event_id, event in events:
+        if not event:
+            continue
+        hash_key, field = event['k'], event['f']
+        if 's' in event:
+            segment = (hash_key, field, event['a'], event['s'],
+                       int(event['c']))
+            segments[segment] += float(event.get('w', 1))
+            continue
+        experiment_name, alternative_name = hash_key.split(':', 1)
+        changed.add(experiment_name)
+        counter = field
+        variance_field = field + '_variance'
+        if ':' in field:
+            # The compact layout names the fields <counter>:<alternative>.
+            counter, alternative_name = field.split(':', 1)
+            variance_field = '%s_variance:%s' % (counter, alternative_name)
+        weight = float(event.get('w', 1))
+        if weight == 1:
+            counters[(hash_key, field)] += 1
+        else:
+            sampled[(hash_key, field)] += weight
+            variances[(hash_key, variance_field)] += weight * (weight - 1)
+        bucket = '%s@%s:%s' % (counter, _get_bucket(event_id),
+                               alternative_name)
+        buckets[('%s:timeline' % experiment_name, bucket)] += weight
+
+    pipe = redis.pipeline()
+    for (hash_key, field), count in counters.items():
+        pipe.hincrbyfloat(hash_key, field, count)
+    for (hash_key, field), amount in sampled.items():
+        pipe.hincrbyfloat(hash_key, field, amount)
+    for (hash_key, field), amount in variances.items():
+        pipe.hincrbyfloat(hash_key, field, amount)
+    for (timeline_key, field), amount in buckets.items():
+        pipe.hincrbyfloat(timeline_key, field, amount)
+    for (segment_key, field, alternative_name, values,
+         cardinality), amount in segments.items():
+        _increment_segments(pipe, segment_key, field, alternative_name,
+                            amount, json.loads(values), cardinality)
+    if mark_changes:
+        mark_changed(pipe, *sorted(changed))
+    if events:
+        pipe.xack(key, group, *[event_id for event_id, event in events])
+    _execute(redis, pipe)
+
+
+def _get_bucket(event_id):
+    timestamp = int(event_id.split('-', 1)[0]) / 1000.0
+    return datetime.utcfromtimestamp(timestamp).strftime(BUCKET_FORMAT)
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.exclusion
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Fast checks for visitors that are excluded from experiments: robots
+    recognized by their user agent, and ignored IP addresses and networks.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+from binascii import hexlify
+from collections import OrderedDict
+import logging
+import re
+import socket
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+#: User agent substrings of common robots, spiders, crawlers, monitoring
+#: services, link preview fetchers and HTTP libraries.  They are matched
+#: case-insensitively.
+ROBOT_SIGNATURES = [
+    'AdsBot-Google',
+    'AhrefsBot',
+    'Amazonbot',
+    'Applebot',
+    'archive.org_bot',
+    'axios/',
+    'Baiduspider',
+    'bingbot',
+    'BingPreview',
+    'BLEXBot',
+    'Bytespider',
+    'CCBot',
+    'Chrome-Lighthouse',
+    'coccocbot',
+    'curl/',
+    'DataForSeoBot',
+    'Discordbot',
+    'DotBot',
+    'DuckDuckBot',
+    'Embedly',
+    'facebookexternalhit',
+    'Feedfetcher-Google',
+    'Go-http-client',
+    'Google-InspectionTool',
+    'GPTBot',
+    'HeadlessChrome',
+    'heritrix',
+    'httpx',
+    'ia_archiver',
+    'Java/',
+    'LinkedInBot',
+    'Mediapartners-Google',
+    'MegaIndex',
+    'MJ12bot',
+    'node-fetch',
+    'Nutch',
+    'okhttp',
+    'PetalBot',
+    'PhantomJS',
+    'Pingdom',
+    'python-requests',
+    'Python-urllib',
+    'Qwantify',
+    'redditbot',
+    'Scrapy',
+    'Screaming Frog',
+    'SemrushBot',
+    'SeznamBot',
+    'Slackbot',
+    'Sogou web spider',
+    'TelegramBot',
+    'Twitterbot',
+    'UptimeRobot',
+    'WhatsApp/',
+    'Wget',
+    'YandexBot',
+    'Yeti',
+]
+
+#: Generic patterns matching the self-descriptions of most other robots.
+#: ``bot`` is not matched after ``cu``, as in the Cubot phone brand.
+_GENERIC_ROBOT_PATTERNS = [
+    r'(?<!cu)bot\b',
+    r'crawler',
+    r'spider',
+    r'scraper',
+]
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping that holds at most `maxsize` items, evicting the
+    least recently used item first.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+
+class IPNetworkSet(object):
+    """
+    A set of IPv4 and IPv6 networks that supports fast membership tests of
+    addresses.
+
+    The networks are kept in one hash set per address family and prefix
+    length, so that an address is looked up with one set lookup per
+    distinct prefix length instead of comparing it with every network.
+
+    :param networks: An iterable of addresses such as ``'10.1.2.3'`` and
+        networks in CIDR notation such as ``'10.0.0.0/8'`` or
+        ``'2001:db8::/32'``.
+    :raises ValueError: if a network is invalid.
+    """
+
+    def __init__(self, networks=()):
+        self._prefixes = {4: {}, 6: {}}
+        for network in networks:
+            self.add(network)
+
+    def add(self, network):
+        """Add an address or a network in CIDR notation to the set."""
+        address, _, prefix_length = network.partition('/')
+        version, number = _parse_address(address)
+        bits = 32 if version == 4 else 128
+        if prefix_length:
+            if not prefix_length.isdigit() or int(prefix_length) > bits:
+                raise ValueError('Invalid network: %r' % network)
+            prefix_length = int(prefix_length)
+        else:
+            prefix_length = bits
+        self._prefixes[version].setdefault(prefix_length, set()).add(
+            number >> (bits - prefix_length))
+
+    def __contains__(self, address):
+        try:
+            version, number = _parse_address(address)
+        except ValueError:
+            return False
+        bits = 32 if version == 4 else 128
+        for prefix_length, prefixes in self._prefixes[version].items():
+            if number >> (bits - prefix_length) in prefixes:
+                return True
+        return False
+
+
+class ExclusionEngine(object):
+    """
+    Decides whether a visitor is excluded from experiments.
+
+    Everything is compiled once when the engine is created.  The verdicts
+    for user agents are cached, as most requests come from a small number
+    of distinct user agents.
+
+    :param robot_regex: A regular expression in verbose mode matching the
+        user agents of robots, as in the ``SPLIT_ROBOT_REGEX`` setting.
+    :param robot_signatures: Additional user agent substrings of robots,
+        matched case-insensitively.
+    :param ignore_ip_addresses: Addresses and networks in CIDR notation to
+        exclude.  Other entries are logged and compared to the client address
+        verbatim.
+    :param cache_size: The number of user agent verdicts to cache.
+    """
+
+    def __init__(self, robot_regex=None, robot_signatures=(),
+                 ignore_ip_addresses=(), cache_size=1024):
+        #: The arguments the engine was built from.
+        self.settings = (robot_regex, tuple(robot_signatures),
+                         tuple(ignore_ip_addresses), cache_size)
+        self._robot_regex = None
+        if robot_regex:
+            self._robot_regex = re.compile(robot_regex, re.VERBOSE)
+        self._signature_regex = None
+        if robot_signatures:
+            self._signature_regex = re.compile('|'.join(
+                [_trie_pattern(s.lower() for s in robot_signatures)] +
+                _GENERIC_ROBOT_PATTERNS
+            ))
+        self._verdicts = LRUCache(cache_size)
+        self._ignored_networks = IPNetworkSet()
+        self._ignored_addresses = set()
+        for entry in ignore_ip_addresses:
+            try:
+                self._ignored_networks.add(entry)
+            except ValueError:
+                logger.warning(
+                    'Ignored address %r is not an IP address or network.',
+                    entry
+                )
+                self._ignored_addresses.add(entry)
+
+    def is_robot(self, user_agent):
+        """Return `True` if `user_agent` belongs to a robot."""
+        verdict = self._verdicts.get(user_agent)
+        if verdict is None:
+            verdict = bool(
+                self._robot_regex and
+                self._robot_regex.search(user_agent) or
+                self._signature_regex and
+                self._signature_regex.search(user_agent.lower())
+            )
+            self._verdicts.set(user_agent, verdict)
+        return verdict
+
+    def is_ignored_ip_address(self, address):
+        """Return `True` if `address` is in an ignored network."""
+        return address is not None and (
+            address in self._ignored_addresses or
+            address in self._ignored_networks
+        )
+
+
+def _trie_pattern(words):
+    """
+    Return a regular expression matching any of `words`, with the common
+    prefixes of the words factored out.  Python's regular expression engine
+    tries the alternatives of a group one by one, so that factoring them out
+    makes matching many words several times faster.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def pattern(node):
+        if '' in node:
+            # A shorter word matches whenever any longer one does.
+            return ''
+        branches = [
+            re.escape(char) + pattern(child)
+            for char, child in sorted(node.items())
+        ]
+        if len(branches) == 1:
+            return branches[0]
+        return '(?:%s)' % '|'.join(branches)
+
+    return pattern(trie)
+
+
+def _parse_address(address):
+    """
+    Parse an IPv4 or IPv6 address into a tuple of its version and its value
+    as an integer.  IPv4-mapped IPv6 addresses are parsed as IPv4 addresses.
+
+    :raises ValueError: if `address` is not a valid address.
+    """
+    for family, version in ((socket.AF_INET, 4), (socket.AF_INET6, 6)):
+        try:
+            packed = socket.inet_pton(family, address)
+        except (socket.error, ValueError, TypeError):
+            continue
+        number = int(hexlify(packed), 16)
+        if version == 6 and number >> 32 == 0xffff:
+            return 4, number & 0xffffffff
+        return version, number
+    raise ValueError('Invalid IP address: %r' % (address,))
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.federation
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    A reader that merges the counters of experiments run in several regions,
+    each with a Redis of its own.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+import logging
+import threading
+
+from .models import COUNTER_FIELDS, Experiment
+
+
+logger = logging.getLogger(__name__)
+
+
+class Federation(object):
+    """
+    Reads experiments from the Redis of every region and sums their counters.
+
+    Each region counts into its own Redis only, so that :func:`ab_test`
+    never waits for another region.  Together the regions form a grow-only
+    counter with one slot per region: no region ever writes to the counters
+    of another, so the global count of a counter is the sum of the counts
+    of all regions, and merging needs no coordination.
+
+    The regions are read in parallel, one thread per region, each with the
+    usual constant number of pipelined round trips.  Each region keeps its
+    own version of an experiment, which only counts its own resets, so the
+    counters of every region are summed whatever their version.  The other
+    fields, such as the version, winner and weights, are those of the first
+    region in the order of `connections` that has the experiment.
+
+    A region that cannot be read, e.g. because its connection times out, is
+    left out of the sums and listed in :attr:`unavailable`, unless no region
+    can be read at all.  Create a new reader for every request to report
+    the regions that failed during it.
+
+    :param connections: The Redis connections of the regions, the local one
+        first.
+    :param labels: The names of the regions for :attr:`unavailable`, in the
+        order of `connections`.  Defaults to their positions.
+    """
+
+    def __init__(self, connections, labels=None):
+        self.connections = list(connections)
+        if labels is None:
+            labels = [str(index) for index in range(len(self.connections))]
+        self.labels = list(labels)
+        #: The labels of the regions that could not be read by any call of
+        #: :meth:`find_many` so far.
+        self.unavailable = []
+
+    def find_many(self, names=None, counters=True, segments=False):
+        """
+        Load the given experiments from all regions and merge them.  Takes
+        the same arguments as :meth:`Experiment.find_many`, and returns the
+        experiments that exist in any region that could be read, sorted by
+        name.
+        """
+        results, errors = _in_parallel([
+            _loader(redis, names, counters, segments)
+            for redis in self.connections
+        ])
+        if all(error is not None for error in errors):
+            raise errors[0]
+        for label, error in zip(self.labels, errors):
+            if error is not None:
+                logger.warning('Could not read region %s: %s', label, error)
+                if label not in self.unavailable:
+                    self.unavailable.append(label)
+        copies = {}
+        for experiments in results:
+            for experiment in experiments or ():
+                copies.setdefault(experiment.name, []).append(experiment)
+        return [
+            _merge(copies[name], counters, segments)
+            for name in sorted(copies)
+        ]
+
+    def find(self, name):
+        """Load and merge the experiment `name`, or return `None`."""
+        experiments = self.find_many([name])
+        return experiments[0] if experiments else None
+
+
+def _loader(redis, names, counters, segments):
+    def load():
+        return Experiment.find_many(redis, names, counters, segments)
+    return load
+
+
+def _in_parallel(functions):
+    """
+    Call the given functions in threads of their own and return a list of
+    their results and a list of the exceptions they raised, in order, with
+    `None` in place of the missing ones.
+    """
+    results = [None] * len(functions)
+    errors = [None] * len(functions)
+
+    def run(index, function):
+        try:
+            results[index] = function()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [
+        threading.Thread(target=run, args=(index, function))
+        for index, function in enumerate(functions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def _merge(experiments, counters, segments):
+    """
+    Merge the copies of an experiment loaded from different regions into
+    the first copy.
+    """
+    merged = experiments[0]
+    if counters:
+        for alternative in merged.alternatives:
+            copies = [
+                other for experiment in experiments
+                for other in experiment.alternatives
+                if other.name == alternative.name
+            ]
+            alternative._counters = dict(
+                (alternative._field(field),
+                 sum(copy._get_value(field) for copy in copies))
+                for field in COUNTER_FIELDS
+            )
+    if segments:
+        data = {}
+        for experiment in experiments:
+            for key, count in experiment._preloaded['segments'].items():
+                if key.startswith(('participant_count:', 'completed_count:')):
+                    data[key] = data.get(key, 0) + float(count)
+        merged._preloaded['segments'] = data
+    return merged
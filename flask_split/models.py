@@ -9,26 +9,137 @@
     :license: MIT, see LICENSE for more details.
 """
 
+import hashlib
 from datetime import datetime
-from math import sqrt
+from math import isinf, isnan, sqrt
 from random import random
 
+from redis import ResponseError
+from redis.client import Pipeline
+from redis.exceptions import NoScriptError
+
+from .tracing import traced
+
+
+#: The counters of an alternative.
+COUNTER_FIELDS = (
+    'participant_count',
+    'completed_count',
+    'participant_count_variance',
+    'completed_count_variance',
+)
+
+#: The fields of an experiment's hash in the compact layout that do not
+#: belong to an alternative.
+COMPACT_FIELDS = ('version', 'winner', 'start_time')
+
+
+#: Increments a counter in each of the given segments of an alternative,
+#: registering new segment values until there are ``ARGV[4]`` values of a
+#: dimension and counting further values as ``other``.
+_INCREMENT_SEGMENTS_SCRIPT = """
+local key = KEYS[1]
+for i = 5, #ARGV, 2 do
+    local dimension, value = ARGV[i], ARGV[i + 1]
+    local member = 'value:' .. dimension .. ':' .. value
+    if value ~= 'other' and redis.call('HEXISTS', key, member) == 0 then
+        if redis.call('HINCRBY', key, 'values:' .. dimension, 1) <=
+                tonumber(ARGV[4]) then
+            redis.call('HSET', key, member, 1)
+        else
+            redis.call('HINCRBY', key, 'values:' .. dimension, -1)
+            value = 'other'
+        end
+    end
+    redis.call('HINCRBYFLOAT', key,
+        ARGV[1] .. ':' .. dimension .. ':' .. value .. ':' .. ARGV[2],
+        ARGV[3])
+end
+"""
+
+_INCREMENT_SEGMENTS_SHA = hashlib.sha1(
+    _INCREMENT_SEGMENTS_SCRIPT.encode('utf-8')).hexdigest()
+
+
+def _increment_segments(redis, key, field, alternative_name, amount,
+                        segments, cardinality):
+    """
+    Add `amount` to the counter `field` of the alternative
+    `alternative_name` in each of the given segments, with the segment hash
+    at `key`.
+
+    The script is run with ``EVALSHA``.  On a connection it is sent with
+    ``EVAL`` if Redis does not have it cached; in a pipeline, which must be
+    executed with :func:`_execute`, this is done after the pipeline.
+    """
+    args = [field, alternative_name, amount, cardinality]
+    for dimension, value in sorted(segments.items()):
+        args.extend([dimension, value])
+    if isinstance(redis, Pipeline):
+        redis.evalsha(_INCREMENT_SEGMENTS_SHA, 1, key, *args)
+        return
+    try:
+        redis.evalsha(_INCREMENT_SEGMENTS_SHA, 1, key, *args)
+    except NoScriptError:
+        redis.eval(_INCREMENT_SEGMENTS_SCRIPT, 1, key, *args)
+
+
+def _execute(redis, pipe, raise_on_error=True):
+    """
+    Execute `pipe` and run the segment increments queued in it again with
+    ``EVAL`` if Redis did not have the script cached, e.g. after a restart.
+    The other commands of a pipeline are applied even if a script fails.
+
+    :param redis: The connection to run the scripts again on.
+    :return: The results of the commands, as ``pipe.execute()``.
+    """
+    commands = [args for args, options in pipe.command_stack]
+    results = pipe.execute(raise_on_error=False)
+    for index, (args, result) in enumerate(zip(commands, results)):
+        if isinstance(result, NoScriptError):
+            try:
+                results[index] = redis.eval(_INCREMENT_SEGMENTS_SCRIPT,
+                                            *args[2:])
+            except ResponseError as e:
+                results[index] = e
+        if raise_on_error and isinstance(results[index], Exception):
+            raise results[index]
+    return results
+
 
 class Alternative(object):
-    def __init__(self, redis, name, experiment_name):
+    def __init__(self, redis, name, experiment_name, compact=False):
         self.redis = redis
         self.experiment_name = experiment_name
+        self.compact = compact
         if isinstance(name, tuple):
             self.name, self.weight = name
         else:
             self.name = name
             self.weight = 1
+        self._counters = None
+        self._experiment = None
+
+    def _get_value(self, field):
+        if self._counters is not None:
+            value = self._counters.get(self._field(field))
+        else:
+            value = self.redis.hget(self.key, self._field(field))
+        return float(value or 0)
+
+    def _get_counter(self, field):
+        return int(round(self._get_value(field)))
+
+    def _set_counter(self, field, count):
+        self.redis.hset(self.key, self._field(field), int(count))
+        if self._counters is not None:
+            self._counters[self._field(field)] = int(count)
 
     def _get_participant_count(self):
-        return int(self.redis.hget(self.key, 'participant_count') or 0)
+        return self._get_counter('participant_count')
 
     def _set_participant_count(self, count):
-        self.redis.hset(self.key, 'participant_count', int(count))
+        self._set_counter('participant_count', count)
 
     participant_count = property(
         _get_participant_count,
@@ -36,21 +147,113 @@ class Alternative(object):
     )
 
     def _get_completed_count(self):
-        return int(self.redis.hget(self.key, 'completed_count') or 0)
+        return self._get_counter('completed_count')
 
     def _set_completed_count(self, count):
-        self.redis.hset(self.key, 'completed_count', int(count))
+        self._set_counter('completed_count', count)
 
     completed_count = property(
         _get_completed_count,
         _set_completed_count
     )
 
-    def increment_participation(self):
-        self.redis.hincrby(self.key, 'participant_count', 1)
+    @property
+    def participant_count_error(self):
+        """
+        The 95% error bound of :attr:`participant_count`, which is 0 unless
+        participations were counted with a sample rate below 1.
+        """
+        return _error_bound(self._get_value('participant_count_variance'))
+
+    @property
+    def completed_count_error(self):
+        """
+        The 95% error bound of :attr:`completed_count`, which is 0 unless
+        completions were counted with a sample rate below 1.
+        """
+        return _error_bound(self._get_value('completed_count_variance'))
+
+    def increment_participation(self, sample_rate=1, aggregator=None,
+                                mark_changes=False):
+        return self._increment('participant_count', sample_rate, aggregator,
+                               mark_changes)
+
+    def increment_completion(self, sample_rate=1, aggregator=None,
+                             mark_changes=False):
+        return self._increment('completed_count', sample_rate, aggregator,
+                               mark_changes)
+
+    def _increment(self, field, sample_rate, aggregator, mark_changes=False):
+        """
+        Increment the counter `field`.
+
+        With a `sample_rate` below 1 the event is only recorded with that
+        probability, but with a weight of ``1 / sample_rate``, so that the
+        counter stays an unbiased estimate of the true count.  The variance
+        of the estimate is accumulated in a companion field for computing
+        error bounds.
 
-    def increment_completion(self):
-        self.redis.hincrby(self.key, 'completed_count', 1)
+        The increment is handed to the `aggregator` if one is given, such
+        as a :class:`~flask_split.aggregation.CounterAggregator`, which
+        writes it to Redis later, or an
+        :class:`~flask_split.events.EventStream`, which appends it to the
+        stream with this alternative's connection or pipeline.  Increments
+        the aggregator declines are written directly.
+
+        :param mark_changes: Whether to mark the experiment as changed for
+            the :mod:`~flask_split.monitor` when the increment is written
+            directly.  The aggregator marks the increments it writes itself.
+        :return: The weight the event was recorded with, or `None` if it
+            was left out of the sample.
+        """
+        self._counters = None
+        if sample_rate >= 1:
+            weight = 1
+        elif random() < sample_rate:
+            weight = 1.0 / sample_rate
+        else:
+            return None
+        if aggregator is not None and \
+                aggregator.increment(self.key, self._field(field), weight,
+                                     pipe=self.redis):
+            return weight
+        # Sampled events leave fractional counts behind, which HINCRBY
+        # refuses to add to, so every writer of the counters uses
+        # HINCRBYFLOAT.
+        self.redis.hincrbyfloat(self.key, self._field(field), weight)
+        if weight != 1:
+            self.redis.hincrbyfloat(
+                self.key, self._field(field + '_variance'),
+                weight * (weight - 1))
+        if mark_changes:
+            from .monitor import mark_changed
+            mark_changed(self.redis, self.experiment_name)
+        return weight
+
+    def increment_segments(self, field, amount, segments, cardinality,
+                           aggregator=None):
+        """
+        Add `amount` to the counter `field` of this alternative in each of
+        the given segments.
+
+        The number of distinct values counted per segment dimension and
+        experiment is capped atomically at `cardinality`; further values are
+        counted in the ``other`` bucket.
+
+        :param segments: A dictionary mapping segment dimensions, such as
+            ``'country'``, to the current visitor's values.
+        :param aggregator: An optional
+            :class:`~flask_split.aggregation.CounterAggregator` or
+            :class:`~flask_split.events.EventStream` to hand the increment to
+            instead of writing it to Redis directly.
+        """
+        key = '%s:segments' % self.experiment_name
+        if aggregator is not None and aggregator.increment_segments(
+                key, field, self.name, amount, segments, cardinality,
+                pipe=self.redis):
+            return
+        _increment_segments(self.redis, key, field, self.name, amount,
+                            segments, cardinality)
 
     @property
     def is_control(self):
@@ -64,25 +267,51 @@ class Alternative(object):
 
     @property
     def experiment(self):
+        if self._experiment is not None:
+            return self._experiment
         return Experiment.find(self.redis, self.experiment_name)
 
-    def save(self):
-        self.redis.hsetnx(self.key, 'participant_count', 0)
-        self.redis.hsetnx(self.key, 'completed_count', 0)
+    def save(self, pipe=None):
+        redis = self.redis if pipe is None else pipe
+        redis.hsetnx(self.key, self._field('participant_count'), 0)
+        redis.hsetnx(self.key, self._field('completed_count'), 0)
+        self._counters = None
 
-    def reset(self):
-        self.redis.hmset(self.key, {
-            'participant_count': 0,
-            'completed_count': 0
+    def reset(self, pipe=None):
+        redis = self.redis if pipe is None else pipe
+        redis.hmset(self.key, {
+            self._field('participant_count'): 0,
+            self._field('completed_count'): 0
         })
+        redis.hdel(self.key, self._field('participant_count_variance'),
+                   self._field('completed_count_variance'))
+        self._counters = None
 
-    def delete(self):
-        self.redis.delete(self.key)
+    def delete(self, pipe=None):
+        redis = self.redis if pipe is None else pipe
+        if self.compact:
+            redis.hdel(self.key, *[
+                self._field(field) for field in COUNTER_FIELDS])
+        else:
+            redis.unlink(self.key)
+        self._counters = None
 
     @property
     def key(self):
+        """
+        The key of the hash holding the counters of this alternative, which
+        is the experiment's hash in the compact layout.
+        """
+        if self.compact:
+            return _compact_key(self.experiment_name)
         return '%s:%s' % (self.experiment_name, self.name)
 
+    def _field(self, field):
+        """Return the name of the hash field holding the counter `field`."""
+        if self.compact:
+            return '%s:%s' % (field, self.name)
+        return field
+
     @property
     def z_score(self):
         control = self.experiment.control
@@ -94,8 +323,12 @@ class Alternative(object):
         cr = alternative.conversion_rate
         crc = control.conversion_rate
 
-        n = alternative.participant_count
-        nc = control.participant_count
+        n = _effective_count(
+            alternative.participant_count,
+            alternative._get_value('participant_count_variance'))
+        nc = _effective_count(
+            control.participant_count,
+            control._get_value('participant_count_variance'))
 
         if n == 0 or nc == 0:
             return None
@@ -130,39 +363,85 @@ class Alternative(object):
 
 
 class Experiment(object):
-    def __init__(self, redis, name, *alternative_names):
+    """
+    An experiment and its alternatives.
+
+    Experiments are stored in one of two layouts.  By default, each
+    alternative's counters are kept in a hash of its own and the
+    alternatives, version and weights in keys of their own, while the winner
+    and start time are entries of global hashes.  In the compact layout,
+    enabled with ``compact=True``, all of them are fields of a single hash,
+    see :attr:`compact_key`.
+    """
+
+    def __init__(self, redis, name, *alternative_names, **kwargs):
         self.redis = redis
         self.name = name
+        self.compact = kwargs.pop('compact', False)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: %s' %
+                            ', '.join(sorted(kwargs)))
         self.alternatives = [
-            Alternative(redis, alternative, name)
+            Alternative(redis, alternative, name, self.compact)
             for alternative in alternative_names
         ]
+        self.archived = False
+        self._preloaded = {}
 
     @property
     def control(self):
         return self.alternatives[0]
 
     def _get_winner(self):
-        winner = self.redis.hget('experiment_winner', self.name)
+        if 'winner' in self._preloaded:
+            winner = self._preloaded['winner']
+        else:
+            winner = self.redis.hget(*self._winner_field)
         if winner:
-            return Alternative(self.redis, winner, self.name)
+            return Alternative(self.redis, winner, self.name, self.compact)
 
     def _set_winner(self, winner_name):
-        self.redis.hset('experiment_winner', self.name, winner_name)
+        self.set_winner(winner_name)
 
     winner = property(
         _get_winner,
         _set_winner
     )
 
-    def reset_winner(self):
+    def set_winner(self, winner_name, pipe=None):
+        """Set the winner of this experiment."""
+        redis = self.redis if pipe is None else pipe
+        key, field = self._winner_field
+        redis.hset(key, field, winner_name)
+        self._preloaded.pop('winner', None)
+
+    def reset_winner(self, pipe=None):
         """Reset the winner of this experiment."""
-        self.redis.hdel('experiment_winner', self.name)
+        redis = self.redis if pipe is None else pipe
+        redis.hdel(*self._winner_field)
+        self._preloaded.pop('winner', None)
+
+    @property
+    def _winner_field(self):
+        """The key and field of the hash entry holding the winner."""
+        if self.compact:
+            return self.compact_key, 'winner'
+        return 'experiment_winner', self.name
+
+    @property
+    def _start_time_field(self):
+        """The key and field of the hash entry holding the start time."""
+        if self.compact:
+            return self.compact_key, 'start_time'
+        return 'experiment_start_times', self.name
 
     @property
     def start_time(self):
         """The start time of this experiment."""
-        t = self.redis.hget('experiment_start_times', self.name)
+        if 'start_time' in self._preloaded:
+            t = self._preloaded['start_time']
+        else:
+            t = self.redis.hget(*self._start_time_field)
         if t:
             return datetime.strptime(t, '%Y-%m-%dT%H:%M:%S')
 
@@ -190,16 +469,73 @@ class Experiment(object):
         total = sum(alternative.weight for alternative in self.alternatives)
         point = random() * total
         for alternative in self.alternatives:
-            if alternative.weight >= point:
+            if point < alternative.weight:
                 return alternative
             point -= alternative.weight
+        return self.control
+
+    @property
+    def weights_key(self):
+        return '%s:weights' % self.name
+
+    @property
+    def weights(self):
+        """A dictionary mapping alternative names to their weights."""
+        return dict((a.name, a.weight) for a in self.alternatives)
+
+    def set_weights(self, weights, pipe=None):
+        """
+        Change the weights of some or all alternatives without resetting
+        the experiment, e.g. to gradually ramp up a new alternative.  The
+        weights are stored in Redis and take precedence over the ones given
+        to :func:`~flask_split.ab_test` until the experiment is redefined.
+
+        :param weights: A dictionary mapping alternative names to their new
+            weights.
+        :param pipe: An optional pipeline to queue the command into.
+        :raises ValueError: if an alternative does not exist, a weight is
+            negative or not finite, or all the weights would be zero.
+        """
+        merged = self.weights
+        for name, weight in weights.items():
+            if name not in merged:
+                raise ValueError('Unknown alternative: %r' % name)
+            weight = _parse_weight(weight)
+            if weight < 0 or isinf(weight) or isnan(weight):
+                raise ValueError('Invalid weight for %r: %r' % (name, weight))
+            merged[name] = weight
+        if not any(merged.values()):
+            raise ValueError('At least one weight must be positive.')
+        redis = self.redis if pipe is None else pipe
+        if self.compact:
+            redis.hmset(self.compact_key, dict(
+                ('weight:%s' % name, weight)
+                for name, weight in merged.items()
+            ))
+        else:
+            redis.hmset(self.weights_key, merged)
+        self._apply_weights(merged)
+
+    def _apply_weights(self, weights):
+        for alternative in self.alternatives:
+            if alternative.name in weights:
+                alternative.weight = _parse_weight(weights[alternative.name])
 
     @property
     def version(self):
+        if 'version' in self._preloaded:
+            return int(self._preloaded['version'] or 0)
+        if self.compact:
+            return int(self.redis.hget(self.compact_key, 'version') or 0)
         return int(self.redis.get('%s:version' % self.name) or 0)
 
-    def increment_version(self):
-        self.redis.incr('%s:version' % self.name)
+    def increment_version(self, pipe=None):
+        redis = self.redis if pipe is None else pipe
+        if self.compact:
+            redis.hincrby(self.compact_key, 'version', 1)
+        else:
+            redis.incr('%s:version' % self.name)
+        self._preloaded.pop('version', None)
 
     @property
     def key(self):
@@ -208,33 +544,241 @@ class Experiment(object):
         else:
             return self.name
 
-    def reset(self):
-        """Delete all data for this experiment."""
+    @property
+    def compact_key(self):
+        """
+        The key of the hash holding all of this experiment in the compact
+        layout.  Its fields are ``alternative:<index>`` for the names of the
+        alternatives in order, ``version``, ``winner``, ``start_time``,
+        ``weight:<alternative>`` and ``<counter>:<alternative>``.
+        """
+        return _compact_key(self.name)
+
+    @property
+    def timeline_key(self):
+        return '%s:timeline' % self.name
+
+    @property
+    def segments_key(self):
+        return '%s:segments' % self.name
+
+    def segments(self):
+        """
+        Return the counters of the alternatives broken down by segment, as
+        a dictionary mapping segment dimensions to dictionaries mapping
+        values to dictionaries mapping alternative names to their
+        ``participant_count`` and ``completed_count``.
+        """
+        if 'segments' in self._preloaded:
+            data = self._preloaded['segments']
+        else:
+            data = self.redis.hgetall(self.segments_key)
+        result = {}
+        for key, count in data.items():
+            if not key.startswith(('participant_count:', 'completed_count:')):
+                continue
+            field, dimension, value, alternative_name = key.split(':', 3)
+            if alternative_name not in self.alternative_names:
+                continue
+            counters = result.setdefault(dimension, {}) \
+                .setdefault(value, {}) \
+                .setdefault(alternative_name, {
+                    'participant_count': 0,
+                    'completed_count': 0,
+                })
+            counters[field] = int(round(float(count)))
+        return result
+
+    def timeline(self):
+        """
+        Return the hourly time buckets of the counters aggregated from the
+        event stream, see :mod:`flask_split.events`, as a dictionary mapping
+        alternative names to dictionaries mapping counter names to
+        dictionaries mapping ``YYYYMMDDHH`` hours to counts.
+        """
+        result = dict((name, {}) for name in self.alternative_names)
+        for bucket, count in self.redis.hgetall(self.timeline_key).items():
+            field_hour, alternative_name = bucket.split(':', 1)
+            field, hour = field_hour.split('@', 1)
+            if alternative_name in result:
+                result[alternative_name].setdefault(field, {})[hour] = \
+                    _parse_weight(count)
+        return result
+
+    def _data_keys(self):
+        """
+        Return the keys that hold the collected data of this experiment,
+        apart from the compact hash.
+        """
+        keys = [self.timeline_key, self.segments_key]
+        if not self.compact:
+            keys.extend(alternative.key for alternative in self.alternatives)
+        return keys
+
+    def reset(self, pipe=None):
+        """
+        Delete all data for this experiment.
+
+        The data is removed with ``UNLINK`` in a single transaction, so that
+        Redis frees the memory in the background and large experiments do
+        not block other clients.
+
+        :param pipe: An optional pipeline to queue the commands into instead
+            of executing them in a transaction of their own.
+        """
+        transaction = self.redis.pipeline() if pipe is None else pipe
+        self._preloaded = {}
+        transaction.unlink(*self._data_keys())
         for alternative in self.alternatives:
-            alternative.reset()
-        self.reset_winner()
-        self.increment_version()
+            if self.compact:
+                alternative.reset(transaction)
+            else:
+                alternative.save(transaction)
+        self.reset_winner(transaction)
+        self.increment_version(transaction)
+        if pipe is None:
+            transaction.execute()
+
+    def delete(self, pipe=None):
+        """
+        Delete this experiment and all its data.
 
-    def delete(self):
-        """Delete this experiment and all its data."""
+        Like :meth:`reset`, this runs as a single transaction that removes
+        the data with ``UNLINK``.
+
+        :param pipe: An optional pipeline to queue the commands into instead
+            of executing them in a transaction of their own.
+        """
+        transaction = self.redis.pipeline() if pipe is None else pipe
+        self._preloaded = {}
+        if self.compact:
+            transaction.unlink(self.compact_key, *self._data_keys())
+        else:
+            transaction.unlink(self.name, self.weights_key,
+                               *self._data_keys())
         for alternative in self.alternatives:
-            alternative.delete()
-        self.reset_winner()
-        self.redis.srem('experiments', self.name)
-        self.redis.delete(self.name)
-        self.increment_version()
+            alternative._counters = None
+        if not self.compact:
+            self.reset_winner(transaction)
+            transaction.hdel('experiment_start_times', self.name)
+        transaction.hdel('experiment_allocations', self.name)
+        transaction.srem('experiments', self.name)
+        self.increment_version(transaction)
+        if pipe is None:
+            transaction.execute()
 
     @property
     def is_new_record(self):
+        if self.compact:
+            return not self.redis.hexists(self.compact_key, 'alternative:0')
         return self.name not in self.redis
 
     def save(self):
-        if self.is_new_record:
-            start_time = self._get_time().isoformat()[:19]
-            self.redis.sadd('experiments', self.name)
-            self.redis.hset('experiment_start_times', self.name, start_time)
-            for alternative in reversed(self.alternatives):
-                self.redis.lpush(self.name, alternative.name)
+        """Save this experiment to Redis unless it already exists."""
+        self._save(redefine=False)
+
+    def _save(self, redefine):
+        """
+        Atomically create this experiment or, if `redefine` is `True`,
+        replace an existing experiment that has different alternatives.
+
+        The alternatives list is watched and the changes are written in a
+        single transaction that is retried if another client modified the
+        experiment in the meantime.  After a retry the alternatives are
+        usually already in place, so concurrent creators neither push
+        duplicate alternatives nor reset the experiment more than once.
+        """
+        start_time = self._get_time().isoformat()[:19]
+        if self.compact:
+            self._save_compact(redefine, start_time)
+            return
+
+        def save(pipe):
+            current = pipe.lrange(self.name, 0, -1)
+            if current == self.alternative_names or \
+                    (current and not redefine):
+                return
+            pipe.multi()
+            if current:
+                previous = Experiment(self.redis, self.name, *current)
+                pipe.unlink(self.name, self.weights_key,
+                    *set(previous._data_keys() + self._data_keys()))
+                previous.reset_winner(pipe)
+                previous.increment_version(pipe)
+            else:
+                pipe.unlink(self.weights_key)
+                pipe.sadd('experiments', self.name)
+                pipe.hset('experiment_start_times', self.name, start_time)
+            pipe.rpush(self.name, *self.alternative_names)
+            for alternative in self.alternatives:
+                alternative.save(pipe)
+
+        self.redis.transaction(save, self.name)
+        self._preloaded = {}
+
+    def _save_compact(self, redefine, start_time):
+        """:meth:`_save` for experiments in the compact layout."""
+        def save(pipe):
+            data = pipe.hgetall(self.compact_key)
+            current = _compact_alternative_names(data)
+            if current == self.alternative_names or \
+                    (current and not redefine):
+                return
+            pipe.multi()
+            fields = {}
+            if current:
+                previous = Experiment(self.redis, self.name, *current,
+                                      compact=True)
+                pipe.unlink(self.compact_key, *previous._data_keys())
+                fields['version'] = int(data.get('version') or 0) + 1
+                if data.get('start_time'):
+                    fields['start_time'] = data['start_time']
+            else:
+                pipe.sadd('experiments', self.name)
+                fields['start_time'] = start_time
+            for index, alternative in enumerate(self.alternatives):
+                fields['alternative:%d' % index] = alternative.name
+                fields[alternative._field('participant_count')] = 0
+                fields[alternative._field('completed_count')] = 0
+            pipe.hmset(self.compact_key, fields)
+
+        self.redis.transaction(save, self.compact_key)
+        self._preloaded = {}
+
+    @classmethod
+    def _from_compact(cls, redis, name, data):
+        """
+        Return the experiment stored in `data`, the contents of its compact
+        hash, with its version, winner and start time preloaded, or `None`
+        if `data` holds no experiment.
+        """
+        alternative_names = _compact_alternative_names(data)
+        if not alternative_names:
+            return None
+        experiment = cls(redis, name, *alternative_names, compact=True)
+        experiment._apply_weights(_compact_weights(data))
+        experiment._preloaded = dict(
+            (field, data.get(field)) for field in COMPACT_FIELDS)
+        return experiment
+
+    def _with_given_weights(self, given, data):
+        """
+        Return this experiment, loaded from its compact hash `data`, with
+        the weights of the experiment `given` in code unless they were
+        changed with :meth:`set_weights`.
+        """
+        weights = given.weights
+        weights.update(_compact_weights(data))
+        self._apply_weights(weights)
+        return self
+
+    def _set_archived(self, winner):
+        """
+        Mark this experiment as archived with the given winner.  Archived
+        experiments have no live keys, so nothing may be written for them.
+        """
+        self.archived = True
+        self._preloaded = {'version': None, 'winner': winner}
 
     @classmethod
     def load_alternatives_for(cls, redis, name):
@@ -242,33 +786,248 @@ class Experiment(object):
 
     @classmethod
     def all(cls, redis):
-        return [cls.find(redis, e) for e in redis.smembers('experiments')]
+        return cls.find_many(redis)
+
+    @classmethod
+    def find_many(cls, redis, names=None, counters=True, segments=False):
+        """
+        Load several experiments with a constant number of round trips to
+        Redis, no matter how many experiments there are.
+
+        The returned experiments are snapshots: their version, winner, start
+        time and, if `counters` is `True`, the counters of their alternatives
+        are read once here and served from memory afterwards.
+
+        :param names: A list of experiment names to load.  Defaults to all
+            experiments.  Names that are not in the ``experiments`` set are
+            skipped, even if they are keys of another kind.
+        :param counters: Whether to load the counters of the alternatives.
+        :param segments: Whether to load the counters broken down by segment
+            too, see :meth:`segments`.
+        """
+        winners = start_times = None
+        if names is None:
+            pipe = redis.pipeline(transaction=False)
+            pipe.smembers('experiments')
+            pipe.hgetall('experiment_winner')
+            pipe.hgetall('experiment_start_times')
+            names, winners, start_times = pipe.execute()
+            names = sorted(names)
+            winners = [winners.get(name) for name in names]
+            start_times = [start_times.get(name) for name in names]
+        if not names:
+            return []
+
+        pipe = redis.pipeline(transaction=False)
+        cls._queue_many(pipe, names, winners is None)
+        experiments = cls._from_many(redis, names,
+                                     pipe.execute(raise_on_error=False),
+                                     counters, winners, start_times)
+
+        if (counters or segments) and experiments:
+            pipe = redis.pipeline(transaction=False)
+            for experiment in experiments:
+                if counters and not experiment.compact:
+                    for alternative in experiment.alternatives:
+                        pipe.hgetall(alternative.key)
+                if segments:
+                    pipe.hgetall(experiment.segments_key)
+            result = iter(pipe.execute())
+            for experiment in experiments:
+                if counters and not experiment.compact:
+                    for alternative in experiment.alternatives:
+                        alternative._counters = next(result)
+                if segments:
+                    experiment._preloaded['segments'] = next(result)
+        return experiments
+
+    @classmethod
+    def _queue_many(cls, pipe, names, winners=True):
+        """
+        Queue the commands reading the experiments with the given names into
+        `pipe`, for :meth:`_from_many`.  Callers can queue commands of their
+        own in front of them to share the round trip.
+
+        The names may come from clients and be keys of another kind, such as
+        ``experiments`` itself, so their membership in the ``experiments``
+        set is read along with them, and the pipeline must be executed with
+        ``raise_on_error=False``.
+
+        :param winners: Whether to read the winners and start times too.
+        """
+        for name in names:
+            pipe.sismember('experiments', name)
+            pipe.lrange(name, 0, -1)
+            pipe.get('%s:version' % name)
+            pipe.hgetall('%s:weights' % name)
+            pipe.hgetall(_compact_key(name))
+        if winners and names:
+            pipe.hmget('experiment_winner', names)
+            pipe.hmget('experiment_start_times', names)
+
+    @classmethod
+    def _from_many(cls, redis, names, result, counters=True, winners=None,
+                   start_times=None):
+        """
+        Return the experiments read by the commands :meth:`_queue_many`
+        queued, whose results are given as `result`.  Names that are not in
+        the ``experiments`` set are skipped, and the counters of alternatives
+        are only filled in for experiments in the compact layout.
+
+        :raises redis.ResponseError: if a command reading an experiment or
+            the winners failed.
+        """
+        if not names:
+            return []
+        result = list(result)
+        if winners is None:
+            start_times = result.pop()
+            winners = result.pop()
+        for value in (winners, start_times):
+            if isinstance(value, Exception):
+                raise value
+
+        experiments = []
+        for index, name in enumerate(names):
+            exists, alternative_names, version, weights, data = \
+                result[5 * index:5 * index + 5]
+            if not exists:
+                continue
+            for value in (alternative_names, version, weights, data):
+                if isinstance(value, Exception):
+                    raise value
+            if alternative_names:
+                experiment = cls(redis, name, *alternative_names)
+                experiment._apply_weights(weights)
+                experiment._preloaded = {
+                    'version': version,
+                    'winner': winners[index],
+                    'start_time': start_times[index],
+                }
+            else:
+                experiment = cls._from_compact(redis, name, data)
+                if experiment is None:
+                    continue
+            for alternative in experiment.alternatives:
+                alternative._experiment = experiment
+                if counters and experiment.compact:
+                    alternative._counters = data
+            experiments.append(experiment)
+        return experiments
 
     @classmethod
     def find(cls, redis, name):
-        if name in redis:
-            return cls(redis, name, *cls.load_alternatives_for(redis, name))
+        alternatives = cls.load_alternatives_for(redis, name)
+        if alternatives:
+            experiment = cls(redis, name, *alternatives)
+            experiment._apply_weights(redis.hgetall(experiment.weights_key))
+            return experiment
+        data = redis.hgetall(_compact_key(name))
+        return cls._from_compact(redis, name, data)
 
     @classmethod
-    def find_or_create(cls, redis, key, *alternatives):
+    @traced('find_or_create', argument='key')
+    def find_or_create(cls, redis, key, *alternatives, **kwargs):
+        """
+        Return the experiment with the given alternatives, creating it or
+        replacing an existing definition with different alternatives.
+
+        If the experiment already exists as defined, which is the common
+        case, it is loaded along with its version, winner and weights in a
+        single round trip.  The given weights are used unless the weights
+        were changed with :meth:`set_weights`, which take precedence until
+        the experiment is redefined.  Creating and redefining experiments is
+        atomic and safe to run concurrently.
+
+        :param compact: Whether to create the experiment in the compact
+            layout if it does not exist yet.  Existing experiments stay in
+            the layout they are stored in.
+
+        Archived experiments are not recreated.  Instead, an experiment
+        that only holds the archived winner is returned, see
+        :mod:`flask_split.archive`.
+        """
         name = key.split(':')[0]
+        compact = kwargs.pop('compact', False)
 
         if len(alternatives) < 2:
             raise TypeError('You must declare at least 2 alternatives.')
 
-        experiment = cls.find(redis, name)
-        if experiment:
-            alts = [a[0] if isinstance(a, tuple) else a for a in alternatives]
-            if [a.name for a in experiment.alternatives] != alts:
-                experiment.reset()
-                for alternative in experiment.alternatives:
-                    alternative.delete()
-                experiment = cls(redis, name, *alternatives)
-                experiment.save()
+        experiment = cls(redis, name, *alternatives, **kwargs)
+        pipe = redis.pipeline(transaction=False)
+        pipe.lrange(name, 0, -1)
+        pipe.get('%s:version' % name)
+        pipe.hget('experiment_winner', name)
+        pipe.hgetall(experiment.weights_key)
+        pipe.hgetall(experiment.compact_key)
+        pipe.hget('experiment_archived_winners', name)
+        current, version, winner, weights, data, archived_winner = \
+            pipe.execute()
+        stored = cls._from_compact(redis, name, data)
+        if current == experiment.alternative_names:
+            experiment._apply_weights(weights)
+            experiment._preloaded = {'version': version, 'winner': winner}
+        elif stored is not None and \
+                stored.alternative_names == experiment.alternative_names:
+            experiment = stored._with_given_weights(experiment, data)
+        elif archived_winner and not current and stored is None:
+            experiment._set_archived(archived_winner)
         else:
-            experiment = cls(redis, name, *alternatives)
-            experiment.save()
+            if stored is not None or (compact and not current):
+                experiment = cls(redis, name, *alternatives, compact=True)
+            experiment._save(redefine=True)
         return experiment
 
     def _get_time(self):
         return datetime.now()
+
+
+def _compact_weights(data):
+    """
+    Return the weights set with :meth:`Experiment.set_weights` in the
+    compact hash `data`, as a dictionary mapping alternative names to them.
+    """
+    return dict(
+        (field[len('weight:'):], value)
+        for field, value in data.items()
+        if field.startswith('weight:')
+    )
+
+
+def _parse_weight(value):
+    weight = float(value)
+    return int(weight) if weight.is_integer() else weight
+
+
+def _error_bound(variance):
+    """Return the 95% error bound of an estimate with the given variance."""
+    return int(round(1.96 * sqrt(variance)))
+
+
+def _effective_count(count, variance):
+    """
+    Return the number of exactly counted events that carries as much
+    information as an estimated `count` with the given `variance`.
+
+    For an exact count the variance is 0 and the count itself is returned.
+    """
+    if count <= 0:
+        return 0
+    return count * count / (count + variance)
+
+
+def _compact_key(name):
+    """Return the key of the hash of the experiment `name` in the compact
+    layout."""
+    return '%s:experiment' % name
+
+
+def _compact_alternative_names(data):
+    """
+    Return the names of the alternatives in order from `data`, the contents
+    of an experiment's hash in the compact layout.
+    """
+    names = []
+    while 'alternative:%d' % len(names) in data:
+        names.append(data['alternative:%d' % len(names)])
+    return names
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.monitor
+    ~~~~~~~~~~~~~~~~~~~
+
+    A background monitor that notifies when an alternative of an experiment
+    becomes significantly better or worse than the control.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+import json
+
+try:
+    from urllib.request import Request, urlopen
+except ImportError:
+    from urllib2 import Request, urlopen
+
+from .models import Experiment
+
+
+#: The key of the set of the names of the experiments whose counters
+#: changed since the monitor last ran.
+CHANGES_KEY = 'split:changed'
+
+#: The key of the hash remembering which alternatives the monitor has
+#: already notified about, by experiment, version and alternative.
+NOTIFIED_KEY = 'split:notified'
+
+
+class SignificanceMonitor(object):
+    """
+    Evaluates the experiments whose counters changed since the last run and
+    calls `callback` when an alternative crosses the significance
+    threshold.
+
+    The names of the changed experiments are collected in the
+    :data:`CHANGES_KEY` set by the code that writes the counters.  Each run
+    takes the set over atomically and loads the changed experiments with a
+    constant number of round trips, so the cost of a run grows with the
+    number of changed experiments, not with the number of all experiments.
+
+    The callback is called once per version of an experiment and
+    alternative, with a dictionary describing the result, see
+    :meth:`evaluate`.  If the callback raises an exception, the experiment
+    is evaluated again on the next run.
+
+    :param redis: The Redis connection.
+    :param callback: The function to call with each result.
+    :param z_score: The absolute z-score an alternative must reach, e.g.
+        ``1.96`` for 95% confidence.
+    :param min_participants: The number of participants both the
+        alternative and the control must have before the alternative is
+        evaluated, which guards against noise early in the experiment.
+    """
+
+    def __init__(self, redis, callback, z_score=1.96, min_participants=100):
+        self.redis = redis
+        self.callback = callback
+        self.z_score = z_score
+        self.min_participants = min_participants
+
+    def run(self):
+        """
+        Evaluate the changed experiments once.
+
+        :return: The list of results the callback was called with.
+        """
+        pipe = self.redis.pipeline()
+        pipe.smembers(CHANGES_KEY)
+        pipe.unlink(CHANGES_KEY)
+        names = sorted(pipe.execute()[0])
+        if not names:
+            return []
+        done = set()
+        try:
+            return self._notify(names, done)
+        finally:
+            # Evaluate the experiments that were not processed again on the
+            # next run, e.g. because Redis or the callback failed.
+            mark_changed(self.redis,
+                         *[name for name in names if name not in done])
+
+    def _notify(self, names, done):
+        results = []
+        for experiment in Experiment.find_many(self.redis, names):
+            results.extend(self.evaluate(experiment))
+        pending = dict((name, 0) for name in names)
+        for result in results:
+            pending[result['experiment']] += 1
+        done.update(name for name in names if not pending[name])
+        if not results:
+            return []
+
+        fields = [_notified_field(result) for result in results]
+        notified = []
+        for field, result, sent in zip(
+                fields, results, self.redis.hmget(NOTIFIED_KEY, fields)):
+            if not sent:
+                self.callback(result)
+                self.redis.hset(NOTIFIED_KEY, field, 1)
+                notified.append(result)
+            pending[result['experiment']] -= 1
+            if not pending[result['experiment']]:
+                done.add(result['experiment'])
+        return notified
+
+    def evaluate(self, experiment):
+        """
+        Return a list of results for the alternatives of `experiment` that
+        are significantly better or worse than the control.  Experiments
+        with a winner are skipped.
+
+        Each result is a dictionary with the ``experiment`` name, its
+        ``version``, the ``alternative`` and the ``control``, the
+        ``z_score`` and ``confidence_level`` of the alternative and the
+        ``participant_count`` and ``conversion_rate`` of both.
+        """
+        if experiment.winner is not None:
+            return []
+        control = experiment.control
+        if control.participant_count < self.min_participants:
+            return []
+        results = []
+        for alternative in experiment.alternatives[1:]:
+            if alternative.participant_count < self.min_participants:
+                continue
+            z_score = alternative.z_score
+            if z_score is None or abs(z_score) < self.z_score:
+                continue
+            results.append({
+                'experiment': experiment.name,
+                'version': experiment.version,
+                'alternative': alternative.name,
+                'control': control.name,
+                'z_score': z_score,
+                'confidence_level': alternative.confidence_level,
+                'participant_count': alternative.participant_count,
+                'conversion_rate': alternative.conversion_rate,
+                'control_participant_count': control.participant_count,
+                'control_conversion_rate': control.conversion_rate,
+            })
+        return results
+
+
+def mark_changed(redis, *names):
+    """
+    Add the experiments `names` to the set of changed experiments.
+
+    :param redis: A Redis connection or a pipeline.
+    """
+    if names:
+        redis.sadd(CHANGES_KEY, *names)
+
+
+def post_webhook(url, timeout=10):
+    """
+    Return a monitor callback that posts each result as JSON to `url`.
+    """
+    def callback(result):
+        request = Request(url, json.dumps(result).encode('utf-8'),
+                          {'Content-Type': 'application/json'})
+        urlopen(request, timeout=timeout).close()
+    return callback
+
+
+def _notified_field(result):
+    return '%s:%s:%s' % (result['experiment'], result['version'],
+                         result['alternative'])
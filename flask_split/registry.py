@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.registry
+    ~~~~~~~~~~~~~~~~~~~~
+
+    This module provides a registry of experiments that are declared up
+    front instead of implicitly by the first call to
+    :func:`~flask_split.ab_test`.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+import hashlib
+import json
+import time
+
+from .bandit import ALLOCATIONS, allocation_weights
+from .models import Experiment, _compact_key
+
+
+_now = getattr(time, 'monotonic', time.time)
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+#: The number of slots each layer is divided into.
+LAYER_SLOTS = 1000
+
+#: The options of an experiment and their defaults.  Both are fractions in
+#: the range (0, 1].
+_DEFAULT_OPTIONS = {
+    'traffic': 1,
+    'sample_rate': 1,
+}
+
+
+class ExperimentRegistry(object):
+    """
+    A registry of declared experiments.
+
+    The definitions of the registered experiments are validated and created
+    in Redis all at once by :meth:`refresh`, and then served from memory.
+    Their version, winner and weights are reloaded with a single pipeline at
+    most once every `ttl` seconds, so that changes made from the dashboard
+    or the command line are picked up.
+
+    Experiments registered with an adaptive `allocation` mode get their
+    weights computed from their counters, see :mod:`flask_split.bandit`.
+    The weights are computed by :meth:`allocate`, outside of requests, and
+    stored in the global ``experiment_allocations`` hash, from which they
+    are loaded along with the experiments.
+
+    Experiments registered in the same `layer` are mutually exclusive: each
+    visitor is eligible for exactly one of them, decided by a hash of the
+    visitor's id, see :meth:`is_eligible`.
+
+    :param ttl: The number of seconds the loaded experiments are served from
+        memory before they are reloaded.
+    """
+
+    def __init__(self, ttl=5):
+        self.ttl = ttl
+        self._definitions = {}
+        self._options = {}
+        self._experiments = {}
+        self._layers = {}
+        self._slot_tables = {}
+        self._loaded_at = None
+
+    def __contains__(self, name):
+        return name in self._definitions
+
+    def __len__(self):
+        return len(self._definitions)
+
+    @property
+    def names(self):
+        """A sorted list of the names of the registered experiments."""
+        return sorted(self._definitions)
+
+    def register(self, name, *alternatives, **options):
+        """
+        Register an experiment.
+
+        :param name: Name of the experiment.
+        :param alternatives: The alternatives of the experiment, in the same
+            form as given to :func:`~flask_split.ab_test`.
+        :param options: The `traffic` and `sample_rate` options, see
+            :func:`~flask_split.ab_test`, and the `allocation` mode, one of
+            :data:`~flask_split.bandit.ALLOCATIONS`, with the `epsilon` of
+            the ``'epsilon-greedy'`` mode, and the name of the `layer` of
+            mutually exclusive experiments the experiment belongs to.
+        :raises TypeError: if there are less than two alternatives or an
+            unknown option is given.
+        :raises ValueError: if the definition is otherwise invalid.
+        """
+        allocation = options.pop('allocation', 'weights')
+        if allocation not in ALLOCATIONS:
+            raise ValueError('Unknown allocation: %r' % allocation)
+        epsilon = _validate_fraction('epsilon', options.pop('epsilon', 0.1))
+        layer = options.pop('layer', None)
+        if layer is not None and \
+                (not isinstance(layer, string_types) or not layer):
+            raise ValueError('Invalid layer: %r' % (layer,))
+        options = _parse_options(options)
+        options.update(allocation=allocation, epsilon=epsilon, layer=layer)
+        if len(alternatives) < 2:
+            raise TypeError('You must declare at least 2 alternatives.')
+        if not name or ':' in name:
+            raise ValueError('Invalid experiment name: %r' % name)
+        names = []
+        for alternative in alternatives:
+            if isinstance(alternative, (tuple, list)):
+                alternative_name, weight = alternative
+                if isinstance(weight, bool) or \
+                        not isinstance(weight, (int, float)) or weight <= 0:
+                    raise ValueError(
+                        'Invalid weight for %r: %r' % (alternative_name,
+                                                       weight))
+            else:
+                alternative_name = alternative
+            names.append(alternative_name)
+        if len(set(names)) != len(names):
+            raise ValueError('Duplicate alternatives in %r.' % name)
+        self._definitions[name] = tuple(
+            tuple(a) if isinstance(a, list) else a for a in alternatives)
+        self._options[name] = options
+        self._layers = _group_layers(self._options)
+        self._slot_tables = {}
+        self._loaded_at = None
+
+    def alternative_names(self, name):
+        """Return the names of the alternatives of a registered experiment."""
+        return [
+            a[0] if isinstance(a, tuple) else a
+            for a in self._definitions[name]
+        ]
+
+    def options(self, name):
+        """Return the options of a registered experiment as a dictionary."""
+        return self._options[name]
+
+    def layer(self, name):
+        """
+        Return the layer of the experiment with the given name, or `None` if
+        it is not registered in a layer.
+        """
+        options = self._options.get(name)
+        return options['layer'] if options else None
+
+    def is_eligible(self, name, visitor_id):
+        """
+        Return `True` if the visitor with the given id may take part in the
+        registered experiment `name`.
+
+        The visitor is put in one of the :data:`LAYER_SLOTS` slots of the
+        layer of the experiment by the MD5 hash of the layer name and
+        `visitor_id`, and is eligible only for the experiment the slot
+        belongs to, see :func:`_slot_table`.  Neither the session nor Redis
+        is read.  Experiments outside of layers are always eligible.
+        """
+        layer = self._options[name]['layer']
+        if layer is None:
+            return True
+        table = self._slot_tables.get(layer)
+        if table is None:
+            table = self._slot_tables[layer] = _slot_table(
+                layer, self._layers[layer])
+        return table[_layer_slot(layer, visitor_id)] == name
+
+    def is_fresh(self):
+        """
+        Return `True` if the experiments are loaded and younger than the TTL,
+        so that :meth:`get` serves them without reloading.
+        """
+        return self._loaded_at is not None and \
+            _now() - self._loaded_at <= self.ttl
+
+    def get(self, redis, name, compact=False):
+        """
+        Return the registered experiment with the given name, reloading all
+        experiments first if they are older than the TTL.
+        """
+        if not self.is_fresh():
+            self.refresh(redis, compact)
+        return self._experiments[name]
+
+    def refresh(self, redis, compact=False):
+        """
+        Load all registered experiments from Redis in a single pipeline,
+        creating the ones that do not exist yet and redefining the ones whose
+        alternatives differ from their registered definition.  Archived
+        experiments are not recreated but serve their archived winner.
+
+        :param compact: Whether to create missing experiments in the compact
+            layout.  Existing experiments stay in the layout they are stored
+            in.
+        """
+        names = self.names
+        pipe = redis.pipeline(transaction=False)
+        for name in names:
+            pipe.lrange(name, 0, -1)
+            pipe.get('%s:version' % name)
+            pipe.hget('experiment_winner', name)
+            pipe.hgetall('%s:weights' % name)
+            pipe.hgetall(_compact_key(name))
+            pipe.hget('experiment_archived_winners', name)
+            pipe.hget('experiment_allocations', name)
+        result = pipe.execute()
+
+        experiments = {}
+        allocations = {}
+        saved = []
+        for index, name in enumerate(names):
+            current, version, winner, weights, data, archived_winner, \
+                allocation = result[7 * index:7 * index + 7]
+            allocations[name] = allocation
+            experiment = Experiment(redis, name, *self._definitions[name])
+            stored = Experiment._from_compact(redis, name, data)
+            if current == experiment.alternative_names:
+                experiment._apply_weights(weights)
+                experiment._preloaded = {
+                    'version': version, 'winner': winner}
+            elif stored is not None and \
+                    stored.alternative_names == experiment.alternative_names:
+                experiment = stored._with_given_weights(experiment, data)
+            elif archived_winner and not current and stored is None:
+                experiment._set_archived(archived_winner)
+            else:
+                if stored is not None or (compact and not current):
+                    experiment = Experiment(
+                        redis, name, *self._definitions[name], compact=True)
+                experiment._save(redefine=True)
+                saved.append(experiment)
+            experiments[name] = experiment
+
+        if saved:
+            pipe = redis.pipeline(transaction=False)
+            for experiment in saved:
+                if experiment.compact:
+                    pipe.hget(experiment.compact_key, 'version')
+                else:
+                    pipe.get('%s:version' % experiment.name)
+                pipe.hget(*experiment._winner_field)
+            result = pipe.execute()
+            for index, experiment in enumerate(saved):
+                experiment._preloaded = {
+                    'version': result[2 * index],
+                    'winner': result[2 * index + 1],
+                }
+        for experiment in self._adaptive(experiments):
+            allocation = allocations[experiment.name]
+            if allocation:
+                allocation = json.loads(allocation)
+                # Weights computed for another version of the experiment,
+                # e.g. before a reset, are ignored until they are recomputed.
+                if allocation['key'] == experiment.key:
+                    experiment._apply_weights(allocation['weights'])
+        self._experiments = experiments
+        self._loaded_at = _now()
+
+    def _adaptive(self, experiments):
+        return [
+            experiment
+            for name, experiment in sorted(experiments.items())
+            if self._options[name]['allocation'] != 'weights' and
+            not experiment.archived and not experiment.winner
+        ]
+
+    def allocate(self, redis, compact=False):
+        """
+        Reload the registered experiments, recompute the weights of the ones
+        with an adaptive allocation from their counters, and store them in
+        Redis, where every process picks them up with its next reload.
+
+        This samples the posteriors of Thompson sampling, so it is run
+        periodically by ``flask split allocate`` instead of by requests.
+        Experiments with a winner are skipped.
+
+        :param compact: Whether to create missing experiments in the compact
+            layout, see :meth:`refresh`.
+        :return: A dictionary mapping the names of the experiments to their
+            new weights.
+        """
+        self.refresh(redis, compact)
+        due = self._adaptive(self._experiments)
+        if not due:
+            return {}
+        pipe = redis.pipeline(transaction=False)
+        for experiment in due:
+            for alternative in experiment.alternatives:
+                pipe.hmget(alternative.key,
+                           alternative._field('participant_count'),
+                           alternative._field('completed_count'))
+        result = iter(pipe.execute())
+        allocations = {}
+        pipe = redis.pipeline(transaction=False)
+        for experiment in due:
+            options = self._options[experiment.name]
+            counts = [
+                tuple(float(value or 0) for value in next(result))
+                for _ in experiment.alternatives
+            ]
+            weights = dict(zip(
+                experiment.alternative_names,
+                allocation_weights(options['allocation'], counts,
+                                   options['epsilon'])
+            ))
+            experiment._apply_weights(weights)
+            allocations[experiment.name] = weights
+            pipe.hset('experiment_allocations', experiment.name, json.dumps(
+                {'key': experiment.key, 'weights': weights}, sort_keys=True))
+        pipe.execute()
+        return allocations
+
+
+def _group_layers(options):
+    """
+    Return a dictionary mapping each layer to the sorted names of the
+    experiments in it.
+    """
+    layers = {}
+    for name, experiment_options in sorted(options.items()):
+        if experiment_options['layer'] is not None:
+            layers.setdefault(experiment_options['layer'], []).append(name)
+    return layers
+
+
+def _layer_slot(layer, visitor_id):
+    """
+    Return the slot of `layer` that the visitor with the given id is in.
+    """
+    digest = hashlib.md5(
+        ('%s:%s' % (layer, visitor_id)).encode('utf-8')).hexdigest()
+    return int(digest, 16) % LAYER_SLOTS
+
+
+def _slot_table(layer, names):
+    """
+    Return a list mapping the slots of `layer` to the experiments among
+    `names` they belong to.
+
+    Each experiment scores each slot by the MD5 hash of the layer name, the
+    experiment name and the slot, and the slot belongs to the experiment
+    with the highest score.  Adding an experiment to a layer thus only
+    moves the slots it wins from the other experiments, and removing one
+    only moves its own slots.
+    """
+    def score(name, slot):
+        return hashlib.md5(
+            ('%s:%s:%d' % (layer, name, slot)).encode('utf-8')
+        ).hexdigest()
+    return [
+        max(names, key=lambda name: score(name, slot))
+        for slot in range(LAYER_SLOTS)
+    ]
+
+
+def _parse_options(options):
+    """
+    Validate the options of an experiment and fill in the defaults of the
+    missing ones.
+
+    :raises TypeError: if an unknown option is given.
+    :raises ValueError: if an option is not a fraction in the range (0, 1].
+    """
+    unknown = set(options) - set(_DEFAULT_OPTIONS)
+    if unknown:
+        raise TypeError('Unknown options: %s' % ', '.join(sorted(unknown)))
+    result = dict(_DEFAULT_OPTIONS, **options)
+    for option, value in result.items():
+        _validate_fraction(option, value)
+    return result
+
+
+def _validate_fraction(option, value):
+    """
+    Check that the value of `option` is a fraction in the range (0, 1] and
+    return it.
+
+    :raises ValueError: if the value is out of range or not a number.
+    """
+    if isinstance(value, bool) or \
+            not isinstance(value, (int, float)) or not 0 < value <= 1:
+        raise ValueError('Invalid %s: %r' % (option, value))
+    return value
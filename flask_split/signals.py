@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.signals
+    ~~~~~~~~~~~~~~~~~~~
+
+    Signals sent when visitors take part in or convert in experiments and
+    when experiments are changed, e.g. for forwarding them to an analytics
+    pipeline.
+
+    All signals are sent with the application as the sender and the
+    :class:`~flask_split.models.Experiment` as the `experiment` keyword
+    argument.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+import os
+import threading
+
+try:
+    from queue import Full, Queue
+except ImportError:
+    from Queue import Full, Queue
+
+from flask import current_app
+from flask.signals import Namespace
+
+
+_signals = Namespace()
+
+#: Sent when the current visitor starts taking part in an experiment and is
+#: counted as a participant of the `alternative`.
+experiment_started = _signals.signal('experiment-started')
+
+#: Sent whenever :func:`~flask_split.ab_test` shows the `alternative` to a
+#: visitor taking part in an experiment, including returning visitors.
+alternative_assigned = _signals.signal('alternative-assigned')
+
+#: Sent when a conversion of the current visitor is counted for the
+#: `alternative`.
+conversion_tracked = _signals.signal('conversion-tracked')
+
+#: Sent when the `alternative` is chosen as the winner of an experiment.
+winner_set = _signals.signal('winner-set')
+
+#: Sent when the data of an experiment is reset.
+experiment_reset = _signals.signal('experiment-reset')
+
+#: Sent when an experiment is deleted.
+experiment_deleted = _signals.signal('experiment-deleted')
+
+
+class SignalDispatcher(object):
+    """
+    Sends signals from a pool of worker threads instead of the thread that
+    emits them, so that slow receivers do not delay the request.
+
+    The signals wait in a queue of at most `queue_size` entries.  When the
+    queue is full, further signals are dropped rather than blocking the
+    request.  The receivers are called in an application context.  Their
+    exceptions are logged to the application's logger.
+
+    The threads are started on the first signal in each process, so that
+    the dispatcher can be created before a preforking server forks.
+
+    :param workers: The number of worker threads.
+    :param queue_size: The maximum number of signals waiting to be sent.
+    """
+
+    def __init__(self, workers=2, queue_size=1000):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def dispatch(self, signal, sender, **kwargs):
+        """
+        Queue `signal` to be sent by `sender` with the keyword arguments.
+
+        :return: `True` if the signal was queued, or `False` if it was
+            dropped because the queue is full.
+        """
+        self._start()
+        try:
+            self._queue.put_nowait((signal, sender, kwargs))
+        except Full:
+            return False
+        return True
+
+    def join(self):
+        """Wait until all queued signals have been sent."""
+        if self._queue is not None:
+            self._queue.join()
+
+    def close(self):
+        """Send the queued signals and stop the worker threads."""
+        if self._queue is not None and self._pid == os.getpid():
+            for _ in range(self.workers):
+                self._queue.put(None)
+            self._queue.join()
+        self._pid = self._queue = None
+
+    def _start(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._queue = Queue(self.queue_size)
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._run,
+                                          args=(self._queue,))
+                thread.daemon = True
+                thread.start()
+            self._pid = pid
+
+    def _run(self, queue):
+        while True:
+            item = queue.get()
+            try:
+                if item is None:
+                    return
+                signal, sender, kwargs = item
+                with sender.app_context():
+                    signal.send(sender, **kwargs)
+            except Exception:
+                sender.logger.exception(
+                    'Exception in a receiver of %s', signal.name)
+            finally:
+                queue.task_done()
+
+
+def _send(signal, **kwargs):
+    """
+    Send `signal` from the current application, through its signal
+    dispatcher if ``SPLIT_SIGNAL_WORKERS`` is set.  Does nothing if the
+    signal has no receivers, or if blinker is not installed on Flask
+    versions whose fake signals have no receivers at all.
+    """
+    if not getattr(signal, 'receivers', None):
+        return
+    from .utils import _get_signal_dispatcher
+    app = current_app._get_current_object()
+    dispatcher = _get_signal_dispatcher(app)
+    if dispatcher is None:
+        signal.send(app, **kwargs)
+    elif not dispatcher.dispatch(signal, app, **kwargs):
+        app.logger.warning('Dropped %s, the signal queue is full.',
+                           signal.name)
@@ -1,7 +1,8 @@
 $(function () {
     $('[rel=tooltip]').tooltip();
 
-    var modalConfirmDelete = $('#modal-confirm-delete'),
+    var modalConfirmArchive = $('#modal-confirm-archive'),
+        modalConfirmDelete = $('#modal-confirm-delete'),
         modalConfirmReset = $('#modal-confirm-reset'),
         modalConfirmWinner = $('#modal-confirm-winner');
 
@@ -17,6 +18,12 @@ $(function () {
         return false;
     });
 
+    modalConfirmArchive.find('.btn-primary').on('click', function () {
+        var form = modalConfirmArchive.data('form');
+        form.submit();
+        return false;
+    });
+
     modalConfirmWinner.find('.btn-success').click(function () {
         var form = modalConfirmWinner.data('form');
         form.submit();
@@ -30,6 +37,13 @@ $(function () {
         return false;
     });
 
+    $('.form-archive-experiment').on('submit', function () {
+        modalConfirmArchive
+            .modal('show')
+            .data('form', this);
+        return false;
+    });
+
     $('.form-delete-experiment').on('submit', function () {
         modalConfirmDelete
             .modal('show')
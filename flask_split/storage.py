@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.storage
+    ~~~~~~~~~~~~~~~~~~~
+
+    Online migration of experiments between the storage layouts, and a
+    report comparing the memory used by the layouts.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+import time
+import uuid
+
+from .backup import _to_keys, _to_record, _write_keys, iter_experiment_names
+from .models import (
+    COUNTER_FIELDS,
+    Experiment,
+    _compact_alternative_names,
+    _compact_key,
+    _compact_weights,
+    _parse_weight
+)
+
+
+#: The storage layouts.  ``'keys'`` keeps the counters of each alternative
+#: and the alternatives, version and weights of each experiment in keys of
+#: their own, ``'compact'`` keeps each experiment in a single hash.
+LAYOUTS = ('keys', 'compact')
+
+#: The counters that are stored even when they are zero.
+_REQUIRED_COUNTERS = ('participant_count', 'completed_count')
+
+
+def migrate_experiment(redis, name, compact=True):
+    """
+    Convert the experiment `name` to the compact layout, or back to the
+    default layout if `compact` is `False`.
+
+    The conversion runs in a transaction that is retried if the experiment
+    is modified concurrently, so that it is safe to run while the
+    application serves requests.  Processes that loaded the experiment
+    before the conversion may still write increments in the old layout
+    until their cache expires.  Migrating an experiment that has already
+    been converted folds such increments into the new layout.
+
+    :return: `True` if the experiment was converted or increments were
+        folded, or `False` if there was nothing to do.
+    """
+    convert = _convert_to_compact if compact else _convert_to_keys
+    return redis.transaction(
+        lambda pipe: convert(pipe, name),
+        name, _compact_key(name),
+        value_from_callable=True
+    )
+
+
+def migrate_experiments(redis, compact=True, throttle=0, callback=None,
+                        chunk_size=100):
+    """
+    Migrate all experiments with :func:`migrate_experiment`.
+
+    :param throttle: The number of seconds to sleep between chunks of
+        `chunk_size` experiments.
+    :param callback: An optional function called with the name of each
+        migrated experiment.
+    :return: The number of migrated experiments.
+    """
+    count = 0
+    for names in iter_experiment_names(redis, chunk_size):
+        for name in names:
+            if migrate_experiment(redis, name, compact):
+                count += 1
+                if callback is not None:
+                    callback(name)
+        if throttle:
+            time.sleep(throttle)
+    return count
+
+
+def memory_report(redis, sample=100):
+    """
+    Compare the memory used by the storage layouts.
+
+    Up to `sample` random experiments are written in both layouts under
+    temporary keys, measured with ``MEMORY USAGE`` and removed again.  The
+    entries of the sampled experiments in the global ``experiment_winner``
+    and ``experiment_start_times`` hashes are measured as hashes of their
+    own.
+
+    :return: A dictionary with the number of sampled ``experiments`` and,
+        for each layout, a dictionary with the number of ``keys`` and the
+        ``bytes`` they use.
+    """
+    names = redis.srandmember('experiments', sample) or []
+    records = [
+        _to_record(experiment)
+        for experiment in Experiment.find_many(redis, sorted(names))
+    ]
+    prefix = 'split:memory-report:%s:' % uuid.uuid4().hex
+    report = {'experiments': len(records)}
+    for layout in LAYOUTS:
+        keys = sorted(_to_keys(records, compact=layout == 'compact').items())
+        if not keys:
+            report[layout] = {'keys': 0, 'bytes': 0}
+            continue
+        pipe = redis.pipeline(transaction=False)
+        _write_keys(pipe, dict(keys), prefix)
+        for key, _ in keys:
+            pipe.memory_usage(prefix + key, samples=0)
+        pipe.unlink(*[prefix + key for key, _ in keys])
+        usage = pipe.execute()[len(keys):-1]
+        # The temporary prefix is not part of the real keys.
+        report[layout] = {
+            'keys': len(keys),
+            'bytes': sum(usage) - len(prefix) * len(keys),
+        }
+    return report
+
+
+def _convert_to_compact(pipe, name):
+    key = _compact_key(name)
+    alternative_names = pipe.lrange(name, 0, -1)
+    data = pipe.hgetall(key)
+    if not alternative_names:
+        return _fold_counter_keys(pipe, name, data)
+
+    version_key = '%s:version' % name
+    weights_key = '%s:weights' % name
+    counter_keys = _counter_keys(name, alternative_names)
+    pipe.watch(version_key, weights_key, 'experiment_winner',
+               'experiment_start_times', *counter_keys)
+    version = pipe.get(version_key)
+    weights = pipe.hgetall(weights_key)
+    winner = pipe.hget('experiment_winner', name)
+    start_time = pipe.hget('experiment_start_times', name)
+
+    fields = {}
+    for index, alternative_name in enumerate(alternative_names):
+        counters = pipe.hgetall(counter_keys[index])
+        fields['alternative:%d' % index] = alternative_name
+        if alternative_name in weights:
+            fields['weight:%s' % alternative_name] = weights[alternative_name]
+        for field in COUNTER_FIELDS:
+            compact_field = '%s:%s' % (field, alternative_name)
+            total = _add(counters.get(field), data.get(compact_field))
+            if total or field in _REQUIRED_COUNTERS:
+                fields[compact_field] = total
+    if version:
+        fields['version'] = version
+    if winner:
+        fields['winner'] = winner
+    if start_time:
+        fields['start_time'] = start_time
+
+    pipe.multi()
+    pipe.unlink(key, name, version_key, weights_key, *counter_keys)
+    pipe.hmset(key, fields)
+    pipe.hdel('experiment_winner', name)
+    pipe.hdel('experiment_start_times', name)
+    return True
+
+
+def _convert_to_keys(pipe, name):
+    key = _compact_key(name)
+    data = pipe.hgetall(key)
+    alternative_names = _compact_alternative_names(data)
+    if not alternative_names:
+        return _fold_compact_fields(pipe, name, data)
+
+    version_key = '%s:version' % name
+    weights_key = '%s:weights' % name
+    counter_keys = _counter_keys(name, alternative_names)
+    pipe.watch(*counter_keys)
+    counters = [pipe.hgetall(counter_key) for counter_key in counter_keys]
+
+    pipe.multi()
+    pipe.unlink(key, name, version_key, weights_key, *counter_keys)
+    pipe.rpush(name, *alternative_names)
+    weights = _compact_weights(data)
+    if weights:
+        pipe.hmset(weights_key, weights)
+    for alternative_name, counter_key, values in zip(
+            alternative_names, counter_keys, counters):
+        fields = {}
+        for field in COUNTER_FIELDS:
+            total = _add(values.get(field),
+                         data.get('%s:%s' % (field, alternative_name)))
+            if total or field in _REQUIRED_COUNTERS:
+                fields[field] = total
+        pipe.hmset(counter_key, fields)
+    if data.get('version'):
+        pipe.set(version_key, data['version'])
+    for field, global_key in (('winner', 'experiment_winner'),
+                              ('start_time', 'experiment_start_times')):
+        if data.get(field):
+            pipe.hset(global_key, name, data[field])
+        else:
+            pipe.hdel(global_key, name)
+    return True
+
+
+def _fold_counter_keys(pipe, name, data):
+    """
+    Fold the counters of an experiment in the compact layout that were
+    incremented in the keys of the default layout into its hash.
+    """
+    alternative_names = _compact_alternative_names(data)
+    if not alternative_names:
+        return False
+    counter_keys = _counter_keys(name, alternative_names)
+    pipe.watch(*counter_keys)
+    counters = [pipe.hgetall(counter_key) for counter_key in counter_keys]
+    if not any(counters):
+        return False
+    pipe.multi()
+    key = _compact_key(name)
+    for alternative_name, values in zip(alternative_names, counters):
+        for field, value in values.items():
+            if field in COUNTER_FIELDS:
+                _increment(pipe, key, '%s:%s' % (field, alternative_name),
+                           value)
+    pipe.unlink(*[
+        counter_key
+        for counter_key, values in zip(counter_keys, counters)
+        if values
+    ])
+    return True
+
+
+def _fold_compact_fields(pipe, name, data):
+    """
+    Fold the counters of an experiment in the default layout that were
+    incremented in the hash of the compact layout into its keys.
+    """
+    strays = [
+        (alternative_name, field)
+        for alternative_name in pipe.lrange(name, 0, -1)
+        for field in COUNTER_FIELDS
+        if '%s:%s' % (field, alternative_name) in data
+    ]
+    if not strays:
+        return False
+    pipe.multi()
+    key = _compact_key(name)
+    for alternative_name, field in strays:
+        compact_field = '%s:%s' % (field, alternative_name)
+        _increment(pipe, '%s:%s' % (name, alternative_name), field,
+                   data[compact_field])
+        pipe.hdel(key, compact_field)
+    return True
+
+
+def _counter_keys(name, alternative_names):
+    return [
+        '%s:%s' % (name, alternative_name)
+        for alternative_name in alternative_names
+    ]
+
+
+def _increment(pipe, key, field, value):
+    pipe.hincrbyfloat(key, field, _parse_weight(value))
+
+
+def _add(a, b):
+    return _parse_weight(float(a or 0) + float(b or 0))
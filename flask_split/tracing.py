@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_split.tracing
+    ~~~~~~~~~~~~~~~~~~~
+
+    Optional OpenTelemetry spans around :func:`~flask_split.ab_test`,
+    :func:`~flask_split.finished` and the Redis round trips they make.  If
+    OpenTelemetry is not installed, this module does nothing.
+
+    :copyright: (c) 2012-2015 by Janne Vanhala.
+    :license: MIT, see LICENSE for more details.
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+import inspect
+import threading
+
+import redis
+from redis.client import Pipeline
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+
+#: The prefix of the names of the spans and their attributes.
+PREFIX = 'split.'
+
+#: The Redis commands that run a Lua script.
+SCRIPT_COMMANDS = frozenset(['EVAL', 'EVALSHA'])
+
+_tracer = None
+_local = threading.local()
+
+
+def get_tracer():
+    """
+    Return the OpenTelemetry tracer of Flask-Split, or `None` if
+    OpenTelemetry is not installed.
+    """
+    global _tracer
+    if _tracer is None and trace is not None:
+        _tracer = trace.get_tracer('flask_split')
+    return _tracer
+
+
+@contextmanager
+def start_span(name, **attributes):
+    """
+    Run the block in a span called ``split.<name>`` with the given
+    attributes, which are prefixed with ``split.`` as well.  The span also
+    gets a ``split.round_trips`` attribute counting the round trips to
+    Redis made within it, including those of nested spans.
+
+    Does nothing if OpenTelemetry is not installed.
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        yield
+        return
+    with tracer.start_as_current_span(PREFIX + name) as span:
+        _set_attributes(span, attributes)
+        active = [span, 0]
+        stack = _get_stack()
+        stack.append(active)
+        try:
+            yield
+        finally:
+            stack.remove(active)
+            span.set_attribute(PREFIX + 'round_trips', active[1])
+
+
+def traced(name, argument='experiment_name'):
+    """
+    Return a decorator that runs the function in a span, see
+    :func:`start_span`, with the function's parameter called `argument` as
+    the ``split.experiment`` attribute, whether it is passed by position or
+    by keyword.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if get_tracer() is None:
+                return function(*args, **kwargs)
+            try:
+                arguments = inspect.getcallargs(function, *args, **kwargs)
+            except TypeError:
+                # Let the function itself complain about its arguments.
+                return function(*args, **kwargs)
+            with start_span(name, experiment=arguments.get(argument)):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate(**attributes):
+    """
+    Set the given attributes on the innermost active span of Flask-Split,
+    if there is one.
+    """
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        _set_attributes(stack[-1][0], attributes)
+
+
+def _get_stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def _set_attributes(span, attributes):
+    for key, value in attributes.items():
+        if value is not None:
+            span.set_attribute(PREFIX + key, value)
+
+
+def _count_round_trip():
+    for active in getattr(_local, 'stack', ()):
+        active[1] += 1
+
+
+class TracedRedis(redis.Redis):
+    """
+    A Redis client that counts its round trips in the active spans and runs
+    each pipeline and script in a span of its own.  It is only used when
+    OpenTelemetry is installed.
+    """
+
+    def execute_command(self, *args, **options):
+        if args[0] in SCRIPT_COMMANDS:
+            with start_span('redis.script'):
+                _count_round_trip()
+                return super(TracedRedis, self).execute_command(
+                    *args, **options)
+        _count_round_trip()
+        return super(TracedRedis, self).execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TracedPipeline(self.connection_pool, self.response_callbacks,
+                              transaction, shard_hint)
+
+
+class TracedPipeline(Pipeline):
+    """The pipeline of :class:`TracedRedis`."""
+
+    def immediate_execute_command(self, *args, **options):
+        _count_round_trip()
+        return super(TracedPipeline, self).immediate_execute_command(
+            *args, **options)
+
+    def execute(self, raise_on_error=True):
+        if not self.command_stack:
+            return super(TracedPipeline, self).execute(raise_on_error)
+        with start_span('redis.pipeline',
+                        commands=len(self.command_stack),
+                        transaction=self.transaction):
+            _count_round_trip()
+            return super(TracedPipeline, self).execute(raise_on_error)
@@ -13,10 +13,13 @@ try:
     import urllib.parse as urlparse
 except ImportError:
     import urlparse
+import uuid
 
-from flask import current_app
+from flask import current_app, has_request_context, session
 import redis
 
+from . import tracing
+
 
 urlparse.uses_netloc.append('redis')
 
@@ -26,9 +29,193 @@ def _get_redis_connection():
     Return a Redis connection based on the Flask application's configuration.
 
     The connection parameters are retrieved from `REDIS_URL` configuration
-    variable.
+    variable.  The connection is created once per application and URL, so
+    that its connection pool is reused between requests.  If OpenTelemetry
+    is installed, the connection traces its round trips, see
+    :mod:`flask_split.tracing`.
 
     :return: an instance of :class:`redis.Connection`
     """
     url = current_app.config.get('REDIS_URL', 'redis://localhost:6379')
-    return redis.from_url(url, decode_responses=True)
+    return _connect(url)
+
+
+def _connect(url, timeout=None):
+    connections = _get_state(current_app).setdefault('connections', {})
+    key = url if timeout is None else (url, timeout)
+    if key not in connections:
+        if tracing.get_tracer() is not None:
+            cls = tracing.TracedRedis
+        else:
+            cls = redis.Redis
+        connections[key] = cls.from_url(
+            url, decode_responses=True, socket_timeout=timeout,
+            socket_connect_timeout=timeout)
+    return connections[key]
+
+
+def _get_federation():
+    """
+    Return a reader that merges the experiments of the local Redis and the
+    Redis of each of the ``SPLIT_FEDERATION_URLS`` of other regions, or
+    `None` if the setting is empty.  The other regions are given
+    ``SPLIT_FEDERATION_TIMEOUT`` seconds to answer.
+    """
+    urls = current_app.config.get('SPLIT_FEDERATION_URLS')
+    if not urls:
+        return None
+    from .federation import Federation
+    timeout = current_app.config.get('SPLIT_FEDERATION_TIMEOUT')
+    return Federation(
+        [_get_redis_connection()] +
+        [_connect(url, timeout) for url in urls],
+        ['local'] + [_describe_url(url) for url in urls])
+
+
+def _describe_url(url):
+    """Return the host, port and database of a Redis URL, but no password."""
+    parts = urlparse.urlsplit(url)
+    return '%s:%s%s' % (parts.hostname, parts.port or 6379, parts.path)
+
+
+def _get_aggregator():
+    """
+    Return the object counter increments of the current application are
+    handed to instead of writing them to Redis directly: the event stream if
+    ``SPLIT_EVENT_STREAM`` is set, or else the host-local counter aggregator
+    if ``SPLIT_AGGREGATION_PATH`` is set, or else `None`.
+    """
+    stream = _get_event_stream()
+    if stream is not None:
+        return stream
+    path = current_app.config.get('SPLIT_AGGREGATION_PATH')
+    if not path:
+        return None
+    state = _get_state(current_app)
+    aggregator = state.get('aggregator')
+    if aggregator is None or aggregator.path != path:
+        if aggregator is not None:
+            aggregator.close()
+        from .aggregation import CounterAggregator
+        aggregator = CounterAggregator(
+            _get_redis_connection(), path,
+            current_app.config['SPLIT_AGGREGATION_INTERVAL'],
+            mark_changes=current_app.config.get('SPLIT_MONITOR', False))
+        state['aggregator'] = aggregator
+    return aggregator
+
+
+def _get_event_stream():
+    """
+    Return the event stream of the current application, or `None` if
+    ``SPLIT_EVENT_STREAM`` is not set.
+    """
+    key = current_app.config.get('SPLIT_EVENT_STREAM')
+    if not key:
+        return None
+    state = _get_state(current_app)
+    stream = state.get('event_stream')
+    if stream is None or stream.key != key:
+        from .events import EventStream
+        stream = EventStream(
+            _get_redis_connection(), key,
+            current_app.config['SPLIT_EVENT_STREAM_MAXLEN'])
+        state['event_stream'] = stream
+    return stream
+
+
+def _get_exclusion_engine(app):
+    """
+    Return the visitor exclusion engine of `app`.  The engine is built once
+    from the ``SPLIT_ROBOT_REGEX``, ``SPLIT_ROBOT_SIGNATURES``,
+    ``SPLIT_IGNORE_IP_ADDRESSES`` and ``SPLIT_ROBOT_CACHE_SIZE`` settings,
+    and rebuilt only if a new value is assigned to one of them.  The values
+    are compared by identity, so that checking them takes constant time
+    however long the lists are.
+    """
+    sources = (
+        app.config['SPLIT_ROBOT_REGEX'],
+        app.config['SPLIT_ROBOT_SIGNATURES'],
+        app.config['SPLIT_IGNORE_IP_ADDRESSES'],
+        app.config['SPLIT_ROBOT_CACHE_SIZE'],
+    )
+    state = _get_state(app)
+    engine = state.get('exclusion')
+    previous = state.get('exclusion_sources', ())
+    if engine is None or len(previous) != len(sources) or any(
+            value is not other for value, other in zip(sources, previous)):
+        from .exclusion import ExclusionEngine
+        engine = ExclusionEngine(*sources)
+        state['exclusion'] = engine
+        # Keep the values alive, so that their ids are not reused.
+        state['exclusion_sources'] = sources
+    return engine
+
+
+def _get_assignment_store(app):
+    """
+    Return the store of the alternatives assigned to logged-in users of
+    `app`, or `None` if ``SPLIT_USER_ID`` is not set.  The store is built
+    once from the ``SPLIT_USER_CACHE_SIZE`` and ``SPLIT_USER_TTL`` settings,
+    and rebuilt only if they change.
+    """
+    if app.config.get('SPLIT_USER_ID') is None:
+        return None
+    cache_size = app.config['SPLIT_USER_CACHE_SIZE']
+    ttl = app.config['SPLIT_USER_TTL']
+    state = _get_state(app)
+    store = state.get('assignments')
+    if store is None or (store.cache_size, store.ttl) != (cache_size, ttl):
+        from .assignments import AssignmentStore
+        store = AssignmentStore(cache_size, ttl)
+        state['assignments'] = store
+    return store
+
+
+def _get_signal_dispatcher(app):
+    """
+    Return the dispatcher that sends the signals of `app` from worker
+    threads, or `None` if ``SPLIT_SIGNAL_WORKERS`` is not set.  The
+    dispatcher is built once from the ``SPLIT_SIGNAL_WORKERS`` and
+    ``SPLIT_SIGNAL_QUEUE_SIZE`` settings, and rebuilt only if they change.
+    """
+    workers = app.config.get('SPLIT_SIGNAL_WORKERS')
+    if not workers:
+        return None
+    queue_size = app.config['SPLIT_SIGNAL_QUEUE_SIZE']
+    state = _get_state(app)
+    dispatcher = state.get('signal_dispatcher')
+    if dispatcher is None or \
+            (dispatcher.workers, dispatcher.queue_size) != (workers,
+                                                            queue_size):
+        if dispatcher is not None:
+            dispatcher.close()
+        from .signals import SignalDispatcher
+        dispatcher = SignalDispatcher(workers, queue_size)
+        state['signal_dispatcher'] = dispatcher
+    return dispatcher
+
+
+def _get_visitor_id():
+    """
+    Return a random id identifying the current visitor, which is stored in
+    the session, or `None` outside of a request.
+    """
+    if not has_request_context():
+        return None
+    if 'split_visitor' not in session:
+        session['split_visitor'] = uuid.uuid4().hex
+    return session['split_visitor']
+
+
+def _use_compact_layout():
+    """
+    Return `True` if new experiments of the current application are stored
+    in the compact layout, see the ``SPLIT_STORAGE_LAYOUT`` setting.
+    """
+    return current_app.config.get('SPLIT_STORAGE_LAYOUT') == 'compact'
+
+
+def _get_state(app):
+    """Return the dictionary holding Flask-Split's state for `app`."""
+    return app.extensions.setdefault('split', {})
@@ -10,11 +10,28 @@
 """
 
 import os
+import time
 
-from flask import Blueprint, redirect, render_template, request, url_for
+from flask import (
+    Blueprint,
+    abort,
+    current_app,
+    g,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    url_for
+)
 
+from .archive import archive_experiment, archived_winners, find_archived
 from .models import Alternative, Experiment
-from .utils import _get_redis_connection
+from .signals import _send, experiment_deleted, experiment_reset, winner_set
+from .utils import (
+    _get_federation,
+    _get_redis_connection,
+    _get_visitor_id
+)
 
 
 root = os.path.abspath(os.path.dirname(__file__))
@@ -24,6 +41,42 @@ split = Blueprint('split', 'flask_split',
     url_prefix='/split'
 )
 
+EXPERIMENT_FIELDS = (
+    'name',
+    'version',
+    'winner',
+    'start_time',
+    'total_participants',
+    'total_completed',
+    'alternatives',
+)
+
+ALTERNATIVE_FIELDS = (
+    'name',
+    'is_control',
+    'weight',
+    'participant_count',
+    'participant_count_error',
+    'completed_count',
+    'completed_count_error',
+    'conversion_rate',
+    'z_score',
+    'confidence_level',
+)
+
+#: Fields that cannot be served without loading the alternatives' counters.
+COUNTER_FIELDS = frozenset([
+    'total_participants',
+    'total_completed',
+    'participant_count',
+    'participant_count_error',
+    'completed_count',
+    'completed_count_error',
+    'conversion_rate',
+    'z_score',
+    'confidence_level',
+])
+
 
 @split.context_processor
 def inject_version():
@@ -31,12 +84,39 @@ def inject_version():
     return dict(version=__version__)
 
 
+@split.after_request
+def report_unavailable_regions(response):
+    """
+    List the regions left out of the counters shown by the request, see
+    ``SPLIT_FEDERATION_URLS``, in the ``X-Split-Unavailable-Regions``
+    header.
+    """
+    regions = g.get('split_unavailable_regions')
+    if regions:
+        response.headers['X-Split-Unavailable-Regions'] = ', '.join(regions)
+    return response
+
+
 @split.route('/')
 def index():
     """Render a dashboard that lists all active experiments."""
-    redis = _get_redis_connection()
     return render_template('split/index.html',
-        experiments=Experiment.all(redis)
+        experiments=_find_experiments()
+    )
+
+
+@split.route('/<experiment>/segments')
+def experiment_segments(experiment):
+    """
+    Render the counters of an experiment broken down by the segments in the
+    ``SPLIT_SEGMENTS`` setting.
+    """
+    experiments = _find_experiments([experiment], segments=True)
+    if not experiments:
+        abort(404)
+    return render_template('split/segments.html',
+        experiment=experiments[0],
+        segments=experiments[0].segments()
     )
 
 
@@ -44,30 +124,294 @@ def index():
 def set_experiment_winner(experiment):
     """Mark an alternative as the winner of the experiment."""
     redis = _get_redis_connection()
-    experiment = Experiment.find(redis, experiment)
+    experiment = _find_experiment(experiment)
     if experiment:
         alternative_name = request.form.get('alternative')
         alternative = Alternative(redis, alternative_name, experiment.name)
         if alternative.name in experiment.alternative_names:
             experiment.winner = alternative.name
+            _send(winner_set, experiment=experiment,
+                  alternative=alternative.name)
+    return redirect(url_for('.index'))
+
+
+@split.route('/<experiment>/weight', methods=['POST'])
+def set_alternative_weight(experiment):
+    """Change the weight of an alternative without resetting its data."""
+    experiment = _find_experiment(experiment)
+    if experiment:
+        try:
+            experiment.set_weights({
+                request.form.get('alternative'): request.form.get('weight')
+            })
+        except (TypeError, ValueError):
+            pass
     return redirect(url_for('.index'))
 
 
 @split.route('/<experiment>/reset', methods=['POST'])
 def reset_experiment(experiment):
     """Delete all data for an experiment."""
-    redis = _get_redis_connection()
-    experiment = Experiment.find(redis, experiment)
+    experiment = _find_experiment(experiment)
     if experiment:
         experiment.reset()
+        _send(experiment_reset, experiment=experiment)
     return redirect(url_for('.index'))
 
 
 @split.route('/<experiment>/delete', methods=['POST'])
 def delete_experiment(experiment):
     """Delete an experiment and all its data."""
-    redis = _get_redis_connection()
-    experiment = Experiment.find(redis, experiment)
+    experiment = _find_experiment(experiment)
     if experiment:
         experiment.delete()
+        _send(experiment_deleted, experiment=experiment)
     return redirect(url_for('.index'))
+
+
+@split.route('/<experiment>/archive', methods=['POST'])
+def archive(experiment):
+    """Archive a finished experiment into a compressed snapshot."""
+    redis = _get_redis_connection()
+    try:
+        archive_experiment(redis, experiment)
+    except ValueError:
+        pass
+    return redirect(url_for('.index'))
+
+
+@split.route('/archive/')
+def archived_experiments():
+    """
+    Render a list of the archived experiments and their winners.  The
+    snapshots are only loaded when an experiment is viewed.
+    """
+    redis = _get_redis_connection()
+    return render_template('split/archive.html',
+        winners=archived_winners(redis)
+    )
+
+
+@split.route('/archive/<experiment>')
+def archived_experiment(experiment):
+    """Render the final statistics of an archived experiment."""
+    redis = _get_redis_connection()
+    snapshot = find_archived(redis, experiment)
+    if snapshot is None:
+        abort(404)
+    return render_template('split/archived_experiment.html',
+        experiment=snapshot
+    )
+
+
+@split.route('/api/experiments')
+def api_experiments():
+    """
+    Return all experiments as JSON.
+
+    The returned fields can be selected with the ``fields`` and
+    ``alternative_fields`` query parameters.  By default only the name,
+    version, winner and start time of each experiment are returned, which
+    does not require loading any counters.
+    """
+    fields = _get_fields('fields', EXPERIMENT_FIELDS,
+        ('name', 'version', 'winner', 'start_time'))
+    alternative_fields = _get_fields('alternative_fields', ALTERNATIVE_FIELDS,
+        ALTERNATIVE_FIELDS)
+    experiments = _find_experiments(
+        counters=_needs_counters(fields, alternative_fields))
+    return jsonify(experiments=[
+        _serialize_experiment(experiment, fields, alternative_fields)
+        for experiment in experiments
+    ])
+
+
+@split.route('/api/experiments/<experiment>')
+def api_experiment(experiment):
+    """
+    Return the statistics of an experiment as JSON.
+
+    Accepts the same ``fields`` and ``alternative_fields`` query parameters
+    as :func:`api_experiments`, but returns all fields by default.
+    """
+    fields = _get_fields('fields', EXPERIMENT_FIELDS, EXPERIMENT_FIELDS)
+    alternative_fields = _get_fields('alternative_fields', ALTERNATIVE_FIELDS,
+        ALTERNATIVE_FIELDS)
+    experiments = _find_experiments([experiment],
+        counters=_needs_counters(fields, alternative_fields))
+    if not experiments:
+        abort(404)
+    return jsonify(
+        _serialize_experiment(experiments[0], fields, alternative_fields))
+
+
+@split.route('/api/experiments/<experiment>/timeline')
+def api_experiment_timeline(experiment):
+    """
+    Return the hourly time buckets of an experiment's counters aggregated
+    from the event stream as JSON.
+    """
+    experiment = _find_experiment(experiment)
+    if not experiment:
+        abort(404)
+    return jsonify(name=experiment.name, timeline=experiment.timeline())
+
+
+@split.route('/api/assignments')
+def api_assignments():
+    """
+    Return the alternatives assigned to the current visitor as JSON.
+
+    The experiments are given as a comma-separated list in the
+    ``experiments`` query parameter.  Each of them is resolved as by
+    :func:`~flask_split.ab_test`, so visitors are enrolled exactly as if the
+    experiment had been rendered on the server, but the experiments that are
+    not registered are loaded with one bulk read.  Experiments that do not
+    exist yet are returned as `null`.
+
+    The response may be cached privately by the client for
+    ``SPLIT_ASSIGNMENT_MAX_AGE`` seconds.
+    """
+    from .core import _ab_test_many
+
+    names = [
+        name.strip()
+        for name in request.args.get('experiments', '').split(',')
+        if name.strip()
+    ]
+    response = jsonify(assignments=_ab_test_many(names))
+    response.cache_control.private = True
+    response.cache_control.max_age = \
+        current_app.config['SPLIT_ASSIGNMENT_MAX_AGE']
+    response.vary.add('Cookie')
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@split.route('/api/events', methods=['POST'])
+def api_events():
+    """
+    Track a batch of conversions of the current visitor.
+
+    Meant to be called from the client, e.g. with ``navigator.sendBeacon``.
+    The request body is a JSON object of the form::
+
+        {"events": [{"experiment": "link_color", "reset": false}, ...]}
+
+    where ``reset`` is optional and defaults to `true`, just like in
+    :func:`~flask_split.finished`.  An event can also be given as a plain
+    experiment name.  Conversions of experiments the visitor is not taking
+    part in are ignored, and each conversion is only counted once.
+
+    The number of events per request is limited by
+    ``SPLIT_BEACON_MAX_EVENTS`` and the number of requests per visitor by
+    ``SPLIT_BEACON_RATE_LIMIT``.
+    """
+    from .core import _finished_many
+
+    config = current_app.config
+    if (request.content_length or 0) > \
+            config['SPLIT_BEACON_MAX_CONTENT_LENGTH']:
+        abort(413)
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('events'), list):
+        abort(400)
+    if len(data['events']) > config['SPLIT_BEACON_MAX_EVENTS']:
+        abort(413)
+    events = [_parse_event(event) for event in data['events']]
+    tracked = _finished_many(events, _beacon_rate_limit())
+    if tracked is None:
+        abort(429)
+    return jsonify(tracked=tracked)
+
+
+def _parse_event(event):
+    if isinstance(event, dict):
+        experiment_name = event.get('experiment')
+        reset = event.get('reset', True)
+    else:
+        experiment_name = event
+        reset = True
+    if not isinstance(experiment_name, type(u'')) or \
+            not isinstance(reset, bool):
+        abort(400)
+    return experiment_name, reset
+
+
+def _beacon_rate_limit():
+    """
+    Return the rate limit of the current visitor's beacons for
+    :func:`~flask_split.core._finished_many` as configured by
+    ``SPLIT_BEACON_RATE_LIMIT``.  The requests are counted in Redis under
+    the visitor's id and the current time window.  The id is kept in the
+    session cookie, so this limits clients that keep their cookies, such as
+    a page sending beacons in a loop, but a client that drops the cookie
+    starts a new count.
+    """
+    limit, period = current_app.config['SPLIT_BEACON_RATE_LIMIT']
+    window = int(time.time() // period)
+    key = 'split:beacon:%s:%d' % (_get_visitor_id(), window)
+    return key, limit, period
+
+
+def _find_experiment(name):
+    """
+    Load the experiment `name` from the local Redis without its counters, or
+    return `None` if `name` is not in the ``experiments`` set.
+    """
+    experiments = Experiment.find_many(_get_redis_connection(), [name],
+                                       counters=False)
+    return experiments[0] if experiments else None
+
+
+def _find_experiments(names=None, counters=True, segments=False):
+    """
+    Load the given experiments for display, with the counters of all regions
+    summed if ``SPLIT_FEDERATION_URLS`` is set.
+    """
+    federation = _get_federation()
+    if federation is not None:
+        experiments = federation.find_many(names, counters, segments)
+        g.split_unavailable_regions = federation.unavailable
+        return experiments
+    return Experiment.find_many(_get_redis_connection(), names, counters,
+                                segments)
+
+
+def _get_fields(param, allowed, default):
+    value = request.args.get(param)
+    if not value:
+        return list(default)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    if any(field not in allowed for field in fields):
+        abort(400)
+    return fields
+
+
+def _needs_counters(fields, alternative_fields):
+    if 'alternatives' in fields:
+        fields = list(fields) + list(alternative_fields)
+    return any(field in COUNTER_FIELDS for field in fields)
+
+
+def _serialize_experiment(experiment, fields, alternative_fields):
+    data = {}
+    for field in fields:
+        if field == 'alternatives':
+            data[field] = [
+                _serialize_alternative(alternative, alternative_fields)
+                for alternative in experiment.alternatives
+            ]
+        elif field == 'winner':
+            winner = experiment.winner
+            data[field] = winner.name if winner else None
+        elif field == 'start_time':
+            start_time = experiment.start_time
+            data[field] = start_time.isoformat() if start_time else None
+        else:
+            data[field] = getattr(experiment, field)
+    return data
+
+
+def _serialize_alternative(alternative, fields):
+    return dict((field, getattr(alternative, field)) for field in fields)
@@ -31,8 +31,9 @@ setup(
     zip_safe=False,
     platforms='any',
     install_requires=[
-        'Flask>=0.10',
-        'Redis>=2.6.0',
+        'click>=7.0',
+        'Flask>=0.11',
+        'Redis>=4.0.0',
     ],
     cmdclass={'test': PyTest},
     classifiers=[
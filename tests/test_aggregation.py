@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from flexmock import flexmock
+from pytest import raises
+from redis import ConnectionError, Redis
+from redis.client import Pipeline
+
+from flask_split import ab_test, finished
+from flask_split.aggregation import CounterAggregator
+from flask_split.cli import cli
+from flask_split.models import Alternative, Experiment
+from flask_split.utils import _get_aggregator
+
+from . import TestCase
+
+
+def _increment_in_child(path, count):
+    redis = Redis(decode_responses=True)
+    aggregator = CounterAggregator(redis, path, interval=0)
+    for _ in range(count):
+        aggregator.increment('link_color:red', 'participant_count')
+    aggregator.close()
+
+
+class TestCounterAggregator(TestCase):
+    def setup_method(self, method):
+        super(TestCounterAggregator, self).setup_method(method)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'counters')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+        super(TestCounterAggregator, self).teardown_method(method)
+
+    def make_aggregator(self, **kwargs):
+        kwargs.setdefault('interval', 60)
+        return CounterAggregator(self.redis, self.path, **kwargs)
+
+    def test_keeps_increments_out_of_redis_until_flushed(self):
+        aggregator = self.make_aggregator()
+        aggregator.flush()
+        aggregator.increment('link_color:red', 'participant_count')
+        aggregator.increment('link_color:red', 'participant_count')
+        assert self.redis.hget('link_color:red', 'participant_count') is None
+        assert aggregator.pending() == {
+            ('link_color:red', 'participant_count'): 2}
+        assert aggregator.flush()
+        assert self.redis.hget('link_color:red', 'participant_count') == '2'
+        assert aggregator.pending() == {}
+
+    def test_marks_the_flushed_experiments_as_changed(self):
+        aggregator = self.make_aggregator(mark_changes=True)
+        aggregator.increment('link_color:red', 'participant_count')
+        aggregator.increment('link_text:experiment', 'participant_count:a')
+        aggregator.flush()
+        assert self.redis.smembers('split:changed') == set(
+            ['link_color', 'link_text'])
+        self.redis.delete('split:changed')
+        aggregator.flush()
+        assert not self.redis.exists('split:changed')
+
+    def test_flushes_only_the_changes_since_the_last_flush(self):
+        aggregator = self.make_aggregator()
+        aggregator.increment('link_color:red', 'participant_count')
+        aggregator.flush()
+        aggregator.increment('link_color:red', 'participant_count')
+        aggregator.increment('link_color:blue', 'completed_count')
+        aggregator.flush()
+        assert self.redis.hget('link_color:red', 'participant_count') == '2'
+        assert self.redis.hget('link_color:blue', 'completed_count') == '1'
+
+    def test_flushes_once_per_interval(self):
+        aggregator = self.make_aggregator()
+        aggregator.flush()
+        flexmock(aggregator).should_receive('_flush').never()
+        aggregator.increment('link_color:red', 'participant_count')
+        assert not aggregator.flush(force=False)
+
+    def test_flushes_in_one_pipeline(self):
+        aggregator = self.make_aggregator()
+        for name in ('blue', 'red', 'green'):
+            aggregator.increment('link_color:%s' % name, 'participant_count')
+        flexmock(Pipeline).should_call('execute').once()
+        aggregator.flush()
+
+    def test_shares_counters_between_instances(self):
+        first = self.make_aggregator()
+        second = self.make_aggregator()
+        first.flush()
+        first.increment('link_color:red', 'participant_count')
+        second.increment('link_color:red', 'participant_count')
+        second.increment('link_color:blue', 'participant_count')
+        assert first.pending() == {
+            ('link_color:red', 'participant_count'): 2,
+            ('link_color:blue', 'participant_count'): 1,
+        }
+
+    def test_aggregates_increments_of_many_processes(self):
+        processes = [
+            multiprocessing.Process(
+                target=_increment_in_child, args=(self.path, 200))
+            for _ in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        assert self.redis.hget('link_color:red', 'participant_count') == \
+            '800'
+
+    def test_keeps_increments_when_the_flush_fails(self):
+        aggregator = self.make_aggregator()
+        aggregator.flush()
+        aggregator.increment('link_color:red', 'participant_count')
+
+        def execute_failing(pipe, *args, **kwargs):
+            raise ConnectionError()
+        execute = Pipeline.execute
+        Pipeline.execute = execute_failing
+        try:
+            with raises(ConnectionError):
+                aggregator.flush()
+        finally:
+            Pipeline.execute = execute
+        assert aggregator.pending() == {
+            ('link_color:red', 'participant_count'): 1}
+        aggregator.flush()
+        assert self.redis.hget('link_color:red', 'participant_count') == '1'
+
+    def test_flushes_the_other_counters_when_one_command_fails(self):
+        aggregator = self.make_aggregator()
+        self.redis.rpush('link_color:blue', 'x')
+        aggregator.increment('link_color:red', 'participant_count')
+        aggregator.increment('link_color:blue', 'participant_count')
+        aggregator.flush()
+        aggregator.increment('link_color:red', 'participant_count')
+        aggregator.flush()
+        assert self.redis.hget('link_color:red', 'participant_count') == '2'
+        assert aggregator.pending() == {
+            ('link_color:blue', 'participant_count'): 1}
+
+    def test_flushes_to_fractional_sampled_counts(self):
+        aggregator = self.make_aggregator()
+        self.redis.hset('link_color:red', 'participant_count', '3.5')
+        aggregator.increment('link_color:red', 'participant_count')
+        aggregator.flush()
+        assert self.redis.hget('link_color:red', 'participant_count') == \
+            '4.5'
+        assert aggregator.pending() == {}
+
+    def test_flushes_segments_with_the_cardinality_cap(self):
+        aggregator = self.make_aggregator()
+        aggregator.flush()
+        for device in ('mobile', 'tablet', 'desktop', 'mobile'):
+            assert aggregator.increment_segments(
+                'link_color:segments', 'participant_count', 'red', 1,
+                {'device': device, 'plan': 'free'}, 2)
+        assert not self.redis.exists('link_color:segments')
+        aggregator.flush()
+        assert self.redis.hgetall('link_color:segments') == {
+            'values:device': '2',
+            'values:plan': '1',
+            'value:device:mobile': '1',
+            'value:device:tablet': '1',
+            'value:plan:free': '1',
+            'participant_count:device:mobile:red': '2',
+            'participant_count:device:tablet:red': '1',
+            'participant_count:device:other:red': '1',
+            'participant_count:plan:free:red': '4',
+        }
+
+    def test_rejects_counters_that_do_not_fit(self):
+        aggregator = self.make_aggregator(counters=1)
+        assert aggregator.increment('link_color:red', 'participant_count')
+        assert not aggregator.increment('link_color:blue',
+                                        'participant_count')
+
+    def test_close_flushes_the_counters(self):
+        aggregator = self.make_aggregator()
+        aggregator.increment('link_color:red', 'participant_count')
+        aggregator.close()
+        assert self.redis.hget('link_color:red', 'participant_count') == '1'
+
+
+class TestAggregatedCounting(TestCase):
+    def setup_method(self, method):
+        super(TestAggregatedCounting, self).setup_method(method)
+        self.tmpdir = tempfile.mkdtemp()
+        self.app.config['SPLIT_AGGREGATION_PATH'] = \
+            os.path.join(self.tmpdir, 'counters')
+        self.app.config['SPLIT_AGGREGATION_INTERVAL'] = 60
+
+    def teardown_method(self, method):
+        _get_aggregator().close()
+        shutil.rmtree(self.tmpdir)
+        super(TestAggregatedCounting, self).teardown_method(method)
+
+    def test_counts_participations_and_completions_on_the_host(self):
+        _get_aggregator().flush()
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        finished('link_color')
+        alternative = Alternative(self.redis, alternative_name, 'link_color')
+        assert alternative.participant_count == 0
+        _get_aggregator().flush()
+        assert alternative.participant_count == 1
+        assert alternative.completed_count == 1
+
+    def test_counts_segments_on_the_host(self):
+        self.app.config['SPLIT_SEGMENTS'] = {'plan': lambda: 'free'}
+        _get_aggregator().flush()
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.segments() == {}
+        _get_aggregator().flush()
+        assert experiment.segments() == {'plan': {'free': {
+            alternative_name: {'participant_count': 1, 'completed_count': 0}
+        }}}
+
+    def test_flush_command(self):
+        _get_aggregator().flush()
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        result = self.app.test_cli_runner().invoke(cli, ['flush'])
+        assert 'Flushed 1 counter(s).' in result.output
+        alternative = Alternative(self.redis, alternative_name, 'link_color')
+        assert alternative.participant_count == 1
+
+    def test_is_disabled_by_default(self):
+        self.app.config['SPLIT_AGGREGATION_PATH'] = None
+        assert _get_aggregator() is None
+        self.app.config['SPLIT_AGGREGATION_PATH'] = \
+            os.path.join(self.tmpdir, 'counters')
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+import json
+from datetime import datetime
+
+from flask_split import preload_experiments, register_experiment
+from flask_split.models import Alternative, Experiment
+from flexmock import flexmock
+from redis import Redis
+
+from . import TestCase
+
+
+class TestStatsAPI(TestCase):
+    def get_json(self, url):
+        response = self.client.get(url)
+        assert response.status_code == 200
+        return json.loads(response.get_data(as_text=True))
+
+    def test_lists_experiments(self):
+        (flexmock(Experiment)
+            .should_receive('_get_time')
+            .and_return(datetime(2011, 7, 7)))
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        Experiment.find_or_create(self.redis, 'button_size', 'small', 'big')
+        data = self.get_json('/split/api/experiments')
+        assert data == {'experiments': [
+            {
+                'name': 'button_size',
+                'version': 0,
+                'winner': None,
+                'start_time': '2011-07-07T00:00:00',
+            },
+            {
+                'name': 'link_color',
+                'version': 0,
+                'winner': None,
+                'start_time': '2011-07-07T00:00:00',
+            },
+        ]}
+
+    def test_lists_no_experiments(self):
+        assert self.get_json('/split/api/experiments') == {'experiments': []}
+
+    def test_returns_experiment_stats(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        experiment.winner = 'red'
+        blue = Alternative(self.redis, 'blue', 'link_color')
+        blue.participant_count = 10
+        blue.completed_count = 2
+        red = Alternative(self.redis, 'red', 'link_color')
+        red.participant_count = 10
+        red.completed_count = 5
+
+        data = self.get_json('/split/api/experiments/link_color')
+        assert data['name'] == 'link_color'
+        assert data['winner'] == 'red'
+        assert data['total_participants'] == 20
+        assert data['total_completed'] == 7
+        blue_data, red_data = data['alternatives']
+        assert blue_data['is_control']
+        assert blue_data['z_score'] is None
+        assert blue_data['confidence_level'] == 'N/A'
+        assert red_data['participant_count'] == 10
+        assert red_data['completed_count'] == 5
+        assert red_data['conversion_rate'] == 0.5
+        assert round(red_data['z_score'], 3) == round(red.z_score, 3)
+        assert red_data['confidence_level'] == red.confidence_level
+        assert red_data['participant_count_error'] == 0
+
+    def test_returns_error_bounds_of_sampled_counts(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        red = Alternative(self.redis, 'red', 'link_color')
+        red.participant_count = 1000
+        self.redis.hset(red.key, 'participant_count_variance', 9900)
+        data = self.get_json('/split/api/experiments/link_color')
+        red_data = data['alternatives'][1]
+        assert red_data['participant_count'] == 1000
+        assert red_data['participant_count_error'] == 195
+        assert red_data['completed_count_error'] == 0
+
+    def test_selects_fields(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        data = self.get_json('/split/api/experiments/link_color'
+            '?fields=name,alternatives'
+            '&alternative_fields=name,participant_count')
+        assert data == {
+            'name': 'link_color',
+            'alternatives': [
+                {'name': 'blue', 'participant_count': 0},
+                {'name': 'red', 'participant_count': 0},
+            ]
+        }
+
+    def test_does_not_load_counters_unless_needed(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        (flexmock(Alternative)
+            .should_receive('_get_counter')
+            .never())
+        self.get_json('/split/api/experiments?fields=name,version')
+
+    def test_rejects_unknown_fields(self):
+        response = self.client.get(
+            '/split/api/experiments?fields=name,password')
+        assert response.status_code == 400
+
+    def test_returns_404_for_non_existing_experiment(self):
+        response = self.client.get('/split/api/experiments/foobar')
+        assert response.status_code == 404
+
+    def test_returns_404_for_keys_that_are_not_experiments(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        for name in ('experiments', 'experiment_winner', 'link_color:blue'):
+            response = self.client.get('/split/api/experiments/%s' % name)
+            assert response.status_code == 404
+            response = self.client.get(
+                '/split/api/experiments/%s/timeline' % name)
+            assert response.status_code == 404
+
+
+class TestFindMany(TestCase):
+    def test_loads_experiments_with_counters(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        Alternative(self.redis, 'red', 'link_color').participant_count = 3
+        experiment, = Experiment.find_many(self.redis)
+        assert experiment.alternative_names == ['blue', 'red']
+        assert experiment.alternatives[1]._counters is not None
+        assert experiment.alternatives[1].participant_count == 3
+
+    def test_skips_non_existing_experiments(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        experiments = Experiment.find_many(
+            self.redis, ['foobar', 'link_color'], counters=False)
+        assert [e.name for e in experiments] == ['link_color']
+        assert experiments[0].alternatives[0]._counters is None
+
+    def test_uses_a_constant_number_of_round_trips(self):
+        for index in range(20):
+            Experiment.find_or_create(
+                self.redis, 'experiment_%d' % index, 'a', 'b')
+        calls = []
+        original = self.redis.pipeline
+
+        def pipeline(*args, **kwargs):
+            calls.append(1)
+            return original(*args, **kwargs)
+
+        self.redis.pipeline = pipeline
+        experiments = Experiment.find_many(self.redis)
+        assert len(experiments) == 20
+        assert len(calls) == 3
+
+
+class TestAssignmentAPI(TestCase):
+    def get_assignments(self, experiments, **kwargs):
+        response = self.client.get(
+            '/split/api/assignments?experiments=%s' % experiments, **kwargs)
+        return response
+
+    def test_assigns_alternatives_for_the_current_visitor(self):
+        self.app.config['SPLIT_ALLOW_MULTIPLE_EXPERIMENTS'] = True
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        Experiment.find_or_create(self.redis, 'button_size', 'small', 'big')
+        response = self.get_assignments('link_color,button_size,foobar')
+        assert response.status_code == 200
+        data = json.loads(response.get_data(as_text=True))
+        assignments = data['assignments']
+        assert assignments['link_color'] in ['blue', 'red']
+        assert assignments['button_size'] in ['small', 'big']
+        assert assignments['foobar'] is None
+        alternative = Alternative(
+            self.redis, assignments['link_color'], 'link_color')
+        assert alternative.participant_count == 1
+
+    def test_returns_the_same_alternatives_on_repeated_requests(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        first = self.get_assignments('link_color')
+        second = self.get_assignments('link_color')
+        assert first.get_data() == second.get_data()
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.total_participants == 1
+
+    def test_returns_private_cache_headers(self):
+        self.app.config['SPLIT_ASSIGNMENT_MAX_AGE'] = 120
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        response = self.get_assignments('link_color')
+        assert response.cache_control.private
+        assert response.cache_control.max_age == 120
+        assert 'Cookie' in response.vary
+        assert response.headers['ETag']
+
+    def test_returns_null_for_keys_that_are_not_experiments(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        self.redis.set('color', 'red')
+        response = self.get_assignments('experiments,color,link_color:red')
+        assert response.status_code == 200
+        data = json.loads(response.get_data(as_text=True))
+        assert data['assignments'] == {
+            'experiments': None, 'color': None, 'link_color:red': None}
+
+    def test_loads_the_experiments_once(self):
+        self.app.config['SPLIT_ALLOW_MULTIPLE_EXPERIMENTS'] = True
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        Experiment.find_or_create(self.redis, 'button_size', 'small', 'big')
+        flexmock(Experiment).should_call('find_many').once()
+        flexmock(Experiment).should_receive('find_or_create').never()
+        response = self.get_assignments('link_color,button_size')
+        assert response.status_code == 200
+
+    def test_registered_experiments_are_served_by_the_registry(self):
+        register_experiment('link_color', 'blue', 'red')
+        preload_experiments()
+        flexmock(Experiment).should_call('find_many') \
+            .with_args(Redis, [], counters=False).once()
+        response = self.get_assignments('link_color')
+        data = json.loads(response.get_data(as_text=True))
+        assert data['assignments']['link_color'] in ['blue', 'red']
+
+    def test_supports_conditional_requests(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        etag = self.get_assignments('link_color').headers['ETag']
+        response = self.get_assignments('link_color',
+            headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+
+class TestEventsAPI(TestCase):
+    def setup_method(self, method):
+        super(TestEventsAPI, self).setup_method(method)
+        self.app.config['SPLIT_ALLOW_MULTIPLE_EXPERIMENTS'] = True
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        Experiment.find_or_create(self.redis, 'button_size', 'small', 'big')
+        response = self.client.get(
+            '/split/api/assignments?experiments=link_color,button_size')
+        self.assignments = json.loads(
+            response.get_data(as_text=True))['assignments']
+
+    def post_events(self, events):
+        return self.client.post('/split/api/events',
+            data=json.dumps({'events': events}),
+            content_type='text/plain')
+
+    def completed_count(self, experiment_name):
+        return Alternative(self.redis, self.assignments[experiment_name],
+            experiment_name).completed_count
+
+    def test_tracks_conversions(self):
+        response = self.post_events(['link_color', {
+            'experiment': 'button_size',
+            'reset': False
+        }])
+        assert response.status_code == 200
+        data = json.loads(response.get_data(as_text=True))
+        assert data == {'tracked': ['link_color', 'button_size']}
+        assert self.completed_count('link_color') == 1
+        assert self.completed_count('button_size') == 1
+
+    def test_counts_each_conversion_only_once(self):
+        events = [{'experiment': 'link_color', 'reset': False}] * 3
+        self.post_events(events)
+        self.post_events(events)
+        assert self.completed_count('link_color') == 1
+
+    def test_ignores_experiments_the_visitor_is_not_part_of(self):
+        Experiment.find_or_create(self.redis, 'font', 'serif', 'sans')
+        response = self.post_events(['font', 'foobar'])
+        data = json.loads(response.get_data(as_text=True))
+        assert data == {'tracked': []}
+        assert Experiment.find(self.redis, 'font').total_completed == 0
+
+    def test_ignores_keys_that_are_not_experiments(self):
+        self.redis.set('color', 'red')
+        response = self.post_events(['experiments', 'color', 'link_color:red',
+                                     'link_color'])
+        assert response.status_code == 200
+        data = json.loads(response.get_data(as_text=True))
+        assert data == {'tracked': ['link_color']}
+
+    def test_applies_all_events_in_one_pipeline(self):
+        calls = []
+        original = Redis.pipeline
+
+        def pipeline(redis, *args, **kwargs):
+            calls.append(1)
+            return original(redis, *args, **kwargs)
+
+        Redis.pipeline = pipeline
+        try:
+            self.post_events(['link_color', 'button_size'])
+        finally:
+            Redis.pipeline = original
+        # One for loading the experiments and one for the completions.
+        assert len(calls) == 2
+
+    def test_rejects_malformed_payloads(self):
+        response = self.client.post('/split/api/events', data='foobar')
+        assert response.status_code == 400
+        response = self.post_events([{'experiment': 42}])
+        assert response.status_code == 400
+
+    def test_limits_the_number_of_events(self):
+        self.app.config['SPLIT_BEACON_MAX_EVENTS'] = 2
+        response = self.post_events(['link_color'] * 3)
+        assert response.status_code == 413
+
+    def test_limits_the_rate_per_visitor(self):
+        self.app.config['SPLIT_BEACON_RATE_LIMIT'] = (2, 60)
+        assert self.post_events([]).status_code == 200
+        assert self.post_events([]).status_code == 200
+        assert self.post_events([]).status_code == 429
+        key, = self.redis.keys('split:beacon:*')
+        assert 0 < self.redis.ttl(key) <= 60
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+from flask import session
+from flexmock import flexmock
+from pytest import raises
+
+from flask_split import (
+    ab_test,
+    finished,
+    preload_experiments,
+    register_experiment
+)
+from flask_split.archive import (
+    archive_experiment,
+    archive_experiments,
+    archived_winners,
+    find_archived,
+    restore_experiment
+)
+from flask_split.cli import cli
+from flask_split.models import Experiment
+
+from . import TestCase
+
+
+class TestArchive(TestCase):
+    def make_experiment(self, name='link_color', compact=False):
+        experiment = Experiment.find_or_create(
+            self.redis, name, 'blue', 'red', compact=compact)
+        experiment.alternatives[0].participant_count = 10
+        experiment.alternatives[0].completed_count = 2
+        experiment.alternatives[1].participant_count = 10
+        experiment.alternatives[1].completed_count = 5
+        experiment.winner = 'red'
+        return experiment
+
+    def test_archives_the_final_statistics(self):
+        self.make_experiment()
+        snapshot = archive_experiment(self.redis, 'link_color')
+        assert snapshot == find_archived(self.redis, 'link_color')
+        assert snapshot['winner'] == 'red'
+        assert snapshot['total_participants'] == 20
+        assert snapshot['total_completed'] == 7
+        assert snapshot['archived_at'] is not None
+        red = snapshot['alternatives'][1]
+        assert red['participant_count'] == 10
+        assert red['conversion_rate'] == 0.5
+        assert red['confidence_level'] == 'no confidence'
+        assert archived_winners(self.redis) == {'link_color': 'red'}
+
+    def test_removes_the_live_keys(self):
+        self.make_experiment().increment_version()
+        self.make_experiment('link_text', compact=True)
+        archive_experiment(self.redis, 'link_color')
+        archive_experiment(self.redis, 'link_text')
+        assert sorted(self.redis.keys('*')) == [
+            'experiment_archive', 'experiment_archived_winners']
+
+    def test_requires_a_winner(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        with raises(ValueError):
+            archive_experiment(self.redis, 'link_color')
+        assert self.redis.exists('link_color')
+        assert archive_experiment(self.redis, 'link_text') is None
+
+    def test_archives_all_finished_experiments(self):
+        self.make_experiment()
+        Experiment.find_or_create(self.redis, 'link_text', 'a', 'b')
+        assert archive_experiments(self.redis) == 1
+        assert self.redis.smembers('experiments') == set(['link_text'])
+
+    def test_ab_test_returns_the_archived_winner(self):
+        self.make_experiment()
+        archive_experiment(self.redis, 'link_color')
+        assert ab_test('link_color', 'blue', 'red') == 'red'
+        assert ab_test('link_color', 'blue', 'red', 'green') == 'red'
+        finished('link_color')
+        assert sorted(self.redis.keys('*')) == [
+            'experiment_archive', 'experiment_archived_winners']
+
+    def test_registered_experiments_are_not_recreated(self):
+        self.make_experiment()
+        archive_experiment(self.redis, 'link_color')
+        register_experiment('link_color', 'blue', 'red')
+        preload_experiments()
+        assert not self.redis.exists('link_color')
+        assert ab_test('link_color') == 'red'
+        session['split'] = {'link_color': 'blue'}
+        finished('link_color')
+        assert not self.redis.exists('link_color:blue')
+
+    def test_restores_an_archived_experiment(self):
+        self.make_experiment()
+        archive_experiment(self.redis, 'link_color')
+        assert restore_experiment(self.redis, 'link_color')
+        assert not restore_experiment(self.redis, 'link_color')
+        assert archived_winners(self.redis) == {}
+        experiment, = Experiment.find_many(self.redis, ['link_color'])
+        assert experiment.winner.name == 'red'
+        assert experiment.total_participants == 20
+        assert experiment.total_completed == 7
+
+    def test_retries_when_the_experiment_changes(self):
+        self.make_experiment()
+        find_many = Experiment.find_many
+        calls = []
+
+        def find_and_increment(redis, names, counters=True):
+            calls.append(counters)
+            if len(calls) == 2:
+                self.redis.hincrby('link_color:red', 'completed_count', 1)
+            return find_many(redis, names, counters)
+
+        flexmock(Experiment).should_receive('find_many').replace_with(
+            find_and_increment)
+        snapshot = archive_experiment(self.redis, 'link_color')
+        assert len(calls) == 4
+        assert snapshot['alternatives'][1]['completed_count'] == 6
+
+    def test_dashboard(self):
+        self.make_experiment()
+        response = self.client.post('/split/link_color/archive')
+        assert response.status_code == 302
+        response = self.client.get('/split/archive/')
+        assert b'link_color' in response.data
+        response = self.client.get('/split/archive/link_color')
+        assert response.status_code == 200
+        assert b'Winner' in response.data
+        response = self.client.get('/split/archive/link_text')
+        assert response.status_code == 404
+
+    def test_commands(self):
+        self.make_experiment()
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(cli, ['archive', '--yes', '*'])
+        assert 'Archived 1 experiment(s).' in result.output
+        result = runner.invoke(cli, ['restore', 'link_color', 'link_text'])
+        assert 'Restored 1 experiment(s).' in result.output
+        assert self.redis.exists('link_color')
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+from flask import session
+from flexmock import flexmock
+from redis import Redis
+
+from flask_split import (
+    ab_test,
+    finished,
+    models,
+    preload_experiments,
+    register_experiment
+)
+from flask_split.assignments import AssignmentStore
+from flask_split.models import Experiment
+
+from . import TestCase
+
+
+class TestAssignmentStore(TestCase):
+    def setup_method(self, method):
+        super(TestAssignmentStore, self).setup_method(method)
+        self.store = AssignmentStore(cache_size=2)
+
+    def test_merges_assignments_the_user_does_not_have(self):
+        self.redis.hset('split:user:1', 'link_color', 'red')
+        assert self.store.load(self.redis, '1', {
+            'link_color': 'blue', 'link_text': 'a'}) == {
+            'link_color': 'red', 'link_text': 'a'}
+        assert self.redis.hgetall('split:user:1') == {
+            'link_color': 'red', 'link_text': 'a'}
+
+    def test_serves_cached_users_without_round_trips(self):
+        self.store.load(self.redis, '1')
+        self.store.claim(self.redis, '1', 'link_color', 'red')
+        flexmock(Redis).should_receive('execute_command').never()
+        flexmock(Redis).should_receive('pipeline').never()
+        assert self.store.load(self.redis, '1', {'link_color': 'red'}) == {
+            'link_color': 'red'}
+        assert self.store.claim(self.redis, '1', 'link_color', 'red') == \
+            'red'
+
+    def test_claims_are_first_come_first_served(self):
+        other = AssignmentStore()
+        self.store.load(self.redis, '1')
+        assert other.claim(self.redis, '1', 'link_color', 'blue') == 'blue'
+        assert self.store.claim(self.redis, '1', 'link_color', 'red') == \
+            'blue'
+        assert self.store.load(self.redis, '1') == {'link_color': 'blue'}
+
+    def test_removes_assignments(self):
+        self.store.load(self.redis, '1', {'link_color': 'red', 'a': 'b'})
+        self.store.remove(self.redis, '1', 'link_color')
+        assert self.store.load(self.redis, '1') == {'a': 'b'}
+        assert self.redis.hgetall('split:user:1') == {'a': 'b'}
+
+    def test_evicts_the_least_recently_used_users(self):
+        for user_id in '123':
+            self.store.load(self.redis, user_id)
+        assert len(self.store._cache) == 2
+
+    def test_expires_assignments(self):
+        store = AssignmentStore(ttl=60)
+        store.claim(self.redis, '1', 'link_color', 'red')
+        assert 0 < self.redis.ttl('split:user:1') <= 60
+
+
+class TestStickyAssignments(TestCase):
+    def setup_method(self, method):
+        super(TestStickyAssignments, self).setup_method(method)
+        self.user_id = None
+        self.app.config['SPLIT_USER_ID'] = lambda: self.user_id
+
+    def on_another_device(self, func, *args):
+        with self.app.app_context(), self.app.test_request_context():
+            return func(*args)
+
+    def on_the_next_request(self, func, *args):
+        with self.app.app_context():
+            return func(*args)
+
+    def test_users_get_the_same_alternative_on_every_device(self):
+        self.user_id = 42
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        for _ in range(5):
+            assert self.on_another_device(
+                ab_test, 'link_color', 'blue', 'red') == alternative_name
+        assert self.redis.hgetall('split:user:42') == {
+            'link_color': alternative_name}
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.total_participants == 1
+
+    def test_concurrent_first_visits_are_counted_once(self):
+        self.user_id = 42
+        flexmock(models).should_receive('random').and_return(0.1)
+        ab_test('link_color', 'blue', 'red')
+        self.redis.hset('split:user:42', 'link_text', 'b')
+
+        def first_visit():
+            flexmock(models).should_receive('random').and_return(0.1)
+            return ab_test('link_text', 'a', 'b')
+
+        assert self.on_another_device(first_visit) == 'b'
+        assert Experiment.find(self.redis, 'link_text') \
+            .total_participants == 0
+
+    def test_merges_anonymous_assignments_at_login(self):
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        assert not self.redis.keys('split:user:*')
+        self.user_id = 42
+        assert self.on_the_next_request(
+            ab_test, 'link_color', 'blue', 'red') == alternative_name
+        assert session['split_user'] == '42'
+        assert self.redis.hgetall('split:user:42') == {
+            'link_color': alternative_name}
+
+    def test_stored_assignments_take_precedence_at_login(self):
+        self.redis.hset('split:user:42', 'link_color', 'red')
+        session['split'] = {'link_color': 'blue'}
+        self.user_id = 42
+        assert ab_test('link_color', 'blue', 'red') == 'red'
+
+    def test_finishing_removes_the_assignment(self):
+        self.user_id = 42
+        ab_test('link_color', 'blue', 'red')
+        finished('link_color')
+        assert self.redis.hgetall('split:user:42') == {}
+        assert Experiment.find(self.redis, 'link_color') \
+            .total_completed == 1
+
+    def test_returning_users_cost_no_round_trips(self):
+        self.user_id = 42
+        register_experiment('link_color', 'blue', 'red')
+        preload_experiments()
+        alternative_name = ab_test('link_color')
+        flexmock(Redis).should_receive('execute_command').never()
+        flexmock(Redis).should_receive('pipeline').never()
+        assert self.on_another_device(ab_test, 'link_color') == \
+            alternative_name
+
+    def test_anonymous_visitors_use_the_session(self):
+        ab_test('link_color', 'blue', 'red')
+        assert not self.redis.keys('split:user:*')
+        assert 'split_user' not in session
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import json
+from datetime import datetime
+
+from flexmock import flexmock
+from pytest import raises
+
+from flask_split.backup import export_experiments, import_experiments
+from flask_split.models import Alternative, Experiment
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from . import TestCase
+
+
+class TestBackup(TestCase):
+    def setup_method(self, method):
+        super(TestBackup, self).setup_method(method)
+        (flexmock(Experiment)
+            .should_receive('_get_time')
+            .and_return(datetime(2012, 3, 9, 22, 1, 34)))
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        experiment.reset()
+        experiment.winner = 'red'
+        experiment.set_weights({'red': 0.25})
+        Alternative(self.redis, 'blue', 'link_color').participant_count = 10
+        Alternative(self.redis, 'red', 'link_color').participant_count = 12
+        Alternative(self.redis, 'red', 'link_color').completed_count = 3
+        for index in range(25):
+            Experiment.find_or_create(
+                self.redis, 'experiment_%d' % index, 'a', 'b', 'c')
+
+    def export(self, format):
+        fp = StringIO()
+        count = export_experiments(self.redis, fp, format, chunk_size=7)
+        assert count == 26
+        return fp.getvalue()
+
+    def assert_restored(self):
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.alternative_names == ['blue', 'red']
+        assert experiment.version == 1
+        assert experiment.winner.name == 'red'
+        assert experiment.start_time == datetime(2012, 3, 9, 22, 1, 34)
+        assert Experiment.find_many(self.redis, ['link_color'])[0] \
+            .weights == {'blue': 1, 'red': 0.25}
+        blue, red = experiment.alternatives
+        assert blue.participant_count == 10
+        assert red.participant_count == 12
+        assert red.completed_count == 3
+        assert len(self.redis.smembers('experiments')) == 26
+        other = Experiment.find(self.redis, 'experiment_24')
+        assert other.alternative_names == ['a', 'b', 'c']
+        assert other.version == 0
+        assert other.winner is None
+
+    def test_exports_json_lines(self):
+        lines = self.export('jsonl').splitlines()
+        records = dict(
+            (record['name'], record) for record in map(json.loads, lines))
+        assert records['link_color'] == {
+            'name': 'link_color',
+            'version': 1,
+            'winner': 'red',
+            'start_time': '2012-03-09T22:01:34',
+            'alternatives': [
+                {'name': 'blue', 'weight': 1, 'participant_count': 10,
+                 'completed_count': 0},
+                {'name': 'red', 'weight': 0.25, 'participant_count': 12,
+                 'completed_count': 3},
+            ]
+        }
+
+    def test_roundtrips_json_lines(self):
+        data = self.export('jsonl')
+        self.redis.flushall()
+        count = import_experiments(self.redis, StringIO(data), 'jsonl', 10)
+        assert count == 26
+        self.assert_restored()
+
+    def test_roundtrips_csv(self):
+        data = self.export('csv')
+        assert data.splitlines()[0] == ('experiment,version,winner,'
+            'start_time,alternative,weight,participant_count,completed_count')
+        self.redis.flushall()
+        count = import_experiments(self.redis, StringIO(data), 'csv', 10)
+        assert count == 26
+        self.assert_restored()
+
+    def test_import_overwrites_existing_experiments(self):
+        data = self.export('jsonl')
+        Alternative(self.redis, 'red', 'link_color').participant_count = 99
+        Experiment.find(self.redis, 'link_color').reset_winner()
+        import_experiments(self.redis, StringIO(data))
+        self.assert_restored()
+
+    def test_import_removes_the_data_of_existing_experiments(self):
+        data = self.export('jsonl')
+        Experiment.find(self.redis, 'link_color').delete()
+        Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red', 'green')
+        Alternative(self.redis, 'green', 'link_color').participant_count = 5
+        self.redis.hset('link_color:timeline', 'participant_count@x:green', 5)
+        self.redis.hset('link_color:segments', 'participant_count:green', 5)
+        import_experiments(self.redis, StringIO(data))
+        self.assert_restored()
+        assert not self.redis.exists(
+            'link_color:green', 'link_color:timeline', 'link_color:segments')
+
+    def test_rejects_unknown_formats(self):
+        with raises(ValueError):
+            export_experiments(self.redis, StringIO(), 'xml')
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import json
+import random
+
+from flexmock import flexmock
+from pytest import raises
+from redis import Redis
+
+from flask_split import ab_test, preload_experiments, register_experiment
+from flask_split import registry as registry_module
+from flask_split.cli import cli
+from flask_split.bandit import epsilon_greedy_weights, thompson_weights
+from flask_split.models import Experiment
+from flask_split.registry import ExperimentRegistry
+
+from . import TestCase
+
+
+class TestAllocationWeights(object):
+    def test_thompson_sampling_prefers_the_better_alternative(self):
+        random.seed(0)
+        weights = thompson_weights([(1000, 100), (1000, 150)])
+        assert abs(sum(weights) - 1) < 1e-9
+        assert weights[1] > 0.99
+        assert weights[0] > 0
+
+    def test_thompson_sampling_explores_without_data(self):
+        random.seed(0)
+        weights = thompson_weights([(0, 0), (0, 0), (0, 0)])
+        assert all(0.25 < weight < 0.42 for weight in weights)
+
+    def test_epsilon_greedy(self):
+        assert epsilon_greedy_weights([(10, 1), (10, 5)], 0.2) == \
+            [0.1, 0.9]
+        assert epsilon_greedy_weights([(0, 0), (0, 0)], 0.2) == [0.9, 0.1]
+
+
+class TestBanditAllocation(TestCase):
+    def make_registry(self, allocation='epsilon-greedy', **options):
+        registry = ExperimentRegistry(ttl=0)
+        registry.register('link_color', 'blue', 'red',
+                          allocation=allocation, **options)
+        return registry
+
+    def convert_red(self):
+        red = Experiment.find(self.redis, 'link_color').alternatives[1]
+        red.participant_count = 10
+        red.completed_count = 5
+
+    def weights(self, registry):
+        return dict(
+            (name, round(weight, 9)) for name, weight in
+            registry.get(self.redis, 'link_color').weights.items()
+        )
+
+    def test_validates_options(self):
+        registry = ExperimentRegistry()
+        with raises(ValueError):
+            registry.register('link_color', 'blue', 'red',
+                              allocation='softmax')
+        with raises(ValueError):
+            registry.register('link_color', 'blue', 'red', epsilon=0)
+
+    def test_computes_weights_from_the_counters(self):
+        registry = self.make_registry(epsilon=0.2)
+        registry.refresh(self.redis)
+        self.convert_red()
+        assert registry.allocate(self.redis) == {
+            'link_color': {'blue': 0.1, 'red': 0.9}}
+        assert self.weights(registry) == {'blue': 0.1, 'red': 0.9}
+        assert 'link_color:weights' not in self.redis
+
+    def test_refresh_loads_the_stored_weights(self):
+        self.make_registry().refresh(self.redis)
+        self.convert_red()
+        self.make_registry().allocate(self.redis)
+        registry = self.make_registry()
+        flexmock(registry_module).should_receive('allocation_weights') \
+            .never()
+        registry.refresh(self.redis)
+        assert self.weights(registry) == {'blue': 0.05, 'red': 0.95}
+
+    def test_ignores_the_weights_of_another_version(self):
+        registry = self.make_registry()
+        registry.refresh(self.redis)
+        self.convert_red()
+        registry.allocate(self.redis)
+        Experiment.find(self.redis, 'link_color').reset()
+        registry.refresh(self.redis)
+        assert self.weights(registry) == {'blue': 1, 'red': 1}
+
+    def test_static_weights_are_not_computed(self):
+        registry = self.make_registry('weights')
+        assert registry.allocate(self.redis) == {}
+        assert not self.redis.exists('experiment_allocations')
+
+    def test_deleting_removes_the_weights(self):
+        registry = self.make_registry()
+        registry.allocate(self.redis)
+        Experiment.find(self.redis, 'link_color').delete()
+        assert not self.redis.exists('experiment_allocations')
+
+    def test_allocate_command(self):
+        register_experiment('link_color', 'blue', 'red',
+                            allocation='epsilon-greedy')
+        preload_experiments()
+        self.convert_red()
+        result = self.app.test_cli_runner().invoke(
+            cli, ['allocate', '--once'])
+        assert result.output == 'link_color: blue 0.050, red 0.950\n'
+        weights = json.loads(
+            self.redis.hget('experiment_allocations', 'link_color')
+        )['weights']
+        assert round(weights['red'], 9) == 0.95
+
+    def test_ab_test_does_not_read_counters(self):
+        self.app.config['SPLIT_CACHE_TTL'] = 60
+        register_experiment('link_color', 'blue', 'red',
+                            allocation='thompson')
+        alternative_name = ab_test('link_color')
+        flexmock(Redis).should_receive('execute_command').never()
+        flexmock(Redis).should_receive('pipeline').never()
+        assert ab_test('link_color') == alternative_name
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+from flask_split.cleanup import collect_garbage, iter_orphaned_keys
+from flask_split.models import Alternative, Experiment
+from flexmock import flexmock
+
+from . import TestCase
+
+
+class TestGarbageCollection(TestCase):
+    def setup_method(self, method):
+        super(TestGarbageCollection, self).setup_method(method)
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        experiment.reset()
+        Alternative(self.redis, 'red', 'link_color').participant_count = 5
+        deleted = Experiment.find_or_create(
+            self.redis, 'button_size', 'small', 'big')
+        Alternative(self.redis, 'big', 'button_size').participant_count = 5
+        deleted.delete()
+        # Counters of a renamed alternative and of a deleted experiment.
+        self.redis.hset('link_color:green', 'participant_count', 3)
+        self.redis.hset('font:serif', 'completed_count', 1)
+        # Data that does not belong to Flask-Split.
+        self.redis.set('session:abc', 'data')
+        self.redis.set('cache:version', 'v2')
+        self.redis.hset('user:1', 'name', 'John')
+        self.redis.hset('link_color:meta', 'owner', 'John')
+
+    def orphans(self, batch_size=500):
+        return sorted(
+            key
+            for keys in iter_orphaned_keys(self.redis, batch_size)
+            for key in keys
+        )
+
+    def test_finds_orphaned_keys(self):
+        self.redis.hset('font:weights', 'serif', 1)
+        assert self.orphans() == [
+            'button_size:version',
+            'font:serif',
+            'font:weights',
+            'link_color:green',
+        ]
+
+    def test_keeps_keys_of_experiments_created_during_the_scan(self):
+        scan = self.redis.scan
+
+        def scan_and_create(*args, **kwargs):
+            result = scan(*args, **kwargs)
+            Experiment.find_or_create(self.redis, 'font', 'serif', 'sans')
+            self.redis.rpush('link_color', 'green')
+            return result
+
+        self.redis.scan = scan_and_create
+        assert self.orphans() == ['button_size:version']
+
+    def test_finds_orphaned_keys_in_small_batches(self):
+        for index in range(50):
+            self.redis.set('unrelated:%d' % index, index)
+        assert len(self.orphans(batch_size=3)) == 3
+
+    def test_dry_run_does_not_remove_anything(self):
+        found = []
+        count = collect_garbage(self.redis, dry_run=True,
+            callback=found.append)
+        assert count == 3
+        assert sorted(found) == self.orphans()
+
+    def test_removes_orphaned_keys(self):
+        assert collect_garbage(self.redis) == 3
+        assert self.orphans() == []
+        assert 'link_color:green' not in self.redis
+        assert 'session:abc' in self.redis
+        assert 'cache:version' in self.redis
+        assert 'user:1' in self.redis
+        assert 'link_color:meta' in self.redis
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.version == 1
+        assert experiment.alternatives[1].participant_count == 5
+
+    def test_throttles_between_batches(self):
+        (flexmock(__import__('time'))
+            .should_receive('sleep')
+            .with_args(0.5)
+            .at_least().once())
+        collect_garbage(self.redis, throttle=0.5)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+from flask_split.cli import cli
+from flask_split.models import Alternative, Experiment
+
+from . import TestCase
+
+
+class TestCLI(TestCase):
+    def setup_method(self, method):
+        super(TestCLI, self).setup_method(method)
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        Experiment.find_or_create(self.redis, 'link_size', 'small', 'big')
+        Experiment.find_or_create(self.redis, 'button_size', 'small', 'big')
+
+    def invoke(self, *args, **kwargs):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(cli, args, **kwargs)
+        assert result.exit_code == 0, result.output
+        return result.output
+
+    def test_lists_experiments_matching_a_pattern(self):
+        output = self.invoke('list', 'link_*')
+        assert output.splitlines() == [
+            'link_color\tv0\tblue,red\t-',
+            'link_size\tv0\tsmall,big\t-',
+        ]
+
+    def test_lists_all_experiments_by_default(self):
+        assert len(self.invoke('list').splitlines()) == 3
+
+    def test_shows_stats(self):
+        Alternative(self.redis, 'red', 'link_color').participant_count = 10
+        Alternative(self.redis, 'red', 'link_color').completed_count = 5
+        output = self.invoke('stats', 'link_color')
+        lines = output.splitlines()
+        assert lines[0] == 'link_color (v0)'
+        assert 'control' in lines[1]
+        assert lines[2].split()[:4] == ['red', '10', '5', '50.00%']
+
+    def test_resets_experiments_matching_a_pattern(self):
+        Alternative(self.redis, 'red', 'link_color').participant_count = 10
+        Alternative(self.redis, 'big', 'button_size').participant_count = 10
+        output = self.invoke('reset', 'link_*', '--yes')
+        assert 'Reset 2 experiment(s).' in output
+        assert Alternative(self.redis, 'red', 'link_color') \
+            .participant_count == 0
+        assert Experiment.find(self.redis, 'link_size').version == 1
+        assert Alternative(self.redis, 'big', 'button_size') \
+            .participant_count == 10
+
+    def test_asks_for_confirmation(self):
+        output = self.invoke('delete', 'link_*', input='n\n')
+        assert 'Delete 2 experiment(s)?' in output
+        assert Experiment.find(self.redis, 'link_color') is not None
+
+    def test_deletes_experiments_matching_a_pattern(self):
+        self.invoke('delete', 'link_*', '--yes')
+        assert Experiment.find(self.redis, 'link_color') is None
+        assert Experiment.find(self.redis, 'link_size') is None
+        assert Experiment.find(self.redis, 'button_size') is not None
+        assert self.redis.smembers('experiments') == set(['button_size'])
+
+    def test_sets_the_winner(self):
+        output = self.invoke('set-winner', '*_size', 'big', '--yes')
+        assert 'Set the winner of 2 experiment(s).' in output
+        assert Experiment.find(self.redis, 'link_size').winner.name == 'big'
+        assert Experiment.find(self.redis, 'link_color').winner is None
+
+    def test_sets_weights(self):
+        output = self.invoke('set-weights', '*_size', 'small=90', 'big=10')
+        assert 'Changed the weights of 2 experiment(s).' in output
+        experiment, = Experiment.find_many(self.redis, ['link_size'])
+        assert experiment.weights == {'small': 90, 'big': 10}
+
+    def test_set_weights_rejects_invalid_weights(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(cli, ['set-weights', 'link_color', 'green=1'])
+        assert result.exit_code != 0
+        assert 'Unknown alternative' in result.output
+
+    def test_reports_when_nothing_matches(self):
+        output = self.invoke('reset', 'foobar*', '--yes')
+        assert 'No matching experiments.' in output
+
+    def test_gc_removes_dangling_experiments(self):
+        self.redis.delete('link_color')
+        output = self.invoke('gc', '--dry-run')
+        assert 'Found 1 dangling experiment(s)' in output
+        assert 'link_color' in self.redis.smembers('experiments')
+        output = self.invoke('gc')
+        assert 'Removed 1 dangling experiment(s)' in output
+        assert 'link_color' not in self.redis.smembers('experiments')
+
+    def test_gc_removes_orphaned_keys(self):
+        Experiment.find(self.redis, 'link_size').delete()
+        output = self.invoke('gc', '--batch-size', '2')
+        assert 'link_size:version' in output
+        assert 'Removed 0 dangling experiment(s) and 1 orphaned key(s).' \
+            in output
+        assert 'link_size:version' not in self.redis
+
+    def test_exports_and_imports(self):
+        Alternative(self.redis, 'red', 'link_color').participant_count = 10
+        runner = self.app.test_cli_runner()
+        with runner.isolated_filesystem():
+            result = runner.invoke(cli, ['export', '-o', 'backup.csv',
+                '--format', 'csv'])
+            assert result.exit_code == 0, result.output
+            self.redis.flushall()
+            output = self.invoke('import', 'backup.csv', '--format', 'csv')
+        assert 'Imported 3 experiment(s).' in output
+        assert Alternative(self.redis, 'red', 'link_color') \
+            .participant_count == 10
@@ -31,6 +31,14 @@ class TestDashboard(TestCase):
         response = self.client.post('/split/foobar/reset')
         assert_redirects(response, '/split/')
 
+    def test_ignores_keys_that_are_not_experiments(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        for action in ('', '/reset', '/delete', '/weight'):
+            response = self.client.post('/split/experiments%s' % action,
+                                        data={'alternative': 'red'})
+            assert response.status_code == 302
+        assert self.redis.type('experiments') == 'set'
+
     def test_delete_an_experiment(self):
         Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
         response = self.client.post('/split/link_color/delete')
@@ -68,6 +76,29 @@ class TestDashboard(TestCase):
             data={'alternative': 'red'})
         assert_redirects(response, '/split/')
 
+    def test_change_the_weight_of_an_alternative(self):
+        Experiment.find_or_create(
+            self.redis, 'link_color', ('blue', 3), ('red', 1))
+        Alternative(self.redis, 'red', 'link_color').participant_count = 5
+
+        response = self.client.post('/split/link_color/weight',
+            data={'alternative': 'red', 'weight': '2'})
+
+        experiment = Experiment.find_many(self.redis, ['link_color'])[0]
+        assert experiment.weights == {'blue': 3, 'red': 2}
+        assert experiment.alternatives[1].participant_count == 5
+        assert_redirects(response, '/split/')
+
+    def test_ignores_invalid_weights(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+
+        response = self.client.post('/split/link_color/weight',
+            data={'alternative': 'red', 'weight': '-1'})
+
+        experiment = Experiment.find_many(self.redis, ['link_color'])[0]
+        assert experiment.weights == {'blue': 1, 'red': 1}
+        assert_redirects(response, '/split/')
+
     def test_displays_the_start_date(self):
         experiment_start_time = datetime(2011, 7, 7)
         (flexmock(Experiment)
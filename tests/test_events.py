@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from flask import session
+from flexmock import flexmock
+
+from flask_split import ab_test, finished, models
+from flask_split.cli import cli
+from flask_split.cleanup import collect_garbage
+from flask_split.events import EventStream, apply_events, consume, create_group
+from flask_split.models import Alternative, Experiment
+
+from . import TestCase
+
+
+class TestEventStream(TestCase):
+    def setup_method(self, method):
+        super(TestEventStream, self).setup_method(method)
+        self.app.config['SPLIT_EVENT_STREAM'] = 'split:events'
+
+    def get_events(self):
+        return [fields for _, fields in self.redis.xrange('split:events')]
+
+    def consume(self):
+        create_group(self.redis, 'split:events', 'split')
+        return consume(self.redis, 'split:events', 'split', 'test')
+
+    def test_ab_test_and_finished_append_events(self):
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        finished('link_color')
+        visitor = session['split_visitor']
+        assert self.get_events() == [
+            {'k': 'link_color:%s' % alternative_name,
+             'f': 'participant_count', 'v': visitor},
+            {'k': 'link_color:%s' % alternative_name,
+             'f': 'completed_count', 'v': visitor},
+        ]
+        alternative = Alternative(self.redis, alternative_name, 'link_color')
+        assert alternative.participant_count == 0
+
+    def test_events_of_sampled_increments_have_a_weight(self):
+        flexmock(models).should_receive('random').and_return(0.05)
+        ab_test('link_color', 'blue', 'red', sample_rate=0.1)
+        assert self.get_events()[0]['w'] == '10.0'
+
+    def test_trims_the_stream(self):
+        stream = EventStream(self.redis, 'split:events', maxlen=10)
+        flexmock(self.redis).should_call('xadd') \
+            .with_args('split:events', dict, maxlen=10, approximate=True)
+        stream.increment('link_color:red', 'participant_count')
+
+    def test_consume_aggregates_events_into_counters(self):
+        ab_test('link_color', 'blue', 'red')
+        session.clear()
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        finished('link_color')
+        assert self.consume() == 3
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.total_participants == 2
+        assert experiment.total_completed == 1
+        alternative = Alternative(self.redis, alternative_name, 'link_color')
+        assert alternative.completed_count == 1
+        assert self.consume() == 0
+
+    def test_consume_acknowledges_the_events(self):
+        ab_test('link_color', 'blue', 'red')
+        self.consume()
+        assert self.redis.xpending('split:events', 'split')['pending'] == 0
+
+    def test_consume_aggregates_sampled_events_with_their_variance(self):
+        flexmock(models).should_receive('random').and_return(0.05)
+        alternative_name = ab_test('link_color', 'blue', 'red',
+                                   sample_rate=0.1)
+        self.consume()
+        alternative = Alternative(self.redis, alternative_name, 'link_color')
+        assert alternative.participant_count == 10
+        assert alternative.participant_count_error == 19
+
+    def test_consume_retries_unacknowledged_events(self):
+        ab_test('link_color', 'blue', 'red')
+        create_group(self.redis, 'split:events', 'split')
+        self.redis.xreadgroup('split', 'test', {'split:events': '>'})
+        assert consume(self.redis, 'split:events', 'split', 'test') == 1
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.total_participants == 1
+
+    def test_consume_acknowledges_trimmed_events(self):
+        ab_test('link_color', 'blue', 'red')
+        create_group(self.redis, 'split:events', 'split')
+        self.redis.xreadgroup('split', 'test', {'split:events': '>'})
+        self.redis.xtrim('split:events', 0, approximate=False)
+        assert consume(self.redis, 'split:events', 'split', 'test') == 1
+        assert self.redis.xpending('split:events', 'split')['pending'] == 0
+        assert consume(self.redis, 'split:events', 'split', 'test') == 0
+
+    def test_consume_claims_the_events_of_crashed_consumers(self):
+        ab_test('link_color', 'blue', 'red')
+        create_group(self.redis, 'split:events', 'split')
+        self.redis.xreadgroup('split', 'crashed', {'split:events': '>'})
+        assert consume(self.redis, 'split:events', 'split', 'test',
+                       min_idle_time=60000) == 0
+        assert consume(self.redis, 'split:events', 'split', 'test',
+                       min_idle_time=0) == 1
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.total_participants == 1
+        assert self.redis.xpending('split:events', 'split')['pending'] == 0
+
+    def test_consume_fills_hourly_time_buckets(self):
+        self.redis.xadd('split:events', {
+            'k': 'link_color:red', 'f': 'participant_count'},
+            id='1350000000000-0')
+        self.redis.xadd('split:events', {
+            'k': 'link_color:red', 'f': 'participant_count'},
+            id='1350000000001-0')
+        self.redis.xadd('split:events', {
+            'k': 'link_color:red', 'f': 'completed_count'},
+            id='1350003600000-0')
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        self.consume()
+        assert experiment.timeline() == {
+            'blue': {},
+            'red': {
+                'participant_count': {'2012101200': 2},
+                'completed_count': {'2012101201': 1},
+            },
+        }
+
+    def test_timeline_api(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        self.redis.xadd('split:events', {
+            'k': 'link_color:blue', 'f': 'participant_count'},
+            id='1350000000000-0')
+        self.consume()
+        response = self.client.get(
+            '/split/api/experiments/link_color/timeline')
+        assert json.loads(response.get_data(as_text=True)) == {
+            'name': 'link_color',
+            'timeline': {
+                'blue': {'participant_count': {'2012101200': 1}},
+                'red': {},
+            },
+        }
+        response = self.client.get('/split/api/experiments/other/timeline')
+        assert response.status_code == 404
+
+    def test_reset_clears_the_timeline(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        ab_test('link_color', 'blue', 'red')
+        self.consume()
+        experiment.reset()
+        assert not self.redis.exists(experiment.timeline_key)
+
+    def test_timeline_is_not_garbage_collected(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        ab_test('link_color', 'blue', 'red')
+        self.consume()
+        assert collect_garbage(self.redis) == 0
+        assert self.redis.exists(experiment.timeline_key)
+
+    def test_consume_aggregates_segment_events(self):
+        self.app.config['SPLIT_SEGMENTS'] = {'plan': lambda: 'free'}
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        finished('link_color')
+        session.clear()
+        ab_test('link_color', 'blue', 'red')
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.segments() == {}
+        assert self.consume() == 6
+        segments = experiment.segments()['plan']['free']
+        assert sum(
+            counters['participant_count'] for counters in segments.values()
+        ) == 2
+        assert segments[alternative_name]['completed_count'] == 1
+
+    def test_segment_events_name_the_alternative(self):
+        self.app.config['SPLIT_SEGMENTS'] = {'plan': lambda: 'free'}
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        assert self.get_events()[1] == {
+            'k': 'link_color:segments', 'f': 'participant_count',
+            'a': alternative_name, 's': '{"plan": "free"}', 'c': '20',
+        }
+
+    def test_queues_the_events_on_the_callers_pipeline(self):
+        self.app.config['SPLIT_SEGMENTS'] = {'plan': lambda: 'free'}
+        ab_test('link_color', 'blue', 'red')
+        flexmock(self.redis).should_receive('xadd').never()
+        finished('link_color')
+        assert len(self.get_events()) == 4
+
+    def test_consume_command(self):
+        ab_test('link_color', 'blue', 'red')
+        result = self.app.test_cli_runner().invoke(
+            cli, ['consume', '--once'])
+        assert 'Consumed 1 event(s).' in result.output
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.total_participants == 1
+
+    def test_apply_events_runs_in_one_transaction(self):
+        events = [
+            ('1350000000000-0', {'k': 'link_color:red',
+                                 'f': 'participant_count'}),
+            ('1350000000001-0', {'k': 'link_color:blue',
+                                 'f': 'participant_count'}),
+        ]
+        create_group(self.redis, 'split:events', 'split')
+        flexmock(self.redis).should_call('pipeline').with_args().once()
+        apply_events(self.redis, 'split:events', 'split', events)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+from flexmock import flexmock
+from pytest import raises
+
+from flask_split import ab_test
+from flask_split.exclusion import (
+    ROBOT_SIGNATURES,
+    ExclusionEngine,
+    IPNetworkSet,
+    LRUCache,
+    _trie_pattern
+)
+from flask_split.models import Experiment
+from flask_split.utils import _get_exclusion_engine
+
+from . import TestCase
+
+
+CHROME = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+)
+
+
+class TestIPNetworkSet(object):
+    def test_contains_exact_addresses(self):
+        networks = IPNetworkSet(['81.19.48.130', '2001:db8::1'])
+        assert '81.19.48.130' in networks
+        assert '2001:db8::1' in networks
+        assert '81.19.48.131' not in networks
+        assert '2001:db8::2' not in networks
+
+    def test_contains_addresses_in_networks(self):
+        networks = IPNetworkSet(['10.0.0.0/8', '192.168.1.0/24',
+                                 '2001:db8::/32'])
+        assert '10.255.1.2' in networks
+        assert '192.168.1.77' in networks
+        assert '192.168.2.1' not in networks
+        assert '2001:db8:ffff::1' in networks
+        assert '2001:db9::1' not in networks
+
+    def test_matches_ipv4_mapped_ipv6_addresses(self):
+        networks = IPNetworkSet(['10.0.0.0/8'])
+        assert '::ffff:10.1.2.3' in networks
+
+    def test_zero_prefix_matches_every_address_of_the_family(self):
+        networks = IPNetworkSet(['0.0.0.0/0'])
+        assert '1.2.3.4' in networks
+        assert '::1' not in networks
+
+    def test_does_not_contain_invalid_addresses(self):
+        networks = IPNetworkSet(['10.0.0.0/8'])
+        assert 'localhost' not in networks
+
+    def test_rejects_invalid_networks(self):
+        with raises(ValueError):
+            IPNetworkSet(['10.0.0.0/33'])
+        with raises(ValueError):
+            IPNetworkSet(['localhost'])
+
+
+class TestLRUCache(object):
+    def test_evicts_the_least_recently_used_item(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert len(cache) == 2
+
+
+class TestTriePattern(object):
+    def test_factors_out_common_prefixes(self):
+        assert _trie_pattern(['bingbot', 'bingpreview', 'curl/']) == \
+            r'(?:bing(?:bot|preview)|curl/)'
+
+    def test_matches_every_word(self):
+        words = ['googlebot', 'google-inspectiontool', 'go-http-client']
+        pattern = re.compile(_trie_pattern(words))
+        for word in words:
+            assert pattern.search('mozilla/5.0 (%s)' % word)
+        assert not pattern.search('mozilla/5.0 (gopher)')
+
+
+class TestExclusionEngine(object):
+    def test_matches_the_robot_regex(self):
+        engine = ExclusionEngine(r'(?i)\b(Googlebot)\b')
+        assert engine.is_robot('Mozilla/5.0 (compatible; Googlebot/2.1)')
+        assert not engine.is_robot(CHROME)
+
+    def test_matches_robot_signatures_case_insensitively(self):
+        engine = ExclusionEngine(robot_signatures=['python-requests'])
+        assert engine.is_robot('Python-Requests/2.31.0')
+        assert engine.is_robot('ExampleCrawler/1.0')
+        assert engine.is_robot('SomeBot/0.1 (+http://example.com/bot)')
+        assert not engine.is_robot(CHROME)
+        assert not engine.is_robot(
+            'Mozilla/5.0 (Linux; Android 10; CUBOT X30) Chrome/91.0')
+
+    def test_caches_verdicts_per_user_agent(self):
+        engine = ExclusionEngine(r'Googlebot')
+        pattern = flexmock(search=lambda user_agent: None)
+        engine._robot_regex = pattern
+        pattern.should_receive('search').and_return(None).once()
+        assert not engine.is_robot(CHROME)
+        assert not engine.is_robot(CHROME)
+
+    def test_ignores_ip_addresses_in_networks(self):
+        engine = ExclusionEngine(ignore_ip_addresses=['10.0.0.0/8'])
+        assert engine.is_ignored_ip_address('10.1.2.3')
+        assert not engine.is_ignored_ip_address('11.1.2.3')
+        assert not engine.is_ignored_ip_address(None)
+
+    def test_keeps_entries_that_are_not_ip_addresses(self):
+        engine = ExclusionEngine(
+            ignore_ip_addresses=['10.0.0.0/8', 'unix-socket', '10.0.0.0/99'])
+        assert engine.is_ignored_ip_address('10.1.2.3')
+        assert engine.is_ignored_ip_address('unix-socket')
+        assert not engine.is_ignored_ip_address('11.1.2.3')
+
+    def test_default_signatures_do_not_match_browsers(self):
+        engine = ExclusionEngine(robot_signatures=ROBOT_SIGNATURES)
+        assert engine.is_robot(
+            'Sogou web spider/4.0(+http://www.sogou.com/docs/help/'
+            'webmasters.htm#07)')
+        assert engine.is_robot('WhatsApp/2.23.20.0 A')
+        assert not engine.is_robot(
+            'Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 '
+            '(KHTML, like Gecko) Chrome/86.0 Safari/537.36 SE 2.X '
+            'MetaSr 1.0 SogouExplorer')
+        assert not engine.is_robot(
+            'Mozilla/5.0 (Linux; Android 12) AppleWebKit/537.36 '
+            '(KHTML, like Gecko) Chrome/96.0 Mobile Safari/537.36 '
+            'SogouMobileBrowser/5.30.0')
+        assert not engine.is_robot(
+            'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) '
+            'AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 '
+            'WhatsApp')
+
+
+class TestVisitorExclusion(TestCase):
+    def test_engine_is_built_once(self):
+        assert _get_exclusion_engine(self.app) is \
+            _get_exclusion_engine(self.app)
+
+    def test_engine_is_rebuilt_when_the_settings_change(self):
+        engine = _get_exclusion_engine(self.app)
+        self.app.config['SPLIT_IGNORE_IP_ADDRESSES'] = ['10.0.0.0/8']
+        assert _get_exclusion_engine(self.app) is not engine
+
+    def test_settings_are_not_compared_item_by_item(self):
+        class Signatures(list):
+            def __eq__(self, other):
+                raise AssertionError('Compared item by item.')
+            __ne__ = __eq__
+
+        self.app.config['SPLIT_ROBOT_SIGNATURES'] = Signatures(['AhrefsBot'])
+        engine = _get_exclusion_engine(self.app)
+        assert _get_exclusion_engine(self.app) is engine
+
+    def test_excludes_robots_by_signature(self):
+        with self.app.test_request_context(headers={
+                'User-Agent': 'Mozilla/5.0 (compatible; AhrefsBot/7.0)'}):
+            assert ab_test('link_color', 'blue', 'red') == 'blue'
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.total_participants == 0
+
+    def test_robot_signatures_can_be_disabled(self):
+        self.app.config['SPLIT_ROBOT_SIGNATURES'] = []
+        with self.app.test_request_context(
+                headers={'User-Agent': 'python-requests/2.31.0'}):
+            ab_test('link_color', 'blue', 'red')
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.total_participants == 1
+
+    def test_excludes_ignored_networks(self):
+        self.app.config['SPLIT_IGNORE_IP_ADDRESSES'] = ['81.19.48.0/24']
+        with self.app.test_request_context(
+                environ_base={'REMOTE_ADDR': '81.19.48.130'}):
+            ab_test('link_color', 'blue', 'red')
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.total_participants == 0
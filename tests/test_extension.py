@@ -2,12 +2,14 @@
 
 from __future__ import with_statement
 
+import random
+
 from flask import make_response, session
 from flexmock import flexmock
 from pytest import raises
 from redis import ConnectionError, Redis
 
-from flask_split import ab_test, finished
+from flask_split import ab_test, finished, models
 from flask_split.core import _get_session
 from flask_split.models import Alternative, Experiment
 
@@ -344,6 +346,99 @@ class TestVersionedExperiments(TestCase):
         assert alternative.completed_count == 0
 
 
+class TestTrafficAllocation(TestCase):
+    def test_visitors_outside_the_sample_get_the_control(self):
+        flexmock(random).should_receive('random').and_return(0.5)
+        assert ab_test('link_color', 'blue', 'red', traffic=0.1) == 'blue'
+        assert 'link_color' not in _get_session()
+        assert session['split_sampled_out'] == ['link_color']
+
+    def test_visitors_outside_the_sample_do_not_write_to_redis(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        flexmock(random).should_receive('random').and_return(0.5)
+        flexmock(Alternative).should_receive('increment_participation') \
+            .never()
+        flexmock(Experiment).should_receive('_save').never()
+        ab_test('link_color', 'blue', 'red', traffic=0.1)
+
+    def test_sampling_decision_is_sticky(self):
+        flexmock(random).should_receive('random').and_return(0.5).once()
+        ab_test('link_color', 'blue', 'red', traffic=0.1)
+        assert ab_test('link_color', 'blue', 'red', traffic=0.1) == 'blue'
+
+    def test_visitors_inside_the_sample_take_part(self):
+        flexmock(random).should_receive('random').and_return(0.05)
+        alternative_name = ab_test('link_color', 'blue', 'red', traffic=0.1)
+        assert _get_session()['link_color'] == alternative_name
+        alternative = Alternative(self.redis, alternative_name, 'link_color')
+        assert alternative.participant_count == 1
+
+    def test_participants_are_kept_when_the_traffic_is_lowered(self):
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        flexmock(random).should_receive('random').and_return(0.99)
+        assert ab_test('link_color', 'blue', 'red', traffic=0.1) == \
+            alternative_name
+
+    def test_finished_does_not_count_visitors_outside_the_sample(self):
+        flexmock(random).should_receive('random').and_return(0.5)
+        ab_test('link_color', 'blue', 'red', traffic=0.1)
+        finished('link_color')
+        alternative = Alternative(self.redis, 'blue', 'link_color')
+        assert alternative.completed_count == 0
+
+    def test_visitors_are_sampled_again_after_a_reset(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        flexmock(random).should_receive('random').and_return(0.5)
+        ab_test('link_color', 'blue', 'red', traffic=0.1)
+        experiment.reset()
+        ab_test('link_color', 'blue', 'red', traffic=0.1)
+        assert session['split_sampled_out'] == ['link_color:1']
+
+    def test_the_winner_is_shown_to_visitors_outside_the_sample(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        flexmock(random).should_receive('random').and_return(0.5)
+        ab_test('link_color', 'blue', 'red', traffic=0.1)
+        experiment.winner = 'red'
+        assert ab_test('link_color', 'blue', 'red', traffic=0.1) == 'red'
+
+    def test_rejects_invalid_traffic_fractions(self):
+        for traffic in (0, 1.5, -1, '0.5', True):
+            with raises(ValueError):
+                ab_test('link_color', 'blue', 'red', traffic=traffic)
+        with raises(TypeError):
+            ab_test('link_color', 'blue', 'red', trafic=0.5)
+
+
+class TestSampledCounting(TestCase):
+    def test_ab_test_records_participations_with_the_sample_rate(self):
+        flexmock(Alternative).should_receive('increment_participation') \
+            .with_args(0.1, aggregator=None).once()
+        ab_test('link_color', 'blue', 'red', sample_rate=0.1)
+
+    def test_ab_test_assigns_alternatives_outside_the_sample(self):
+        flexmock(models).should_receive('random').and_return(0.5)
+        alternative_name = ab_test('link_color', 'blue', 'red',
+                                   sample_rate=0.1)
+        assert _get_session()['link_color'] == alternative_name
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.total_participants == 0
+
+    def test_finished_records_conversions_with_the_sample_rate(self):
+        ab_test('link_color', 'blue', 'red')
+        flexmock(Alternative).should_receive('increment_completion') \
+            .with_args(0.1, aggregator=None).once()
+        finished('link_color', sample_rate=0.1)
+        assert 'link_color' not in _get_session()
+
+    def test_rejects_invalid_sample_rates(self):
+        with raises(ValueError):
+            ab_test('link_color', 'blue', 'red', sample_rate=0)
+        with raises(ValueError):
+            finished('link_color', sample_rate=2)
+
+
 class TestExtensionWhenRedisNotAvailable(TestCase):
     def test_ab_test_raises_an_exception_without_db_failover(self):
         self.app.config['SPLIT_DB_FAILOVER'] = False
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from pytest import raises
+from redis import ConnectionError, Redis
+
+from flask_split import ab_test
+from flask_split.cli import cli
+from flask_split.federation import Federation
+from flask_split.models import Experiment
+
+from . import TestCase
+
+
+class TestFederation(TestCase):
+    def setup_method(self, method):
+        super(TestFederation, self).setup_method(method)
+        self.urls = ['redis://localhost:6379/1', 'redis://localhost:6379/2']
+        self.regions = [
+            Redis.from_url(url, decode_responses=True) for url in self.urls]
+        self.federation = Federation([self.redis] + self.regions)
+
+    def make_experiment(self, redis, counts, compact=False, name='link_color'):
+        experiment = Experiment.find_or_create(
+            redis, name, 'blue', 'red', compact=compact)
+        for alternative, (participants, completed) in zip(
+                experiment.alternatives, counts):
+            alternative.participant_count = participants
+            alternative.completed_count = completed
+        return experiment
+
+    def counts(self, experiment):
+        return [
+            (alternative.participant_count, alternative.completed_count)
+            for alternative in experiment.alternatives
+        ]
+
+    def test_sums_the_counters_of_all_regions(self):
+        self.make_experiment(self.redis, [(100, 10), (100, 20)])
+        self.make_experiment(self.regions[0], [(50, 5), (50, 10)],
+                             compact=True)
+        self.make_experiment(self.regions[1], [(10, 1), (10, 2)])
+        experiment = self.federation.find('link_color')
+        assert self.counts(experiment) == [(160, 16), (160, 32)]
+        assert experiment.total_participants == 320
+        red = experiment.alternatives[1]
+        assert red.conversion_rate == 0.2
+        assert red.confidence_level == '95% confidence'
+        assert self.counts(Experiment.find(self.redis, 'link_color')) == \
+            [(100, 10), (100, 20)]
+
+    def test_sums_regions_at_different_versions(self):
+        self.make_experiment(self.redis, [(100, 10), (100, 20)])
+        self.make_experiment(self.regions[0], [(50, 5), (50, 10)])
+        self.make_experiment(self.regions[1], [(10, 1), (10, 2)]).reset()
+        self.make_experiment(self.regions[1], [(10, 1), (10, 2)])
+        experiment = self.federation.find('link_color')
+        assert experiment.version == 0
+        assert self.counts(experiment) == [(160, 16), (160, 32)]
+
+    def test_leaves_out_regions_that_cannot_be_read(self):
+        down = Redis.from_url('redis://localhost:1/0', decode_responses=True)
+        federation = Federation([self.redis, down, self.regions[0]],
+                                ['local', 'down', 'up'])
+        self.make_experiment(self.redis, [(100, 10), (100, 20)])
+        self.make_experiment(self.regions[0], [(50, 5), (50, 10)])
+        experiment = federation.find('link_color')
+        assert self.counts(experiment) == [(150, 15), (150, 30)]
+        assert federation.unavailable == ['down']
+
+    def test_fails_if_no_region_can_be_read(self):
+        down = Redis.from_url('redis://localhost:1/0', decode_responses=True)
+        with raises(ConnectionError):
+            Federation([down]).find('link_color')
+
+    def test_includes_experiments_of_any_region(self):
+        self.make_experiment(self.redis, [(1, 0), (1, 0)])
+        self.make_experiment(self.regions[1], [(2, 0), (2, 0)],
+                             name='link_text')
+        assert [
+            experiment.name for experiment in self.federation.find_many()
+        ] == ['link_color', 'link_text']
+        assert self.federation.find('link_size') is None
+
+    def test_sums_segments(self):
+        for redis in [self.redis] + self.regions:
+            self.make_experiment(redis, [(1, 0), (1, 0)])
+            redis.hset('link_color:segments', 'participant_count:device:'
+                       'mobile:red', 2)
+        experiment, = self.federation.find_many(['link_color'],
+                                                segments=True)
+        assert experiment.segments()['device']['mobile']['red'] == {
+            'participant_count': 6, 'completed_count': 0}
+
+    def test_writes_stay_in_the_local_region(self):
+        self.app.config['SPLIT_FEDERATION_URLS'] = self.urls
+        ab_test('link_color', 'blue', 'red')
+        assert not any(redis.keys('*') for redis in self.regions)
+
+    def test_api_and_export_show_global_counts(self):
+        self.app.config['SPLIT_FEDERATION_URLS'] = self.urls
+        self.make_experiment(self.redis, [(100, 10), (100, 20)])
+        self.make_experiment(self.regions[0], [(50, 5), (50, 10)])
+        response = self.client.get('/split/api/experiments/link_color')
+        data = json.loads(response.data.decode('utf-8'))
+        assert data['total_participants'] == 300
+
+        assert self.export() == [150, 150]
+        assert self.export('--local') == [100, 100]
+
+    def test_api_reports_unavailable_regions(self):
+        self.app.config['SPLIT_FEDERATION_URLS'] = [
+            self.urls[0], 'redis://:secret@localhost:1/0']
+        self.make_experiment(self.redis, [(100, 10), (100, 20)])
+        self.make_experiment(self.regions[0], [(50, 5), (50, 10)])
+        response = self.client.get('/split/api/experiments/link_color')
+        data = json.loads(response.data.decode('utf-8'))
+        assert data['total_participants'] == 300
+        assert response.headers['X-Split-Unavailable-Regions'] == \
+            'localhost:1/0'
+        response = self.client.get('/split/')
+        assert b'localhost:1/0' in response.data
+        assert b'secret' not in response.data
+
+    def export(self, *args):
+        runner = self.app.test_cli_runner()
+        with runner.isolated_filesystem():
+            runner.invoke(cli, ['export', '-o', 'backup.jsonl'] + list(args))
+            with open('backup.jsonl') as fp:
+                record = json.loads(fp.readline())
+        return [
+            alternative['participant_count']
+            for alternative in record['alternatives']
+        ]
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+from flask import session
+from flexmock import flexmock
+from pytest import raises
+from redis import Redis
+
+from flask_split import ab_test, preload_experiments, register_experiment
+from flask_split import registry as registry_module
+from flask_split.models import Experiment
+from flask_split.registry import ExperimentRegistry
+
+from . import TestCase
+
+
+class TestLayers(TestCase):
+    def setup_method(self, method):
+        super(TestLayers, self).setup_method(method)
+        self.app.config['SPLIT_CACHE_TTL'] = 60
+        for name in ('link_color', 'link_text', 'link_size'):
+            register_experiment(name, 'a', 'b', layer='links')
+        preload_experiments()
+
+    def as_visitor(self, visitor_id, func, *args):
+        with self.app.app_context(), self.app.test_request_context():
+            session['split_visitor'] = visitor_id
+            return func(*args)
+
+    def test_validates_the_layer(self):
+        registry = ExperimentRegistry()
+        with raises(ValueError):
+            registry.register('link_color', 'a', 'b', layer='')
+        with raises(ValueError):
+            registry.register('link_color', 'a', 'b', layer=1)
+
+    def test_visitors_are_eligible_for_one_experiment_per_layer(self):
+        registry = ExperimentRegistry()
+        for name in ('link_color', 'link_text', 'link_size'):
+            registry.register(name, 'a', 'b', layer='links')
+        registry.register('button_size', 'a', 'b', layer='buttons')
+        registry.register('button_text', 'a', 'b')
+        counts = {}
+        for visitor_id in range(3000):
+            names = [
+                name for name in registry.names
+                if registry.is_eligible(name, visitor_id)
+            ]
+            assert len(names) == 3
+            assert 'button_size' in names and 'button_text' in names
+            name, = set(names) - set(['button_size', 'button_text'])
+            counts[name] = counts.get(name, 0) + 1
+        assert all(900 < count < 1100 for count in counts.values())
+
+    def test_looks_up_the_slot_in_a_table(self):
+        registry = ExperimentRegistry()
+        for name in ('link_color', 'link_text', 'link_size'):
+            registry.register(name, 'a', 'b', layer=u'links')
+        flexmock(registry_module).should_call('_slot_table').once()
+        for visitor_id in range(100):
+            for name in registry.names:
+                registry.is_eligible(name, visitor_id)
+
+    def test_counts_visitors_in_their_slot_only(self):
+        def run_all():
+            return [ab_test(name) for name in
+                    ('link_color', 'link_text', 'link_size')]
+
+        for visitor_id in range(30):
+            self.as_visitor('visitor-%d' % visitor_id, run_all)
+        experiments = Experiment.find_many(
+            self.redis, ['link_color', 'link_text', 'link_size'])
+        totals = [experiment.total_participants for experiment in experiments]
+        assert sum(totals) == 30
+        assert all(totals)
+
+    def test_eligibility_costs_no_round_trips(self):
+        registry = self.app.extensions['split']['registry']
+        name = [
+            name for name in ('link_color', 'link_text', 'link_size')
+            if not registry.is_eligible(name, 'visitor')
+        ][0]
+        flexmock(Redis).should_receive('execute_command').never()
+        flexmock(Redis).should_receive('pipeline').never()
+        assert self.as_visitor('visitor', ab_test, name) == 'a'
+
+    def test_layers_are_exempt_from_single_experiment_mode(self):
+        session['split_visitor'] = 'visitor'
+        ab_test('button_color', 'blue', 'red')
+        registry = self.app.extensions['split']['registry']
+        name = [
+            name for name in ('link_color', 'link_text', 'link_size')
+            if registry.is_eligible(name, 'visitor')
+        ][0]
+        ab_test(name)
+        assert sorted(session['split']) == sorted(['button_color', name])
+        ab_test('button_size', 'small', 'big')
+        assert session['split']['button_size'] == 'small'
+        assert Experiment.find(self.redis, 'button_size') \
+            .total_participants == 0
+
+    def test_logged_in_users_get_the_same_slot_on_every_device(self):
+        self.app.config['SPLIT_USER_ID'] = lambda: 42
+        registry = self.app.extensions['split']['registry']
+        eligible = [
+            name for name in ('link_color', 'link_text', 'link_size')
+            if registry.is_eligible(name, '42')
+        ]
+        for visitor_id in range(5):
+            self.as_visitor('visitor-%d' % visitor_id, ab_test, eligible[0])
+        assert sorted(self.redis.hgetall('split:user:42')) == eligible
+
+    def test_adding_an_experiment_only_moves_visitors_to_it(self):
+        registry = ExperimentRegistry()
+        for name in ('link_color', 'link_text', 'link_size'):
+            registry.register(name, 'a', 'b', layer='links')
+
+        def slots():
+            return [
+                [name for name in registry.names
+                 if registry.is_eligible(name, visitor_id)][0]
+                for visitor_id in range(1000)
+            ]
+
+        before = slots()
+        registry.register('link_font', 'a', 'b', layer='links')
+        moved = [
+            new for old, new in zip(before, slots()) if old != new
+        ]
+        assert 150 < len(moved) < 350
+        assert set(moved) == set(['link_font'])
+
+    def test_participants_stay_when_the_layer_changes(self):
+        registry = self.app.extensions['split']['registry']
+        session['split_visitor'] = 'visitor'
+        name = [
+            name for name in ('link_color', 'link_text', 'link_size')
+            if registry.is_eligible(name, 'visitor')
+        ][0]
+        ab_test(name)
+        session['split'][name] = 'b'
+        flexmock(registry).should_receive('is_eligible').and_return(False)
+        assert ab_test(name) == 'b'
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
+from flask_split import models
 from flask_split.models import Alternative, Experiment
 from flexmock import flexmock
+from pytest import raises
+from redis.client import Pipeline
 
 from . import TestCase
 
@@ -130,6 +134,58 @@ class TestAlternative(TestCase):
         assert round(treatment_b.z_score, 2) == -1.13
         assert round(treatment_c.z_score, 2) == 2.94
 
+    def test_sampled_increments_are_weighted(self):
+        flexmock(models).should_receive('random').and_return(0.005)
+        alternative = Alternative(self.redis, 'red', 'link_color')
+        alternative.increment_participation(sample_rate=0.01)
+        alternative.increment_completion(sample_rate=0.01)
+        assert alternative.participant_count == 100
+        assert alternative.completed_count == 100
+        assert alternative.participant_count_error == 195
+        assert alternative.completed_count_error == 195
+
+    def test_exact_increments_add_to_fractional_sampled_counts(self):
+        flexmock(models).should_receive('random').and_return(0.1)
+        alternative = Alternative(self.redis, 'red', 'link_color')
+        alternative.increment_participation(sample_rate=0.3)
+        alternative.increment_participation()
+        assert alternative.participant_count == 4
+
+    def test_sampled_increments_are_skipped_outside_the_sample(self):
+        flexmock(models).should_receive('random').and_return(0.5)
+        alternative = Alternative(self.redis, 'red', 'link_color')
+        alternative.increment_participation(sample_rate=0.01)
+        assert alternative.participant_count == 0
+        assert self.redis.exists(alternative.key) == 0
+
+    def test_exact_counts_have_no_error(self):
+        alternative = Alternative(self.redis, 'red', 'link_color')
+        alternative.increment_participation()
+        assert alternative.participant_count == 1
+        assert alternative.participant_count_error == 0
+
+    def test_reset_clears_the_error_bounds(self):
+        flexmock(models).should_receive('random').and_return(0.005)
+        alternative = Alternative(self.redis, 'red', 'link_color')
+        alternative.increment_participation(sample_rate=0.01)
+        alternative.reset()
+        assert alternative.participant_count == 0
+        assert alternative.participant_count_error == 0
+
+    def test_z_score_accounts_for_sampled_counts(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        control = Alternative(self.redis, 'blue', 'link_color')
+        control.participant_count = 1000
+        control.completed_count = 100
+        alternative = Alternative(self.redis, 'red', 'link_color')
+        alternative.participant_count = 1000
+        alternative.completed_count = 150
+        exact_z_score = alternative.z_score
+
+        for alt in (control, alternative):
+            self.redis.hset(alt.key, 'participant_count_variance', 9000)
+        assert 0 < alternative.z_score < exact_z_score / 3
+
 
 class TestExperiment(TestCase):
     def test_has_name(self):
@@ -180,6 +236,23 @@ class TestExperiment(TestCase):
         experiment.delete()
         assert 'basket_text' not in self.redis
 
+    def test_deleting_should_delete_the_alternatives_and_start_time(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        experiment.delete()
+        assert 'link_color:blue' not in self.redis
+        assert 'link_color:red' not in self.redis
+        assert self.redis.hget('experiment_start_times', 'link_color') is None
+
+    def test_reset_and_delete_run_in_a_single_transaction(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        flexmock(self.redis).should_receive('execute_command').never()
+        flexmock(Pipeline).should_call('unlink').twice()
+        flexmock(Pipeline).should_call('execute').twice()
+        experiment.reset()
+        experiment.delete()
+
     def test_deleting_should_increment_the_version(self):
         experiment = Experiment.find_or_create(
             self.redis, 'link_color', 'blue', 'red', 'green')
@@ -284,3 +357,134 @@ class TestExperiment(TestCase):
         assert alternative_names == ['blue', 'yellow', 'orange']
         new_blue = Alternative(self.redis, 'blue', 'link_color')
         assert new_blue.participant_count == 0
+
+    def test_given_weights_are_not_stored(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', ('blue', 3), ('red', 0.5))
+        assert experiment.weights == {'blue': 3, 'red': 0.5}
+        assert 'link_color:weights' not in self.redis
+
+    def test_given_weights_apply_until_they_are_changed(self):
+        Experiment.find_or_create(
+            self.redis, 'link_color', ('blue', 1), ('red', 1))
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', ('blue', 1), ('red', 99))
+        assert experiment.weights == {'blue': 1, 'red': 99}
+        experiment.set_weights({'blue': 3})
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', ('blue', 1), ('red', 1))
+        assert experiment.weights == {'blue': 3, 'red': 99}
+
+    def test_given_weights_apply_until_they_are_changed_compact(self):
+        Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red', compact=True)
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', ('blue', 1), ('red', 99))
+        assert experiment.weights == {'blue': 1, 'red': 99}
+        experiment.set_weights({'blue': 3})
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', ('blue', 1), ('red', 1))
+        assert experiment.compact
+        assert experiment.weights == {'blue': 3, 'red': 99}
+
+    def test_find_loads_the_stored_weights(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        experiment.set_weights({'red': 3})
+        assert Experiment.find(self.redis, 'link_color').weights == {
+            'blue': 1, 'red': 3}
+
+    def test_changing_the_weights_does_not_reset_the_experiment(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        Alternative(self.redis, 'red', 'link_color').participant_count = 5
+        experiment.set_weights({'blue': 99, 'red': '1'})
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        assert experiment.weights == {'blue': 99, 'red': 1}
+        assert experiment.version == 0
+        assert experiment.alternatives[1].participant_count == 5
+
+    def test_set_weights_validates_the_weights(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        with raises(ValueError):
+            experiment.set_weights({'green': 1})
+        with raises(ValueError):
+            experiment.set_weights({'blue': -1})
+        with raises(ValueError):
+            experiment.set_weights({'blue': 'nan'})
+        with raises(ValueError):
+            experiment.set_weights({'blue': 'inf'})
+        with raises(ValueError):
+            experiment.set_weights({'blue': 'heavy'})
+        with raises(ValueError):
+            experiment.set_weights({'blue': 0, 'red': 0})
+        assert experiment.weights == {'blue': 1, 'red': 1}
+
+    def test_never_picks_alternatives_with_zero_weight(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        experiment.set_weights({'blue': 0})
+        assert set(
+            experiment.random_alternative().name for _ in range(100)
+        ) == set(['red'])
+
+    def test_redefining_an_experiment_replaces_the_weights(self):
+        Experiment.find_or_create(
+            self.redis, 'link_color', ('blue', 3), ('red', 1))
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', ('blue', 2), ('green', 1))
+        assert experiment.weights == {'blue': 2, 'green': 1}
+        experiment.set_weights({'green': 3})
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', ('blue', 2), ('red', 1))
+        assert experiment.weights == {'blue': 2, 'red': 1}
+        experiment.set_weights({'red': 3})
+        experiment.delete()
+        assert 'link_color:weights' not in self.redis
+
+    def test_redefining_an_experiment_stores_the_new_alternatives(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'yellow')
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'yellow')
+        assert self.redis.lrange('link_color', 0, -1) == ['blue', 'yellow']
+        assert experiment.version == 1
+
+
+class TestConcurrentFindOrCreate(TestCase):
+    def find_or_create_concurrently(self, *alternatives):
+        pool = ThreadPool(16)
+        try:
+            return pool.map(
+                lambda _: Experiment.find_or_create(
+                    self.redis, 'link_color', *alternatives),
+                range(200)
+            )
+        finally:
+            pool.close()
+            pool.join()
+
+    def test_concurrent_creation_creates_the_experiment_once(self):
+        self.find_or_create_concurrently('blue', 'red', 'green')
+        assert self.redis.lrange('link_color', 0, -1) == \
+            ['blue', 'red', 'green']
+        assert self.redis.smembers('experiments') == set(['link_color'])
+        assert Experiment.find(self.redis, 'link_color').version == 0
+
+    def test_concurrent_redefinition_resets_the_experiment_once(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        Alternative(self.redis, 'blue', 'link_color').participant_count = 5
+        experiments = self.find_or_create_concurrently(
+            'blue', 'yellow', 'orange')
+        assert all(
+            experiment.alternative_names == ['blue', 'yellow', 'orange']
+            for experiment in experiments
+        )
+        assert self.redis.lrange('link_color', 0, -1) == \
+            ['blue', 'yellow', 'orange']
+        assert Experiment.find(self.redis, 'link_color').version == 1
+        assert Alternative(self.redis, 'blue', 'link_color') \
+            .participant_count == 0
+        assert 'link_color:red' not in self.redis
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from flexmock import flexmock
+from pytest import raises
+
+from flask_split import ab_test, finished, monitor
+from flask_split.cli import cli
+from flask_split.events import apply_events
+from flask_split.models import Experiment
+from flask_split.monitor import SignificanceMonitor, mark_changed
+
+from . import TestCase
+
+
+class TestSignificanceMonitor(TestCase):
+    def setup_method(self, method):
+        super(TestSignificanceMonitor, self).setup_method(method)
+        self.results = []
+        self.monitor = SignificanceMonitor(self.redis, self.results.append)
+
+    def make_experiment(self, name='link_color', completed=(100, 150)):
+        experiment = Experiment.find_or_create(
+            self.redis, name, 'blue', 'red')
+        for alternative, count in zip(experiment.alternatives, completed):
+            alternative.participant_count = 1000
+            alternative.completed_count = count
+        mark_changed(self.redis, name)
+        return experiment
+
+    def test_marks_changed_experiments(self):
+        ab_test('link_color', 'blue', 'red')
+        assert not self.redis.exists('split:changed')
+        self.app.config['SPLIT_MONITOR'] = True
+        finished('link_color')
+        ab_test('link_text', 'a', 'b')
+        assert self.redis.smembers('split:changed') == set(
+            ['link_color', 'link_text'])
+
+    def test_notifies_about_significant_alternatives(self):
+        self.make_experiment()
+        assert self.monitor.run() == self.results
+        result, = self.results
+        assert result['experiment'] == 'link_color'
+        assert result['version'] == 0
+        assert result['alternative'] == 'red'
+        assert result['control'] == 'blue'
+        assert result['z_score'] > 3.29
+        assert result['confidence_level'] == '99.9% confidence'
+        assert result['conversion_rate'] == 0.15
+        assert result['control_conversion_rate'] == 0.1
+        assert not self.redis.exists('split:changed')
+
+    def test_notifies_once_per_version(self):
+        experiment = self.make_experiment()
+        self.monitor.run()
+        mark_changed(self.redis, 'link_color')
+        assert self.monitor.run() == []
+        experiment.reset()
+        self.make_experiment()
+        assert len(self.monitor.run()) == 1
+        assert self.results[1]['version'] == 1
+
+    def test_only_evaluates_changed_experiments(self):
+        self.make_experiment()
+        self.make_experiment('link_text')
+        self.monitor.run()
+        self.make_experiment('link_size')
+        flexmock(Experiment).should_call('find_many').with_args(
+            self.redis, ['link_size']).once()
+        assert len(self.monitor.run()) == 1
+        assert self.monitor.run() == []
+
+    def test_skips_insignificant_and_decided_experiments(self):
+        self.make_experiment(completed=(100, 110))
+        Experiment.find_or_create(self.redis, 'link_text', 'a', 'b')
+        mark_changed(self.redis, 'link_text')
+        self.make_experiment('link_size').winner = 'red'
+        monitor = SignificanceMonitor(self.redis, self.results.append,
+                                      min_participants=2000)
+        self.make_experiment('link_font')
+        monitor.run()
+        self.monitor.run()
+        assert self.results == []
+
+    def test_evaluates_again_if_the_callback_fails(self):
+        self.make_experiment()
+        monitor = SignificanceMonitor(self.redis, lambda result: 1 / 0)
+        with raises(ZeroDivisionError):
+            monitor.run()
+        assert self.redis.sismember('split:changed', 'link_color')
+        assert len(self.monitor.run()) == 1
+
+    def test_evaluates_the_remaining_experiments_again_on_failure(self):
+        self.make_experiment()
+        self.make_experiment('link_text')
+        flexmock(Experiment).should_receive('find_many').and_raise(
+            ValueError)
+        with raises(ValueError):
+            self.monitor.run()
+        assert self.redis.smembers('split:changed') == set(
+            ['link_color', 'link_text'])
+
+    def test_does_not_evaluate_notified_experiments_again_on_failure(self):
+        self.make_experiment()
+        self.make_experiment('link_text')
+
+        def callback(result):
+            if result['experiment'] == 'link_text':
+                raise ValueError()
+            self.results.append(result)
+
+        with raises(ValueError):
+            SignificanceMonitor(self.redis, callback).run()
+        assert self.redis.smembers('split:changed') == set(['link_text'])
+
+    def test_aggregated_increments_are_marked_when_written(self):
+        self.app.config['SPLIT_MONITOR'] = True
+        self.app.config['SPLIT_EVENT_STREAM'] = 'split:events'
+        ab_test('link_color', 'blue', 'red')
+        assert not self.redis.exists('split:changed')
+
+    def test_consumed_events_mark_changes(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        self.redis.xgroup_create('split:events', 'split', mkstream=True)
+        events = [('1350000000000-0', {'k': 'link_color:red',
+                                       'f': 'participant_count'})]
+        apply_events(self.redis, 'split:events', 'split', events)
+        assert not self.redis.exists('split:changed')
+        apply_events(self.redis, 'split:events', 'split', events, True)
+        assert self.redis.smembers('split:changed') == set(['link_color'])
+
+    def test_command_calls_the_callback_and_the_webhook(self):
+        self.make_experiment()
+        self.app.config['SPLIT_MONITOR_CALLBACK'] = self.results.append
+        self.app.config['SPLIT_MONITOR_WEBHOOK'] = 'http://localhost/hook'
+        requests = []
+        flexmock(monitor).should_receive('urlopen').replace_with(
+            lambda request, timeout: requests.append(request) or
+            flexmock(close=lambda: None))
+        result = self.app.test_cli_runner().invoke(cli, ['monitor', '--once'])
+        assert 'link_color: red vs. blue, 99.9% confidence' in result.output
+        assert len(self.results) == 1
+        request, = requests
+        assert request.get_full_url() == 'http://localhost/hook'
+        assert json.loads(request.data.decode('utf-8')) == self.results[0]
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+from flask import Flask, session
+from flexmock import flexmock
+from pytest import raises
+from redis import ConnectionError, Redis
+
+from flask_split import (
+    ab_test,
+    finished,
+    preload_experiments,
+    register_experiment,
+    split
+)
+from flask_split.core import _get_registry, _get_session
+from flask_split.models import Alternative, Experiment
+from flask_split.registry import ExperimentRegistry
+from flask_split.utils import _get_redis_connection
+
+from . import TestCase
+
+
+class TestExperimentRegistry(TestCase):
+    def test_validates_definitions(self):
+        registry = ExperimentRegistry()
+        with raises(TypeError):
+            registry.register('link_color', 'blue')
+        with raises(ValueError):
+            registry.register('link:color', 'blue', 'red')
+        with raises(ValueError):
+            registry.register('link_color', 'blue', 'blue')
+        with raises(ValueError):
+            registry.register('link_color', ('blue', 0), 'red')
+        with raises(ValueError):
+            registry.register('link_color', ('blue', 'heavy'), 'red')
+
+    def test_creates_all_experiments_in_one_pipeline(self):
+        registry = ExperimentRegistry()
+        registry.register('link_color', 'blue', 'red')
+        registry.register('button_size', ('small', 2), ('big', 1))
+        registry.refresh(self.redis)
+        assert self.redis.lrange('link_color', 0, -1) == ['blue', 'red']
+        assert self.redis.lrange('button_size', 0, -1) == ['small', 'big']
+        assert self.redis.smembers('experiments') == \
+            set(['link_color', 'button_size'])
+
+    def test_redefines_experiments_with_different_alternatives(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'green')
+        registry = ExperimentRegistry()
+        registry.register('link_color', 'blue', 'red')
+        experiment = registry.get(self.redis, 'link_color')
+        assert experiment.alternative_names == ['blue', 'red']
+        assert experiment.version == 1
+        assert self.redis.lrange('link_color', 0, -1) == ['blue', 'red']
+
+    def test_serves_experiments_from_memory_within_the_ttl(self):
+        registry = ExperimentRegistry(ttl=60)
+        registry.register('link_color', 'blue', 'red')
+        registry.refresh(self.redis)
+        flexmock(Redis).should_receive('execute_command').never()
+        flexmock(registry).should_receive('refresh').never()
+        experiment = registry.get(self.redis, 'link_color')
+        assert experiment.key == 'link_color'
+        assert experiment.winner is None
+
+    def test_reloads_experiments_after_the_ttl(self):
+        registry = ExperimentRegistry(ttl=0)
+        registry.register('link_color', 'blue', 'red')
+        registry.refresh(self.redis)
+        Experiment.find(self.redis, 'link_color').reset()
+        Experiment.find(self.redis, 'link_color').winner = 'red'
+        experiment = registry.get(self.redis, 'link_color')
+        assert experiment._preloaded['version'] == '1'
+        assert experiment._preloaded['winner'] == 'red'
+
+
+class TestRegisteredExperiments(TestCase):
+    def setup_method(self, method):
+        super(TestRegisteredExperiments, self).setup_method(method)
+        register_experiment('link_color', 'blue', 'red')
+        preload_experiments()
+
+    def test_ab_test_only_needs_the_name(self):
+        alternative_name = ab_test('link_color')
+        assert alternative_name in ['blue', 'red']
+        assert _get_session()['link_color'] == alternative_name
+        alternative = Alternative(self.redis, alternative_name, 'link_color')
+        assert alternative.participant_count == 1
+        assert ab_test('link_color') == alternative_name
+
+    def test_ab_test_does_not_reload_the_definition(self):
+        flexmock(Experiment).should_receive('find_or_create').never()
+        flexmock(Experiment).should_receive('find').never()
+        flexmock(Experiment).should_receive('_save').never()
+        ab_test('link_color', 'blue', 'red')
+        finished('link_color')
+
+    def test_ab_test_rejects_different_alternatives(self):
+        with raises(ValueError):
+            ab_test('link_color', 'blue', 'green')
+
+    def test_finished_tracks_conversions(self):
+        alternative_name = ab_test('link_color')
+        finished('link_color')
+        alternative = Alternative(self.redis, alternative_name, 'link_color')
+        assert alternative.completed_count == 1
+
+    def test_returns_the_control_on_connection_errors_with_db_failover(self):
+        self.app.config['SPLIT_DB_FAILOVER'] = True
+        (flexmock(_get_registry())
+            .should_receive('get')
+            .and_raise(ConnectionError))
+        assert ab_test('link_color') == 'blue'
+
+
+class TestExperimentsSetting(object):
+    def test_preloads_experiments_when_registering_the_blueprint(self):
+        app = Flask(__name__)
+        app.config['SPLIT_EXPERIMENTS'] = {
+            'link_color': ['blue', 'red'],
+            'button_size': [('small', 1), ('big', 3)],
+        }
+        with app.app_context():
+            _get_redis_connection().flushall()
+        app.register_blueprint(split)
+        with app.app_context():
+            redis = _get_redis_connection()
+            assert redis.lrange('button_size', 0, -1) == ['small', 'big']
+            registry = _get_registry()
+            assert registry._loaded_at is not None
+            assert registry.alternative_names('link_color') == \
+                ['blue', 'red']
+
+
+class TestRegisteredExperimentWeights(TestCase):
+    def test_picks_up_changed_weights_on_refresh(self):
+        registry = ExperimentRegistry(ttl=60)
+        registry.register('link_color', ('blue', 1), ('red', 1))
+        registry.refresh(self.redis)
+        Experiment.find(self.redis, 'link_color').set_weights({'red': 9})
+        assert registry.get(self.redis, 'link_color').weights == \
+            {'blue': 1, 'red': 1}
+        registry.refresh(self.redis)
+        assert registry.get(self.redis, 'link_color').weights == \
+            {'blue': 1, 'red': 9}
+
+
+class TestRegisteredExperimentTraffic(TestCase):
+    def test_uses_the_registered_traffic_fraction(self):
+        register_experiment('link_color', 'blue', 'red', traffic=0.1)
+        preload_experiments()
+        flexmock(random).should_receive('random').and_return(0.5)
+        flexmock(Redis).should_receive('execute_command').never()
+        assert ab_test('link_color') == 'blue'
+        assert session['split_sampled_out'] == ['link_color']
+
+    def test_validates_the_traffic_fraction(self):
+        registry = ExperimentRegistry()
+        with raises(ValueError):
+            registry.register('link_color', 'blue', 'red', traffic=0)
+        with raises(TypeError):
+            registry.register('link_color', 'blue', 'red', colour='red')
+
+    def test_accepts_options_in_the_experiments_setting(self):
+        app = Flask(__name__)
+        app.config['SPLIT_EXPERIMENTS'] = {
+            'link_color': {'alternatives': ['blue', 'red'], 'traffic': 0.1},
+        }
+        app.register_blueprint(split)
+        with app.app_context():
+            assert _get_registry().options('link_color')['traffic'] == 0.1
+
+    def test_uses_the_registered_sample_rate(self):
+        register_experiment('link_color', 'blue', 'red', sample_rate=0.5)
+        preload_experiments()
+        flexmock(Alternative).should_receive('increment_participation') \
+            .with_args(0.5, aggregator=None).once()
+        flexmock(Alternative).should_receive('increment_completion') \
+            .with_args(0.5, aggregator=None).once()
+        ab_test('link_color')
+        finished('link_color')
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+
+from flask import request
+from flexmock import flexmock
+from redis.client import Pipeline
+
+from flask_split import ab_test, finished
+from flask_split.cleanup import collect_garbage
+from flask_split.models import Alternative, Experiment
+
+from . import TestCase
+
+
+class TestSegments(TestCase):
+    def setup_method(self, method):
+        super(TestSegments, self).setup_method(method)
+        self.app.config['SPLIT_SEGMENTS'] = {
+            'device': lambda: request.args.get('device'),
+            'plan': lambda: 'free',
+        }
+
+    def make_test_request_context(self):
+        return self.app.test_request_context('/?device=mobile')
+
+    @contextmanager
+    def request(self, url):
+        with self.app.app_context():
+            with self.app.test_request_context(url):
+                yield
+
+    def test_counts_participations_and_completions_per_segment(self):
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        finished('link_color')
+        experiment = Experiment.find(self.redis, 'link_color')
+        counters = {
+            alternative_name: {'participant_count': 1, 'completed_count': 1}
+        }
+        assert experiment.segments() == {
+            'device': {'mobile': counters},
+            'plan': {'free': counters},
+        }
+        alternative = Alternative(self.redis, alternative_name, 'link_color')
+        assert alternative.participant_count == 1
+        assert alternative.completed_count == 1
+
+    def test_writes_segments_in_the_same_pipeline_as_the_totals(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        executed = []
+        execute = Pipeline.execute
+
+        def record_execute(pipe, *args, **kwargs):
+            executed.append([command[0][0] for command in pipe.command_stack])
+            return execute(pipe, *args, **kwargs)
+        Pipeline.execute = record_execute
+        try:
+            ab_test('link_color', 'blue', 'red')
+        finally:
+            Pipeline.execute = execute
+        assert ['HINCRBYFLOAT', 'EVALSHA'] in executed
+
+    def test_runs_the_script_again_when_redis_lost_it(self):
+        self.redis.script_flush()
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        segments = Experiment.find(self.redis, 'link_color').segments()
+        assert segments['device']['mobile'][alternative_name] == {
+            'participant_count': 1, 'completed_count': 0}
+        self.redis.script_flush()
+        finished('link_color')
+        segments = Experiment.find(self.redis, 'link_color').segments()
+        assert segments['device']['mobile'][alternative_name] == {
+            'participant_count': 1, 'completed_count': 1}
+
+    def test_counts_missing_values_as_unknown(self):
+        with self.request('/'):
+            alternative_name = ab_test('link_color', 'blue', 'red')
+        segments = Experiment.find(self.redis, 'link_color').segments()
+        assert segments['device']['unknown'][alternative_name] == {
+            'participant_count': 1, 'completed_count': 0}
+
+    def test_caps_the_number_of_values_per_dimension(self):
+        self.app.config['SPLIT_SEGMENT_CARDINALITY'] = 2
+        for device in ('mobile', 'tablet', 'desktop', 'tv', 'mobile'):
+            with self.request('/?device=%s' % device):
+                ab_test('link_color', 'blue', 'red')
+        segments = Experiment.find(self.redis, 'link_color').segments()
+        assert sorted(segments['device']) == ['mobile', 'other', 'tablet']
+        assert sum(
+            counters['participant_count']
+            for counters in segments['device']['other'].values()
+        ) == 2
+        assert sum(
+            counters['participant_count']
+            for counters in segments['device']['mobile'].values()
+        ) == 2
+
+    def test_find_many_loads_segments_with_the_counters(self):
+        ab_test('link_color', 'blue', 'red')
+        experiment, = Experiment.find_many(
+            self.redis, ['link_color'], segments=True)
+        flexmock(self.redis).should_receive('hgetall').never()
+        assert 'mobile' in experiment.segments()['device']
+
+    def test_reset_and_garbage_collection(self):
+        ab_test('link_color', 'blue', 'red')
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert collect_garbage(self.redis) == 0
+        experiment.reset()
+        assert not self.redis.exists(experiment.segments_key)
+
+    def test_segments_of_deleted_experiments_are_garbage(self):
+        ab_test('link_color', 'blue', 'red')
+        self.redis.srem('experiments', 'link_color')
+        assert collect_garbage(self.redis, dry_run=True) >= 1
+
+    def test_segment_drill_down(self):
+        ab_test('link_color', 'blue', 'red')
+        response = self.client.get('/split/link_color/segments')
+        assert response.status_code == 200
+        assert 'mobile' in response.get_data(as_text=True)
+        response = self.client.get('/split/other/segments')
+        assert response.status_code == 404
+
+    def test_segment_drill_down_of_keys_that_are_not_experiments(self):
+        ab_test('link_color', 'blue', 'red')
+        for name in ('experiments', 'link_color:segments', 'link_color:red'):
+            response = self.client.get('/split/%s/segments' % name)
+            assert response.status_code == 404
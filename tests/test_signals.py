@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from flask import current_app
+from flexmock import flexmock
+from redis import ConnectionError
+from redis.client import Pipeline
+
+from flask_split import ab_test, core, finished, signals
+from flask_split.cli import cli
+from flask_split.core import _finished_many
+from flask_split.models import Experiment
+from flask_split.signals import SignalDispatcher
+from flask_split.utils import _get_signal_dispatcher
+
+from . import TestCase
+
+
+SIGNALS = (
+    'experiment_started',
+    'alternative_assigned',
+    'conversion_tracked',
+    'winner_set',
+    'experiment_reset',
+    'experiment_deleted',
+)
+
+
+class TestSignals(TestCase):
+    def setup_method(self, method):
+        super(TestSignals, self).setup_method(method)
+        self.received = []
+        for name in SIGNALS:
+            getattr(signals, name).connect(self.receiver, weak=False)
+
+    def teardown_method(self, method):
+        for name in SIGNALS:
+            getattr(signals, name).disconnect(self.receiver)
+        super(TestSignals, self).teardown_method(method)
+
+    def receiver(self, sender, experiment, alternative=None):
+        assert sender is current_app._get_current_object()
+        self.received.append((experiment.name, alternative,
+                              threading.current_thread().name))
+
+    def names(self):
+        return [
+            (name, alternative) for name, alternative, thread in self.received
+        ]
+
+    def test_ab_test_sends_assignments(self):
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        ab_test('link_color', 'blue', 'red')
+        assert self.names() == [('link_color', alternative_name)] * 3
+
+    def test_finished_sends_conversions(self):
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        self.received = []
+        finished('link_color', reset=False)
+        finished('link_color', reset=False)
+        assert self.names() == [('link_color', alternative_name)]
+
+    def test_beacon_conversions_are_sent_after_they_are_written(self):
+        self.app.config['SPLIT_DB_FAILOVER'] = True
+        ab_test('link_color', 'blue', 'red')
+        self.received = []
+        execute = Pipeline.execute
+        calls = []
+
+        def execute_failing(pipe, *args, **kwargs):
+            calls.append(1)
+            if len(calls) > 1:
+                raise ConnectionError()
+            return execute(pipe, *args, **kwargs)
+
+        Pipeline.execute = execute_failing
+        try:
+            assert _finished_many([('link_color', True)]) == []
+        finally:
+            Pipeline.execute = execute
+        assert self.received == []
+
+    def test_works_without_blinker(self):
+        # Flask < 2.3 replaces the signals with fake ones that have no
+        # receivers if blinker is not installed.
+        class FakeSignal(object):
+            def send(self, *args, **kwargs):
+                raise AssertionError('The signal was sent.')
+
+        flexmock(core, experiment_started=FakeSignal(),
+                 alternative_assigned=FakeSignal(),
+                 conversion_tracked=FakeSignal())
+        ab_test('link_color', 'blue', 'red')
+        finished('link_color')
+        assert self.received == []
+
+    def test_excluded_visitors_send_nothing(self):
+        self.app.config['SPLIT_IGNORE_IP_ADDRESSES'] = ['127.0.0.1']
+        with self.app.test_request_context(
+                environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+            ab_test('link_color', 'blue', 'red')
+            finished('link_color')
+        assert self.received == []
+
+    def test_dashboard_sends_changes(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        self.client.post('/split/link_color', data={'alternative': 'red'})
+        self.client.post('/split/link_color/reset')
+        self.client.post('/split/link_color/delete')
+        self.client.post('/split/link_text/delete')
+        assert self.names() == [
+            ('link_color', 'red'), ('link_color', None), ('link_color', None)]
+
+    def test_commands_send_changes(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        runner = self.app.test_cli_runner()
+        runner.invoke(cli, ['set-winner', 'link_*', 'red', '--yes'])
+        runner.invoke(cli, ['reset', 'link_*', '--yes'])
+        assert self.names() == [('link_color', 'red'), ('link_color', None)]
+
+    def test_sends_from_worker_threads(self):
+        self.app.config['SPLIT_SIGNAL_WORKERS'] = 2
+        ab_test('link_color', 'blue', 'red')
+        _get_signal_dispatcher(self.app).close()
+        assert len(self.received) == 2
+        assert all(
+            thread != threading.current_thread().name
+            for name, alternative, thread in self.received
+        )
+
+
+class TestSignalDispatcher(TestCase):
+    def test_drops_signals_when_the_queue_is_full(self):
+        started = threading.Event()
+        release = threading.Event()
+        received = []
+
+        def receiver(sender, **kwargs):
+            started.set()
+            release.wait()
+            received.append(kwargs)
+
+        dispatcher = SignalDispatcher(workers=1, queue_size=1)
+        with signals.winner_set.connected_to(receiver):
+            assert dispatcher.dispatch(signals.winner_set, self.app, index=0)
+            started.wait()
+            assert [
+                dispatcher.dispatch(signals.winner_set, self.app, index=index)
+                for index in range(1, 4)
+            ] == [True, False, False]
+            release.set()
+            dispatcher.close()
+        assert received == [{'index': 0}, {'index': 1}]
+
+    def test_survives_failing_receivers(self):
+        received = []
+
+        def receiver(sender, **kwargs):
+            received.append(kwargs)
+            if kwargs['index'] == 0:
+                raise ValueError
+
+        dispatcher = SignalDispatcher(workers=1)
+        with signals.winner_set.connected_to(receiver):
+            for index in range(2):
+                dispatcher.dispatch(signals.winner_set, self.app, index=index)
+            dispatcher.join()
+        dispatcher.close()
+        assert received == [{'index': 0}, {'index': 1}]
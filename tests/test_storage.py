@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+from io import StringIO
+
+from flask import Flask
+from flexmock import flexmock
+from pytest import raises
+
+from flask_split import (
+    ab_test,
+    finished,
+    models,
+    preload_experiments,
+    register_experiment,
+    split
+)
+from flask_split.backup import export_experiments, import_experiments
+from flask_split.cleanup import collect_garbage, find_dangling_experiments
+from flask_split.cli import cli
+from flask_split.events import apply_events
+from flask_split.models import Alternative, Experiment
+from flask_split.storage import (
+    memory_report,
+    migrate_experiment,
+    migrate_experiments
+)
+
+from . import TestCase
+
+
+class TestCompactLayout(TestCase):
+    def setup_method(self, method):
+        super(TestCompactLayout, self).setup_method(method)
+        self.app.config['SPLIT_STORAGE_LAYOUT'] = 'compact'
+
+    def test_stores_an_experiment_in_a_single_hash(self):
+        alternative_name = ab_test('link_color', 'blue', 'red')
+        finished('link_color')
+        assert self.redis.keys('link_color*') == ['link_color:experiment']
+        data = self.redis.hgetall('link_color:experiment')
+        assert data['alternative:0'] == 'blue'
+        assert data['alternative:1'] == 'red'
+        assert data['participant_count:%s' % alternative_name] == '1'
+        assert data['completed_count:%s' % alternative_name] == '1'
+        assert 'start_time' in data
+        assert not self.redis.hexists('experiment_start_times', 'link_color')
+
+    def test_finds_experiments(self):
+        ab_test('link_color', 'blue', 'red')
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.compact
+        assert experiment.alternative_names == ['blue', 'red']
+        assert experiment.total_participants == 1
+        assert experiment.start_time is not None
+
+    def test_find_many_loads_the_counters_with_the_definition(self):
+        ab_test('link_color', 'blue', 'red')
+        experiment, = Experiment.find_many(self.redis, ['link_color'])
+        flexmock(self.redis).should_receive('hget').never()
+        assert experiment.total_participants == 1
+        assert experiment.version == 0
+
+    def test_existing_experiments_keep_their_layout(self):
+        Experiment.find_or_create(self.redis, 'link_color', 'blue', 'red')
+        ab_test('link_color', 'blue', 'red')
+        assert not self.redis.exists('link_color:experiment')
+        assert Experiment.find(self.redis, 'link_color').total_participants \
+            == 1
+
+    def test_redefining_resets_the_experiment(self):
+        ab_test('link_color', 'blue', 'red')
+        experiment = Experiment.find(self.redis, 'link_color')
+        experiment.winner = 'red'
+        ab_test('link_color', 'blue', 'red', 'green')
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.alternative_names == ['blue', 'red', 'green']
+        assert experiment.version == 1
+        assert experiment.winner is None
+        assert experiment.total_participants == 1
+
+    def test_winner_weights_reset_and_delete(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red', compact=True)
+        experiment.winner = 'red'
+        assert Experiment.find(self.redis, 'link_color').winner.name == 'red'
+        experiment.set_weights({'red': 3})
+        assert Experiment.find(self.redis, 'link_color').weights == {
+            'blue': 1, 'red': 3}
+        experiment.alternatives[0].increment_participation()
+        experiment.reset()
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.version == 1
+        assert experiment.winner is None
+        assert experiment.total_participants == 0
+        experiment.delete()
+        assert Experiment.find(self.redis, 'link_color') is None
+        assert not self.redis.sismember('experiments', 'link_color')
+
+    def test_registered_experiments(self):
+        register_experiment('link_color', 'blue', 'red')
+        preload_experiments()
+        ab_test('link_color')
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.compact
+        assert experiment.total_participants == 1
+
+    def test_sampled_counters_have_compact_variances(self):
+        flexmock(models).should_receive('random').and_return(0.05)
+        alternative = Alternative(self.redis, 'red', 'link_color', True)
+        alternative.increment_participation(sample_rate=0.1)
+        assert self.redis.hgetall('link_color:experiment') == {
+            'participant_count:red': '10',
+            'participant_count_variance:red': '90',
+        }
+        assert alternative.participant_count == 10
+        assert alternative.participant_count_error == 19
+
+    def test_event_stream_aggregates_compact_counters(self):
+        Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red', compact=True)
+        events = [
+            ('1350000000000-0', {'k': 'link_color:experiment',
+                                 'f': 'participant_count:red'}),
+            ('1350000000001-0', {'k': 'link_color:experiment',
+                                 'f': 'participant_count:red', 'w': '2.0'}),
+        ]
+        self.redis.xgroup_create('split:events', 'split', mkstream=True)
+        apply_events(self.redis, 'split:events', 'split', events)
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.alternatives[1].participant_count == 3
+        assert experiment.alternatives[1]._get_value(
+            'participant_count_variance') == 2
+        assert experiment.timeline()['red'] == {
+            'participant_count': {'2012101200': 3}}
+
+    def test_import_restores_in_the_compact_layout(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        experiment.alternatives[0].increment_participation()
+        fp = StringIO()
+        export_experiments(self.redis, fp)
+        fp.seek(0)
+        import_experiments(self.redis, fp, compact=True)
+        assert not self.redis.exists('link_color', 'link_color:blue')
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.compact
+        assert experiment.alternatives[0].participant_count == 1
+
+    def test_garbage_collection(self):
+        ab_test('link_color', 'blue', 'red')
+        assert find_dangling_experiments(self.redis) == []
+        assert collect_garbage(self.redis) == 0
+        self.redis.srem('experiments', 'link_color')
+        assert collect_garbage(self.redis) == 1
+        assert not self.redis.exists('link_color:experiment')
+
+    def test_rejects_unknown_layouts(self):
+        app = Flask(__name__)
+        app.config['SPLIT_STORAGE_LAYOUT'] = 'other'
+        with raises(ValueError):
+            app.register_blueprint(split)
+
+
+class TestMigration(TestCase):
+    def make_experiment(self, compact=False):
+        flexmock(models).should_receive('random').and_return(0.1)
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red', compact=compact)
+        experiment.set_weights({'red': 2})
+        experiment.alternatives[0].increment_participation()
+        experiment.alternatives[0].increment_completion()
+        experiment.alternatives[1].increment_participation(sample_rate=0.5)
+        experiment.increment_version()
+        experiment.winner = 'blue'
+        return experiment
+
+    def assert_migrated(self, compact):
+        experiment, = Experiment.find_many(self.redis, ['link_color'])
+        assert experiment.compact == compact
+        assert experiment.version == 1
+        assert experiment.winner.name == 'blue'
+        assert experiment.weights == {'blue': 1, 'red': 2}
+        assert experiment.start_time is not None
+        assert experiment.alternatives[0].participant_count == 1
+        assert experiment.alternatives[0].completed_count == 1
+        assert experiment.alternatives[1].participant_count == 2
+        assert experiment.alternatives[1].participant_count_error == 3
+        return experiment
+
+    def test_migrates_to_the_compact_layout(self):
+        self.make_experiment()
+        assert migrate_experiment(self.redis, 'link_color')
+        assert self.redis.keys('link_color*') == ['link_color:experiment']
+        assert not self.redis.hexists('experiment_winner', 'link_color')
+        self.assert_migrated(compact=True)
+        assert not migrate_experiment(self.redis, 'link_color')
+
+    def test_migrates_back_to_the_default_layout(self):
+        self.make_experiment(compact=True)
+        assert migrate_experiment(self.redis, 'link_color', compact=False)
+        assert not self.redis.exists('link_color:experiment')
+        self.assert_migrated(compact=False)
+        assert not migrate_experiment(self.redis, 'link_color', False)
+
+    def test_folds_late_increments_into_the_new_layout(self):
+        stale = self.make_experiment()
+        migrate_experiment(self.redis, 'link_color')
+        stale.alternatives[0].increment_participation()
+        assert migrate_experiment(self.redis, 'link_color')
+        assert not self.redis.exists('link_color:blue')
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.alternatives[0].participant_count == 2
+
+        stale = experiment
+        migrate_experiment(self.redis, 'link_color', compact=False)
+        stale.alternatives[0].increment_completion()
+        assert migrate_experiment(self.redis, 'link_color', compact=False)
+        experiment = Experiment.find(self.redis, 'link_color')
+        assert experiment.alternatives[0].completed_count == 2
+        assert not self.redis.exists('link_color:experiment')
+
+    def test_migrates_all_experiments(self):
+        self.make_experiment()
+        Experiment.find_or_create(self.redis, 'link_text', 'a', 'b')
+        assert migrate_experiments(self.redis) == 2
+        assert migrate_experiments(self.redis) == 0
+        assert migrate_experiments(self.redis, compact=False) == 2
+
+    def test_migrate_command(self):
+        self.make_experiment()
+        result = self.app.test_cli_runner().invoke(
+            cli, ['migrate', '--to', 'compact', '--settle', '0'])
+        assert 'Migrated 1 experiment(s) to the compact layout.' in \
+            result.output
+        self.assert_migrated(compact=True)
+
+    def test_memory_report(self):
+        self.make_experiment()
+        Experiment.find_or_create(self.redis, 'link_text', 'a', 'b', 'c')
+        keys = set(self.redis.keys('*'))
+        report = memory_report(self.redis)
+        assert set(self.redis.keys('*')) == keys
+        assert report['experiments'] == 2
+        assert report['keys']['keys'] == 12
+        assert report['compact']['keys'] == 2
+        assert report['compact']['bytes'] < report['keys']['bytes']
+
+    def test_memory_command(self):
+        self.make_experiment()
+        result = self.app.test_cli_runner().invoke(cli, ['memory'])
+        assert 'Measured 1 experiment(s).' in result.output
+        assert 'The compact layout uses' in result.output
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+
+from flexmock import flexmock
+from redis import ConnectionError, Redis
+
+from flask_split import (
+    ab_test,
+    finished,
+    preload_experiments,
+    register_experiment,
+    tracing
+)
+from flask_split.models import Experiment
+from flask_split.utils import _get_redis_connection
+
+from . import TestCase
+
+
+class FakeSpan(object):
+    def __init__(self, name):
+        self.name = name
+        self.attributes = {}
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class FakeTracer(object):
+    def __init__(self):
+        self.spans = []
+
+    @contextmanager
+    def start_as_current_span(self, name):
+        span = FakeSpan(name)
+        self.spans.append(span)
+        yield span
+
+    def find(self, name):
+        return [span for span in self.spans if span.name == name]
+
+
+class TestTracing(TestCase):
+    def setup_method(self, method):
+        super(TestTracing, self).setup_method(method)
+        self.tracer = FakeTracer()
+        flexmock(tracing).should_receive('get_tracer').and_return(
+            self.tracer)
+        self.app.extensions['split']['connections'] = {}
+        self.redis = _get_redis_connection()
+
+    def test_does_nothing_without_opentelemetry(self):
+        flexmock(tracing).should_receive('get_tracer').and_return(None)
+        self.app.extensions['split']['connections'] = {}
+        assert type(_get_redis_connection()) is Redis
+        assert ab_test('link_color', 'blue', 'red') in ('blue', 'red')
+        assert self.tracer.spans == []
+
+    def test_traces_ab_test(self):
+        ab_test('link_color', 'blue', 'red')
+        span, = self.tracer.find('split.ab_test')
+        assert span.attributes['split.experiment'] == 'link_color'
+        assert span.attributes['split.cache_hit'] is False
+        assert 'split.failover' not in span.attributes
+        find_or_create, = self.tracer.find('split.find_or_create')
+        assert find_or_create.attributes['split.experiment'] == 'link_color'
+        pipelines = self.tracer.find('split.redis.pipeline')
+        assert pipelines
+        assert span.attributes['split.round_trips'] >= \
+            find_or_create.attributes['split.round_trips'] + 1
+
+    def test_traces_experiment_names_passed_by_keyword(self):
+        finished(experiment_name='link_color')
+        span, = self.tracer.find('split.finished')
+        assert span.attributes['split.experiment'] == 'link_color'
+
+    def test_registered_experiments_hit_the_cache(self):
+        self.app.config['SPLIT_CACHE_TTL'] = 60
+        register_experiment('link_color', 'blue', 'red')
+        preload_experiments()
+        ab_test('link_color')
+        self.tracer.spans = []
+        ab_test('link_color')
+        span, = self.tracer.spans
+        assert span.attributes['split.cache_hit'] is True
+        assert span.attributes['split.round_trips'] == 0
+
+    def test_traces_scripts(self):
+        experiment = Experiment.find_or_create(
+            self.redis, 'link_color', 'blue', 'red')
+        experiment.control.increment_segments(
+            'participant_count', 1, {'device': 'mobile'}, 20)
+        self.tracer.spans = []
+        experiment.control.increment_segments(
+            'participant_count', 1, {'device': 'mobile'}, 20)
+        script, = self.tracer.find('split.redis.script')
+        assert script.attributes['split.round_trips'] == 1
+
+    def test_traces_failover(self):
+        self.app.config['SPLIT_DB_FAILOVER'] = True
+        (flexmock(Redis)
+            .should_receive('execute_command')
+            .and_raise(ConnectionError))
+        finished('link_color')
+        span, = self.tracer.find('split.finished')
+        assert span.attributes['split.failover'] is True